@@ -1,47 +1,496 @@
-import os
-import time
 import json
-import hashlib
-from typing import Any, Dict, Optional, List, Tuple
+import math
+import re
+import time
+import asyncio
+import logging
+import contextlib
+from contextlib import asynccontextmanager
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional, List, Tuple, Union
 
 from fastapi import FastAPI, Request, HTTPException
-from pydantic import BaseModel
-from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ConfigDict
+import httpx
+
+import fastjson
+import metrics
+import tracing
+from jsonstream import ArrayStreamParser, JSONStreamError, NotAnArrayError
+from coalesce import Coalescer
+from coordination import Coordinator
+from event_queue import EventQueue, QueuedEvent
+from failed_events import FailedEventStore, Replayer
+from idempotency import create_idempotency_store
+from mapping import lazy_mapper, load_mapper
+from rd_client import CircuitBreaker, CircuitOpenError, NegativeCache, RDClient, create_http_client
+from settings import Settings, SettingsError
+from state_cache import PersistentLRUCache
+from tenants import Tenant, TenantConfig, TenantRegistry, load_tenants
+
+logger = logging.getLogger(__name__)
 
-from rd_client import RDClient
 
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # configuração completa (com .env) e recursos com I/O só no startup
+    configure(Settings.from_env(dotenv=True))
+    await _start_rd()
+    if _COORDINATOR is not None:
+        # entra na divisão das partições antes de os workers da fila começarem
+        await _COORDINATOR.aheartbeat()
+    workers = [asyncio.create_task(_queue_worker(_QUEUE)) for _ in range(EVENT_QUEUE_WORKERS)] if _QUEUE else []
+    if _TENANTS is not None:
+        workers.append(asyncio.create_task(_evict_idle_tenants(_TENANTS)))
+    if _COORDINATOR is not None:
+        workers.append(asyncio.create_task(_coordination_heartbeat(_COORDINATOR)))
+    try:
+        yield
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await _close_rd()
+        await _CONTACT_STATE.aflush()
+        await _WATERMARKS.aflush()
+        _IDEMPOTENCY.close()
+        if _QUEUE:
+            _QUEUE.close()
+        if _COORDINATOR is not None:
+            await asyncio.to_thread(_COORDINATOR.close)
+
 
-app = FastAPI(title="Mercos → RD Station Webhook")
+app = FastAPI(title="Mercos → RD Station Webhook", lifespan=lifespan)
 
 # -----------------------------
 # RD Station client (OAuth2)
 # -----------------------------
-rd = RDClient(
-    client_id=os.environ["RD_CLIENT_ID"],
-    client_secret=os.environ["RD_CLIENT_SECRET"],
-    refresh_token=os.environ["RD_REFRESH_TOKEN"],
-)
+# Criado no startup (ou no primeiro uso, sem lifespan) e fechado no shutdown
+rd: Optional[RDClient] = None
+
+# Tenants (TENANTS_PATH): um RDClient por tenant, criado no primeiro evento e
+# fechado quando fica ocioso; todos usam o mesmo pool HTTP (_TENANT_HTTP)
+_TENANTS: Optional[TenantRegistry] = None
+_TENANT_HTTP: Optional[httpx.AsyncClient] = None
+
+
+def _create_rd(settings: Settings, tenant: Optional[TenantConfig] = None, http_client=None) -> RDClient:
+    if tenant is None:
+        client_id, client_secret, refresh_token = settings.rd_credentials()
+        contacts_rate, tags_rate = settings.rd_rate_limit_contacts, settings.rd_rate_limit_tags
+    else:
+        client_id, client_secret, refresh_token = tenant.rd_client_id, tenant.rd_client_secret, tenant.rd_refresh_token
+        contacts_rate = settings.rd_rate_limit_contacts if tenant.rate_limit_contacts is None else tenant.rate_limit_contacts
+        tags_rate = settings.rd_rate_limit_tags if tenant.rate_limit_tags is None else tenant.rate_limit_tags
+    return RDClient(
+        client_id=client_id,
+        client_secret=client_secret,
+        refresh_token=refresh_token,
+        # limites em requisições/s por família de endpoint (0 = sem limite no cliente);
+        # com tenants, cada um tem o próprio orçamento; com COORDINATION_PATH, o limite
+        # é de todos os processos juntos
+        rate_limits={"contacts": contacts_rate, "tag": tags_rate},
+        rate_limiter_factory=_shared_limiter_factory(tenant.name if tenant is not None else None),
+        # pool HTTP: dimensione max_connections para a concorrência do lote
+        max_connections=settings.rd_http_max_connections,
+        max_keepalive_connections=settings.rd_http_max_keepalive,
+        keepalive_expiry=settings.rd_http_keepalive_expiry,
+        http2=settings.rd_http2,
+        # disjuntor: com o RD fora, falha rápido em vez de segurar conexões em backoff
+        circuit_breaker=CircuitBreaker(
+            failure_ratio=settings.rd_circuit_failure_ratio,
+            min_requests=settings.rd_circuit_min_requests,
+            window_seconds=settings.rd_circuit_window_seconds,
+            open_seconds=settings.rd_circuit_open_seconds,
+        )
+        if settings.rd_circuit_failure_ratio > 0
+        else None,
+        # recusas definitivas (400/422) do mesmo e-mail + payload falham na hora
+        negative_cache=NegativeCache(settings.rd_negative_cache_ttl, max_entries=settings.rd_negative_cache_max_entries)
+        if settings.rd_negative_cache_ttl > 0
+        else None,
+        http_client=http_client,
+    )
+
+
+def _shared_limiter_factory(tenant: Optional[str]):
+    coordinator = _COORDINATOR
+    if coordinator is None:
+        return None
+    return lambda family, rate: coordinator.bucket(f"{tenant}:{family}" if tenant else family, rate)
+
+
+def _create_tenant_rd(config: TenantConfig) -> RDClient:
+    global _TENANT_HTTP
+    if _TENANT_HTTP is None:
+        _TENANT_HTTP = create_http_client(
+            limits=httpx.Limits(
+                max_connections=SETTINGS.rd_http_max_connections,
+                max_keepalive_connections=SETTINGS.rd_http_max_keepalive,
+                keepalive_expiry=SETTINGS.rd_http_keepalive_expiry,
+            ),
+            http2=SETTINGS.rd_http2,
+        )
+    client = _create_rd(SETTINGS, config, _TENANT_HTTP)
+    client.start_token_refresher()
+    return client
+
+
+def _tenant_named(name: Optional[str]) -> Optional[Tenant]:
+    """Tenant pelo nome gravado na fila/registro de falhas; None = configuração principal."""
+    if name is None:
+        return None
+    tenant = _TENANTS.get(name) if _TENANTS is not None else None
+    if tenant is None:
+        raise KeyError(f"tenant desconhecido: {name}")
+    return tenant
+
+
+async def _coordination_heartbeat(coordinator: Coordinator) -> None:
+    # renova leases/locks deste processo e rebalanceia as partições da fila
+    while True:
+        await asyncio.sleep(coordinator.lease_seconds / 3)
+        try:
+            await coordinator.aheartbeat()
+        except Exception as e:
+            logger.warning("heartbeat da coordenação falhou: %r", e)
+
+
+async def _evict_idle_tenants(registry: TenantRegistry) -> None:
+    while True:
+        await asyncio.sleep(max(1.0, registry.idle_seconds / 2))
+        try:
+            await registry.evict_idle()
+        except Exception as e:
+            logger.warning("falha ao fechar clientes ociosos de tenants: %r", e)
+
+
+def get_rd() -> RDClient:
+    """Cliente do RD; criado na primeira chamada (SettingsError se faltar credencial)."""
+    global rd
+    if rd is None:
+        rd = _create_rd(SETTINGS)
+    return rd
+
+
+async def _start_rd() -> None:
+    if _TENANTS is not None and not SETTINGS.has_rd_credentials():
+        # só tenants: não há cliente principal (os dos tenants são criados sob demanda)
+        return
+    client = get_rd()
+    # pré-aquece pool e token: a primeira requisição não paga o refresh
+    if SETTINGS.rd_token_prewarm_timeout > 0:
+        try:
+            await asyncio.wait_for(client.warm_up(), SETTINGS.rd_token_prewarm_timeout)
+        except Exception as e:
+            # RD fora no startup não impede o serviço de subir: o token é renovado sob demanda
+            logger.warning("pré-aquecimento do token do RD falhou: %r", e)
+    # renova o token do RD em background, antes de expirar
+    client.start_token_refresher()
+
+
+async def _close_rd() -> None:
+    global rd, _TENANT_HTTP
+    if rd is not None:
+        client, rd = rd, None
+        await client.aclose()
+    if _TENANTS is not None:
+        await _TENANTS.aclose()
+    if _TENANT_HTTP is not None:
+        http, _TENANT_HTTP = _TENANT_HTTP, None
+        await http.aclose()
+
+
+# -----------------------------
+# Configurações
+# -----------------------------
+def configure(settings: Settings, *, open_stores: bool = True) -> None:
+    """
+    Aplica `settings` nos globais do módulo.
+
+    No import roda só com o ambiente do processo e open_stores=False: stores
+    em memória, sem fila e sem arquivo de estado, então importar o app não
+    abre arquivos nem conexões. O lifespan chama de novo no startup, com o
+    .env carregado e os stores configurados.
+    """
+    global SETTINGS, MERCOS_URL_TOKEN, DEFAULT_TAGS, _IDEMPOTENCY, WEBHOOK_CONCURRENCY
+    global WEBHOOK_MAX_EVENT_BYTES, WEBHOOK_MAX_PENDING, _COALESCER, _CONTACT_STATE, _WATERMARKS, _MAPPER
+    global EVENT_QUEUE_WORKERS, EVENT_QUEUE_BATCH_SIZE, EVENT_QUEUE_POLL_SECONDS, _QUEUE, _FAILED
+    global TRACE_MODE, _TRACE_HEADER, _TRACE_LOG, _PROFILER, _TENANTS, _COORDINATOR, _CONTACT_STATE_SKIP
+    # valida os tenants antes de mexer em qualquer global: configuração inválida não deixa o app pela metade
+    tenant_configs = load_tenants(settings.tenants_path) if settings.tenants_path and open_stores else None
+    if tenant_configs is not None:
+        _check_tenants_admin_token(settings, tenant_configs)
+    contact_state_skip = _contact_state_skip(settings)
+    SETTINGS = settings
+
+    # Token compartilhado recebido via query string: ?token=SEU_SEGREDO
+    MERCOS_URL_TOKEN = settings.mercos_webhook_token
+
+    # Tags padrão a aplicar em todos os eventos "não-excluidos"
+    DEFAULT_TAGS = list(settings.rd_default_tags)
+
+    # Idempotência por evento: "memory" (por processo) ou "sqlite" (arquivo
+    # compartilhado entre workers do mesmo host, sobrevive a restart)
+    _IDEMPOTENCY = create_idempotency_store(
+        settings.idempotency_backend if open_stores else "memory",
+        settings.idempotency_ttl_seconds,
+        settings.idempotency_max_keys,
+        path=settings.idempotency_db_path,
+    )
+
+    # Processamento do lote: máximo de eventos em andamento ao mesmo tempo
+    WEBHOOK_CONCURRENCY = settings.webhook_concurrency
+
+    # Corpo lido em streaming: tamanho máximo de um evento e quantos eventos podem
+    # ficar pendentes antes de parar de ler o corpo (contrapressão)
+    WEBHOOK_MAX_EVENT_BYTES = settings.webhook_max_event_bytes
+    WEBHOOK_MAX_PENDING = settings.webhook_max_pending
+
+    # Fusão de atualizações por contato: upserts do mesmo e-mail que chegam dentro
+    # da janela (e os do mesmo lote) viram um único PATCH + tag com o estado final
+    _COALESCER = Coalescer(settings.coalesce_window_seconds)
+
+    # Último estado enviado ao RD por e-mail (hash do payload + tags já aplicadas):
+    # eventos que não mudam nada do que mapeamos terminam como "unchanged", sem PATCH.
+    # O cache é do processo: com vários processos fica desligado (ver _contact_state_skip)
+    _CONTACT_STATE_SKIP = contact_state_skip
+    _CONTACT_STATE = PersistentLRUCache(
+        settings.contact_state_max_entries,
+        settings.contact_state_path if open_stores else None,
+        flush_interval=settings.contact_state_flush_seconds,
+    )
+
+    # Ordem dos eventos por contato (chave = id do Mercos, ou e-mail): maior
+    # `ultima_alteracao` já aplicada ou em andamento; evento mais antigo → "stale"
+    _WATERMARKS = PersistentLRUCache(
+        settings.event_watermark_max_entries,
+        settings.event_watermark_path if open_stores else None,
+        flush_interval=settings.contact_state_flush_seconds,
+    )
+
+    # Mapeamento Mercos → RD: especificação declarativa compilada uma vez
+    # (no import a especificação só é lida no primeiro evento: importar não abre arquivos;
+    # no startup é compilada na hora, e um mapping.json inválido derruba o startup)
+    _MAPPER = load_mapper(settings.mapping_spec_path) if open_stores else lazy_mapper(settings.mapping_spec_path)
+
+    # Fila durável (opcional): com EVENT_QUEUE_PATH definido o webhook só valida,
+    # grava os eventos em SQLite e responde 202; workers em background drenam a fila.
+    EVENT_QUEUE_WORKERS = settings.event_queue_workers
+    EVENT_QUEUE_BATCH_SIZE = settings.event_queue_batch_size
+    EVENT_QUEUE_POLL_SECONDS = settings.event_queue_poll_seconds
+    _QUEUE = (
+        EventQueue(
+            settings.event_queue_path,
+            max_retries=settings.event_queue_max_retries,
+            retry_backoff=settings.event_queue_retry_backoff_seconds,
+        )
+        if settings.event_queue_path and open_stores
+        else None
+    )
+
+    # Eventos do webhook que terminaram em erro (NDJSON), para replay depois de
+    # um incidente no RD: POST /admin/failed-events/replay ou failed_events.py
+    _FAILED = FailedEventStore(settings.failed_events_path) if settings.failed_events_path and open_stores else None
+
+    # Coordenação entre processos (vários workers/réplicas no mesmo host): partições
+    # da fila por hash do e-mail, lock por contato e limite de taxa do RD compartilhados
+    _COORDINATOR = (
+        Coordinator(
+            settings.coordination_path,
+            partitions=settings.coordination_partitions,
+            lease_seconds=settings.coordination_lease_seconds,
+        )
+        if settings.coordination_path and open_stores
+        else None
+    )
+
+    # Vários tenants (conta Mercos → conta RD) no mesmo processo, escolhidos pelo ?token=
+    _TENANTS = (
+        TenantRegistry(
+            tenant_configs,
+            _create_tenant_rd,
+            idle_seconds=settings.tenant_idle_seconds,
+            max_in_flight=settings.tenant_max_in_flight,
+        )
+        if tenant_configs is not None
+        else None
+    )
+
+    # Detalhamento de tempo por requisição: "header" (Server-Timing), "log"
+    # (linha JSON no logger), "both" ou "off"
+    TRACE_MODE = settings.trace_mode
+    _TRACE_HEADER = TRACE_MODE in ("header", "both")
+    _TRACE_LOG = TRACE_MODE in ("log", "both")
+
+    # Profiling amostrado: ligado em runtime via POST /admin/profiling
+    _PROFILER = tracing.SamplingProfiler(settings.profile_dir, max_files=settings.profile_max_files)
+    _PROFILER.configure(settings.profile_sample_rate)
+
+
+def _contact_state_skip(settings: Settings) -> bool:
+    """
+    Liga o "unchanged" só quando um processo vê todos os eventos do contato.
+    Com vários processos cada um guarda o que ele mesmo enviou: o worker 1
+    envia A, o 2 envia B e a volta para A, no worker 1, seria pulada com o
+    RD ainda em B.
+    """
+    mode = settings.contact_state_skip
+    if mode not in ("auto", "on", "off"):
+        raise SettingsError(f"CONTACT_STATE_SKIP: esperado auto, on ou off, recebido {mode!r}")
+    if mode == "auto":
+        return (
+            settings.coordination_path is None
+            and settings.web_concurrency <= 1
+            and settings.idempotency_backend == "memory"
+        )
+    return mode == "on"
+
+
+def _check_tenants_admin_token(settings: Settings, configs: List[TenantConfig]) -> None:
+    """
+    Com tenants, MERCOS_WEBHOOK_TOKEN é o token dos endpoints de administração:
+    sem ele (modo só-tenants) /stats, /admin/* e o replay ficariam abertos.
+    """
+    if not settings.mercos_webhook_token:
+        raise SettingsError("TENANTS_PATH exige MERCOS_WEBHOOK_TOKEN (token dos endpoints de administração)")
+    if any(c.webhook_token == settings.mercos_webhook_token for c in configs):
+        raise SettingsError("TENANTS_PATH: webhook_token de tenant igual ao MERCOS_WEBHOOK_TOKEN")
+
+
+SETTINGS: Settings
+MERCOS_URL_TOKEN: Optional[str]
+DEFAULT_TAGS: List[str]
+WEBHOOK_CONCURRENCY: int
+WEBHOOK_MAX_EVENT_BYTES: int
+WEBHOOK_MAX_PENDING: int
+EVENT_QUEUE_WORKERS: int
+EVENT_QUEUE_BATCH_SIZE: int
+EVENT_QUEUE_POLL_SECONDS: float
+_QUEUE: Optional[EventQueue]
+_FAILED: Optional[FailedEventStore]
+_COORDINATOR: Optional[Coordinator]
+TRACE_MODE: str
+_CONTACT_STATE_SKIP: bool
+configure(Settings.from_env(), open_stores=False)
+
+_UNCHANGED = object()
+_CONTACT_STATE_SKIPS = 0
+_REPLAY: Optional[Replayer] = None
+
+UPSERT_EVENTS = ("cliente.cadastrado", "cliente.atualizado", "cliente.bloqueioatualizado")
+# Não há delete oficial no RD: cliente.excluido vira esta tag
+EXCLUIDO_TAGS = ["excluido_no_mercos"]
+
 
 # -----------------------------
-# Configurações / Segurança
+# Métricas (GET /metrics, formato Prometheus)
 # -----------------------------
-# Token compartilhado recebido via query string: ?token=SEU_SEGREDO
-MERCOS_URL_TOKEN = os.getenv("MERCOS_WEBHOOK_TOKEN")
+_KNOWN_EVENTS = frozenset((*UPSERT_EVENTS, "cliente.excluido"))
+_EVENTS_TOTAL = metrics.REGISTRY.counter(
+    "mercos_webhook_events_total", "Eventos processados por tipo e resultado", ("evento", "status")
+)
+_REQUEST_SECONDS = metrics.REGISTRY.histogram("mercos_webhook_request_seconds", "Duração do POST do webhook")
+_MAPPING_SECONDS = metrics.REGISTRY.histogram(
+    "mercos_mapping_seconds",
+    "Duração do mapeamento Mercos → RD por evento",
+    buckets=(0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.001, 0.01),
+)
+_IDEMPOTENCY_LOOKUPS = metrics.REGISTRY.counter(
+    "idempotency_lookups_total", "Consultas ao cache de idempotência (hit = evento duplicado)", ("result",)
+)
+_IDEMPOTENCY_HITS = _IDEMPOTENCY_LOOKUPS.labels("hit")
+_IDEMPOTENCY_MISSES = _IDEMPOTENCY_LOOKUPS.labels("miss")
+
+
+def _count_results(results: List[Dict[str, Any]]) -> None:
+    for result in results:
+        evento = result.get("evento")
+        # tipos desconhecidos agrupados: o label não pode crescer com o que o cliente envia
+        _EVENTS_TOTAL.labels(evento if evento in _KNOWN_EVENTS else "outro", result.get("status", "error")).inc()
+
+
+def _collect_metrics():
+    """Valores mantidos pelos próprios componentes, lidos só no scrape."""
+    yield metrics.gauge("idempotency_keys", "Chaves no cache de idempotência", len(_IDEMPOTENCY))
+    yield metrics.gauge("contact_state_entries", "Contatos no cache de estado", len(_CONTACT_STATE))
+    yield "contact_state_unchanged_total", "counter", "Eventos sem mudança (RD não chamado)", [({}, _CONTACT_STATE_SKIPS)]
+    yield metrics.gauge("event_watermark_entries", "Contatos com ultima_alteracao registrada", len(_WATERMARKS))
+    coalescing = _COALESCER.stats()
+    yield "coalesce_merged_total", "counter", "Upserts fundidos em outro envio", [({}, coalescing["coalesced"])]
+    if _FAILED is not None:
+        yield metrics.gauge("failed_events_pending", "Eventos com erro aguardando replay", len(_FAILED))
+    yield from _collect_rd_metrics(_rd_clients())
+    if _COORDINATOR is not None:
+        coordination = _COORDINATOR.stats()
+        yield metrics.gauge("coordination_workers", "Processos vivos na coordenação", coordination["workers"])
+        yield metrics.gauge("coordination_partitions_owned", "Partições da fila deste processo", coordination["owned"])
+        yield (
+            "coordination_lock_wait_seconds_total",
+            "counter",
+            "Espera por lock de contato segurado por outro processo",
+            [({}, coordination["lock_wait_seconds"])],
+        )
+    if _TENANTS is not None:
+        tenants = _TENANTS.stats()
+        yield metrics.gauge("tenant_rd_clients", "Clientes do RD abertos (tenants com uso recente)", tenants["active_clients"])
+        yield "tenant_rd_clients_evicted_total", "counter", "Clientes de tenants fechados por ociosidade", [({}, tenants["evicted"])]
+    if _QUEUE:
+        queue = _QUEUE.stats()
+        yield metrics.gauge("event_queue_depth", "Eventos na fila durável", queue["depth"])
+        yield metrics.gauge("event_queue_lag_seconds", "Idade do evento mais antigo na fila", queue["lag_seconds"])
+        yield metrics.gauge("event_queue_dead_letter", "Eventos em dead-letter", queue["dead_letter"])
+
+
+def _rd_clients() -> List[Tuple[Optional[str], RDClient]]:
+    """Clientes do RD abertos: o principal (tenant None) e os dos tenants em uso."""
+    clients: List[Tuple[Optional[str], RDClient]] = [(None, rd)] if rd is not None else []
+    if _TENANTS is not None:
+        clients.extend((t.name, t.client) for t in _TENANTS if t.client is not None)
+    return clients
 
-# Tags padrão a aplicar em todos os eventos "não-excluidos"
-DEFAULT_TAGS = [t.strip() for t in os.getenv("RD_DEFAULT_TAGS", "").split(",") if t.strip()]
 
-# Idempotência por evento (em memória)
-IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))  # 1 hora
-IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
-_IDEMPOTENCY_CACHE: Dict[str, float] = {}
+def _collect_rd_metrics(clients: List[Tuple[Optional[str], RDClient]]):
+    """Cada métrica sai uma vez, com uma amostra por cliente; as dos tenants levam o label tenant."""
+    refreshes, waits, circuit_open, opened, rejected, negative, connections = [], [], [], [], [], [], []
+    for tenant, client in clients:
+        labels = {"tenant": tenant} if tenant is not None else {}
+        refreshes.append((labels, client.token_refreshes))
+        for family, st in client.rate_limit_stats().items():
+            waits.append(({**labels, "family": family}, st["wait_seconds"]))
+        if client.circuit_breaker is not None:
+            circuit = client.circuit_breaker.stats()
+            circuit_open.append((labels, int(circuit["retry_after"] is not None)))
+            opened.append((labels, circuit["opened"]))
+            rejected.append((labels, circuit["rejected"]))
+        if client.negative_cache is not None:
+            negative.append((labels, len(client.negative_cache)))
+        connections.append((labels, client.pool_stats()["new_connections"]))
+
+    for name, kind, help_text, samples in (
+        ("rd_client_token_refreshes_total", "counter", "Renovações do access_token do RD", refreshes),
+        ("rd_client_rate_limit_wait_seconds_total", "counter", "Espera no limitador de taxa do cliente", waits),
+        ("rd_client_circuit_open", "gauge", "1 se o circuito do RD está aberto", circuit_open),
+        ("rd_client_circuit_opened_total", "counter", "Vezes que o circuito abriu", opened),
+        ("rd_client_circuit_rejected_total", "counter", "Chamadas recusadas com o circuito aberto", rejected),
+        ("rd_client_negative_cache_entries", "gauge", "Recusas do RD em cache", negative),
+        ("rd_client_connections_created_total", "counter", "Conexões novas abertas com o RD", connections),
+    ):
+        if samples:
+            yield name, kind, help_text, samples
+
+
+metrics.REGISTRY.add_collector(_collect_metrics)
 
 
 # -----------------------------
 # Modelos / Helpers
 # -----------------------------
 class MercosCliente(BaseModel):
+    # o webhook mapeia direto do dict: o schema só é montado no primeiro uso (import mais rápido)
+    model_config = ConfigDict(defer_build=True)
+
     # Campos mais comuns no "dados" do payload do Mercos
     id: Optional[int] = None
     razao_social: Optional[str] = None
@@ -67,13 +516,7 @@ class MercosCliente(BaseModel):
         Seleciona o primeiro e-mail válido.
         Estrutura esperada: emails = [{ "email": "x@y.com", "tipo": "T", "id": 4 }, ...]
         """
-        if not self.emails:
-            return None
-        for e in self.emails:
-            val = (e or {}).get("email")
-            if val:
-                return val
-        return None
+        return _first_email(self.emails)
 
     def principal_telefone(self) -> Optional[str]:
         """
@@ -92,85 +535,153 @@ class MercosCliente(BaseModel):
         return None
 
 
-def map_mercos_to_rd(mercos: MercosCliente) -> Dict[str, Any]:
+def _first_email(emails: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+    if not emails:
+        return None
+    for e in emails:
+        val = (e or {}).get("email")
+        if val:
+            return val
+    return None
+
+
+def map_mercos_to_rd(mercos: Union[MercosCliente, Dict[str, Any]]) -> Dict[str, Any]:
     """
     Mapeia 'dados' do Mercos → payload do RD Station (contacts).
+    As regras ficam em mapping.json (ou MAPPING_SPEC_PATH), compiladas em _MAPPER.
     Campos nativos: name, personal_phone, city, state, country, etc.
     Campos extras: custom_fields (precisam existir no RD com esses 'keys').
     """
-    body: Dict[str, Any] = {}
-
-    # Nome: usamos a razão social como name principal
-    if mercos.razao_social:
-        body["name"] = mercos.razao_social
-
-    # Telefone
-    tel = mercos.principal_telefone()
-    if tel:
-        body["personal_phone"] = tel
-
-    # Localidade
-    if mercos.cidade:
-        body["city"] = mercos.cidade
-    if mercos.estado:
-        body["state"] = mercos.estado
-    if mercos.pais:
-        body["country"] = mercos.pais
-
-    # Campos customizados
-    custom_fields: Dict[str, Any] = {}
-    if mercos.cnpj:
-        custom_fields["cnpj"] = mercos.cnpj
-    if mercos.nome_fantasia:
-        custom_fields["nome_fantasia"] = mercos.nome_fantasia
-
-    # Endereço (opcional, caso queira salvar em custom_fields)
-    if mercos.cep:
-        custom_fields["cep"] = mercos.cep
-    if mercos.rua:
-        custom_fields["rua"] = mercos.rua
-    if mercos.bairro:
-        custom_fields["bairro"] = mercos.bairro
-    if mercos.numero:
-        custom_fields["numero"] = mercos.numero
-    if mercos.complemento:
-        custom_fields["complemento"] = mercos.complemento
-
-    if custom_fields:
-        body["custom_fields"] = custom_fields
-
-    return body
-
-
-def _clean_idempotency_cache(now: float) -> None:
+    if isinstance(mercos, MercosCliente):
+        return _MAPPER(mercos.model_dump())
+    return _MAPPER(mercos)
+
+
+async def _clean_idempotency_cache(now: float) -> None:
     """Remove entradas antigas e limita o tamanho do cache."""
-    if not _IDEMPOTENCY_CACHE:
-        return
-    # TTL
-    expired = [k for k, ts in _IDEMPOTENCY_CACHE.items() if now - ts > IDEMPOTENCY_TTL_SECONDS]
-    for k in expired:
-        _IDEMPOTENCY_CACHE.pop(k, None)
-    # Limita tamanho (remove mais antigos primeiro)
-    if len(_IDEMPOTENCY_CACHE) > IDEMPOTENCY_MAX_KEYS:
-        overflow = len(_IDEMPOTENCY_CACHE) - IDEMPOTENCY_MAX_KEYS
-        for k, _ in sorted(_IDEMPOTENCY_CACHE.items(), key=lambda kv: kv[1])[:overflow]:
-            _IDEMPOTENCY_CACHE.pop(k, None)
-
-
-def _idempotency_key_for_event(event_item: Dict[str, Any]) -> str:
+    await _IDEMPOTENCY.aexpire(now)
+
+
+def _idempotency_key_for_event(event_item: Dict[str, Any], tenant: Optional[Tenant] = None) -> str:
     """Gera uma chave idempotente (sha256) para um item do array de eventos."""
     # Usa dump estável (chaves ordenadas) para mesmo evento gerar a mesma assinatura
-    serialized = json.dumps(event_item, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
-    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+    digest = fastjson.canonical_digest(event_item)
+    # o mesmo evento em dois tenants são dois eventos
+    return digest if tenant is None else tenant.scoped(digest)
+
+
+def _scoped(tenant: Optional[Tenant], key: str) -> str:
+    """Chave por contato (estado, ordem, fusão) no namespace do tenant; sem tenant, a própria chave."""
+    return key if tenant is None else tenant.scoped(key)
 
 
-def _mark_processed(key: str) -> None:
-    _IDEMPOTENCY_CACHE[key] = time.time()
-    _clean_idempotency_cache(_IDEMPOTENCY_CACHE[key])
+async def _unmark_processed(key: str) -> None:
+    await _IDEMPOTENCY.aunmark(key)
 
 
-def _unmark_processed(key: str) -> None:
-    _IDEMPOTENCY_CACHE.pop(key, None)
+async def _unmarked(key: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Libera a chave (sem travar o event loop) e devolve o resultado."""
+    await _unmark_processed(key)
+    return result
+
+
+def _payload_hash(payload: Dict[str, Any]) -> str:
+    return fastjson.canonical_digest(payload)
+
+
+def _is_unchanged(email: str, payload_hash: str, tags: List[str]) -> bool:
+    """Mesmo payload já enviado e todas as tags já aplicadas (tags no RD são cumulativas)."""
+    state = _CONTACT_STATE.get(email)
+    return state is not None and state[0] == payload_hash and set(tags) <= set(state[1])
+
+
+def _remember_state(email: str, payload_hash: str, tags: List[str]) -> None:
+    state = _CONTACT_STATE.get(email)
+    known_tags = state[1] if state is not None and state[0] == payload_hash else []
+    _CONTACT_STATE.set(email, [payload_hash, sorted(set(known_tags) | set(tags))])
+
+
+# checagem barata (não é RFC 5322): barra lixo antes de gastar uma chamada ao RD
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def _event_email(item: Any) -> Optional[str]:
+    """E-mail principal lido direto do item bruto (sem validar o modelo)."""
+    dados = item.get("dados") if isinstance(item, dict) else None
+    emails = dados.get("emails") if isinstance(dados, dict) else None
+    if not isinstance(emails, list):
+        return None
+    return _first_email([e for e in emails if isinstance(e, dict)])
+
+
+def _event_version(dados: Dict[str, Any]) -> Optional[str]:
+    """
+    `ultima_alteracao` normalizada ("AAAA-MM-DD HH:MM:SS"), comparável como
+    texto; None se ausente ou fora do formato (o evento passa sem o guarda).
+    """
+    value = dados.get("ultima_alteracao")
+    if not isinstance(value, str) or len(value) < 19 or value[4] != "-" or value[7] != "-":
+        return None
+    return f"{value[:10]} {value[11:]}"  # aceita também o "T" do ISO 8601
+
+
+def _watermark_key(dados: Dict[str, Any], email: str) -> str:
+    # id do Mercos sobrevive à troca de e-mail; sem id, o e-mail
+    mercos_id = dados.get("id")
+    return f"id:{mercos_id}" if mercos_id is not None else f"email:{email}"
+
+
+def _advance_watermark(wkey: str, version: str) -> Tuple[bool, Optional[str]]:
+    """
+    Registra `version` como a mais recente do contato já no despacho
+    (síncrono, na ordem do lote): um evento mais antigo que chegue depois —
+    no mesmo lote ou em outra requisição — vê a marca mesmo com o envio
+    anterior ainda em andamento. Devolve (aceito, marca anterior).
+    """
+    current = _WATERMARKS.get(wkey)
+    if current is not None and version < current:
+        return False, current
+    _WATERMARKS.set(wkey, version)
+    return True, current
+
+
+def _rollback_watermark(mark: Optional[Tuple[str, str, Optional[str]]]) -> None:
+    """Envio falhou: devolve a marca anterior, se nenhum evento mais novo passou na frente."""
+    if mark is None:
+        return
+    wkey, version, previous = mark
+    if _WATERMARKS.get(wkey) == version:
+        if previous is None:
+            _WATERMARKS.pop(wkey)
+        else:
+            _WATERMARKS.set(wkey, previous)
+
+
+def _check_token(token: Optional[str]) -> None:
+    """Validação do token via query string (?token=...)."""
+    if MERCOS_URL_TOKEN:
+        if not token or token != MERCOS_URL_TOKEN:
+            raise HTTPException(status_code=401, detail="Invalid webhook token")
+
+
+def _require_admin_token(token: Optional[str]) -> None:
+    """Como _check_token, mas recusa quando não há token configurado (endpoints que gravam arquivos/gastam CPU)."""
+    if not MERCOS_URL_TOKEN:
+        raise HTTPException(status_code=403, detail="Defina MERCOS_WEBHOOK_TOKEN para usar este endpoint")
+    _check_token(token)
+
+
+def _webhook_tenant(token: Optional[str]) -> Optional[Tenant]:
+    """Tenant do webhook pelo ?token=; None = configuração principal (MERCOS_WEBHOOK_TOKEN)."""
+    if _TENANTS is not None:
+        tenant = _TENANTS.by_token(token) if token else None
+        if tenant is not None:
+            return tenant
+        if not SETTINGS.has_rd_credentials():
+            # só tenants: token que não é de nenhum tenant não tem para onde ir
+            raise HTTPException(status_code=401, detail="Invalid webhook token")
+    _check_token(token)
+    return None
 
 
 # -----------------------------
@@ -181,92 +692,618 @@ def health():
     return {"ok": True}
 
 
+@app.get("/stats")
+def stats(token: Optional[str] = None):
+    _check_token(token)
+    return {
+        "queue": _QUEUE.stats() if _QUEUE else None,
+        "coalescing": _COALESCER.stats(),
+        "contact_state": {
+            "enabled": _CONTACT_STATE_SKIP,
+            "entries": len(_CONTACT_STATE),
+            "unchanged": _CONTACT_STATE_SKIPS,
+        },
+        "watermarks": {"entries": len(_WATERMARKS), "max_entries": _WATERMARKS.max_entries},
+        "failed_events": _FAILED.stats() if _FAILED else None,
+        "tenants": _TENANTS.stats() if _TENANTS is not None else None,
+        "coordination": _COORDINATOR.stats() if _COORDINATOR is not None else None,
+        # None até o cliente do RD ser criado (startup ou primeiro evento)
+        "rd": _rd_stats(rd) if rd is not None else None,
+        # clientes dos tenants em uso (os ociosos já foram fechados)
+        "rd_tenants": {name: _rd_stats(client) for name, client in _rd_clients() if name is not None}
+        if _TENANTS is not None
+        else None,
+    }
+
+
+def _rd_stats(client: RDClient) -> Dict[str, Any]:
+    return {
+        "rate_limits": client.rate_limit_stats(),
+        "pool": client.pool_stats(),
+        "sync": client.sync_stats(),
+        "circuit": client.circuit_breaker.stats() if client.circuit_breaker else None,
+        "negative_cache": client.negative_cache.stats() if client.negative_cache else None,
+    }
+
+
+@app.get("/metrics")
+def metrics_endpoint(token: Optional[str] = None):
+    _check_token(token)
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/admin/profiling")
+def profiling_status(token: Optional[str] = None):
+    _check_token(token)
+    return _PROFILER.stats()
+
+
+@app.post("/admin/profiling")
+def profiling_configure(rate: float, duration: Optional[float] = None, token: Optional[str] = None):
+    """
+    Liga (rate > 0, fração das requisições) ou desliga (rate = 0) o profiling
+    amostrado. Exige o token de administração; os arquivos vão só para PROFILE_DIR.
+    """
+    _require_admin_token(token)
+    _PROFILER.configure(rate, duration)
+    return _PROFILER.stats()
+
+
+@app.get("/admin/rd-rejections")
+def rd_rejections(token: Optional[str] = None, limit: int = 20, tenant: Optional[str] = None):
+    """
+    Recusas do RD em cache (cliente principal e tenants em uso), das mais
+    repetidas: dados a corrigir no Mercos ou custom fields a criar no RD.
+    """
+    _check_token(token)
+    caches = [
+        (name, client.negative_cache)
+        for name, client in _rd_clients()
+        if client.negative_cache is not None and (tenant is None or name == tenant)
+    ]
+    if not caches:
+        # desligado (RD_NEGATIVE_CACHE_TTL=0) ou cliente ainda não criado
+        return {"enabled": SETTINGS.rd_negative_cache_ttl > 0, "offenders": []}
+    offenders = [
+        {**offender, **({"tenant": name} if name is not None else {})}
+        for name, cache in caches
+        for offender in cache.offenders(limit)
+    ]
+    offenders.sort(key=lambda o: o["blocked"], reverse=True)
+    return {
+        "enabled": True,
+        "ttl": caches[0][1].ttl,
+        "entries": sum(len(cache) for _, cache in caches),
+        "hits": sum(cache.hits for _, cache in caches),
+        "added": sum(cache.added for _, cache in caches),
+        "offenders": offenders[:limit],
+    }
+
+
+@app.get("/admin/failed-events")
+def failed_events_status(token: Optional[str] = None, limit: int = 20):
+    _check_token(token)
+    store = _failed_store()
+    return {
+        **store.stats(),
+        "replay": _REPLAY.progress() if _REPLAY else None,
+        "events": [
+            {"key": e.key, "evento": e.item.get("evento"), "error": e.error, "attempts": e.attempts, "failed_at": e.failed_at}
+            for e in store.pending(limit)
+        ],
+    }
+
+
+@app.post("/admin/failed-events/replay")
+async def failed_events_replay(
+    token: Optional[str] = None, rate: float = 5.0, concurrency: int = 5, limit: Optional[int] = None
+):
+    """Reprocessa em background os eventos com erro (um replay por vez); progresso em GET /admin/failed-events."""
+    global _REPLAY
+    _require_admin_token(token)
+    store = _failed_store()
+    if _REPLAY is not None and _REPLAY.running:
+        raise HTTPException(status_code=409, detail="Replay já em andamento")
+    # replay pedido pelo operador = "já corrigi, tente de novo": recusas antigas não bloqueiam
+    for _, client in _rd_clients():
+        if client.negative_cache is not None:
+            client.negative_cache.clear()
+    _REPLAY = Replayer(
+        store,
+        lambda items, tenant=None: _process_events(items, time.time(), _tenant_named(tenant)),
+        rate=rate,
+        concurrency=concurrency,
+    )
+    task = asyncio.ensure_future(_REPLAY.run(limit))
+    task.add_done_callback(_log_replay_result)
+    await asyncio.sleep(0)  # deixa o replay começar (running=True) antes de responder
+    return JSONResponse(status_code=202, content=_REPLAY.progress())
+
+
+def _failed_store() -> FailedEventStore:
+    if _FAILED is None:
+        raise HTTPException(status_code=404, detail="Registro de falhas desabilitado (FAILED_EVENTS_PATH)")
+    return _FAILED
+
+
+def _log_replay_result(task: "asyncio.Task[Dict[str, Any]]") -> None:
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        logger.error("replay de eventos com erro falhou: %r", task.exception())
+    else:
+        logger.info(json.dumps({"replay": task.result()}))
+
+
+@app.get("/queue/dead-letter")
+def queue_dead_letter(token: Optional[str] = None, limit: int = 100):
+    _check_token(token)
+    if not _QUEUE:
+        raise HTTPException(status_code=404, detail="Fila desabilitada (EVENT_QUEUE_PATH)")
+    return {"events": _QUEUE.dead_letters(limit)}
+
+
 # -----------------------------
-# Handler geral de eventos de clientes
+# Processamento de eventos
 # -----------------------------
-@app.post("/webhooks/mercos/clientes")
-async def mercos_clientes(request: Request, token: Optional[str] = None):
-    # 1) Validação do token via query string (?token=...)
-    if MERCOS_URL_TOKEN:
-        if not token or token != MERCOS_URL_TOKEN:
-            raise HTTPException(status_code=401, detail="Invalid webhook token")
+async def _resolved(result: Dict[str, Any]) -> Dict[str, Any]:
+    return result
+
+
+def _error_result(evento: Optional[str], error: Exception) -> Dict[str, Any]:
+    result = {"evento": evento, "status": "error", "error": str(error)}
+    if isinstance(error, CircuitOpenError):
+        # RD fora: o evento nem foi enviado; o chamador deve reenviar depois
+        result["retry_after"] = error.retry_after
+    return result
+
+
+def _circuit_retry_after(tenant: Optional[Tenant] = None) -> Optional[float]:
+    client = rd if tenant is None else tenant.client
+    breaker = client.circuit_breaker if client is not None else None
+    return breaker.retry_after() if breaker is not None else None
+
+
+def _contact_lock(state_key: str):
+    """
+    Lock do contato entre processos (COORDINATION_PATH sem fila). No modo fila
+    não precisa: a fila já entrega um evento por e-mail por vez.
+    """
+    if _COORDINATOR is None or _QUEUE:
+        return contextlib.nullcontext()
+    return _COORDINATOR.contact(state_key)
+
+
+@asynccontextmanager
+async def _rd_lease(tenant: Optional[Tenant]) -> AsyncIterator[RDClient]:
+    """Cliente do RD para um envio: o principal ou o do tenant (com o teto de chamadas do tenant)."""
+    if tenant is None:
+        yield get_rd()
+    else:
+        async with _TENANTS.lease(tenant) as client:  # type: ignore[union-attr]
+            yield client
+
+
+def _retry_after_of(results: List[Dict[str, Any]]) -> Optional[float]:
+    waits = [r["retry_after"] for r in results if "retry_after" in r]
+    return max(waits) if waits else None
 
-    # 2) Ler e validar payload (precisa ser uma lista de eventos)
+
+async def _send_upsert(
+    email: str,
+    semaphore: asyncio.Semaphore,
+    payload: Dict[str, Any],
+    tags: List[str],
+    tenant: Optional[Tenant] = None,
+) -> Any:
+    # Roda em ordem por contato (Coalescer): o cache reflete o último envio com sucesso
+    global _CONTACT_STATE_SKIPS
+    state_key = _scoped(tenant, email)
+    payload_hash = _payload_hash(payload)
+    if _CONTACT_STATE_SKIP and _is_unchanged(state_key, payload_hash, tags):
+        _CONTACT_STATE_SKIPS += 1
+        return _UNCHANGED
+
+    async with semaphore, _contact_lock(state_key), _rd_lease(tenant) as client:
+        # upsert + tags com o mínimo de chamadas (tags no create, sem repetir tags conhecidas);
+        # falha ao taguear não falha o processamento
+        synced = await client.sync_contact(email, payload, tags, payload_hash)
+    if _CONTACT_STATE_SKIP:
+        _remember_state(state_key, payload_hash, tags if synced.tags_error is None else [])
+    return synced.contact
+
+
+async def _send_excluido(email: str, semaphore: asyncio.Semaphore, tenant: Optional[Tenant] = None) -> None:
+    async with semaphore, _contact_lock(_scoped(tenant, email)), _rd_lease(tenant) as client:
+        await client.add_tags("email", email, EXCLUIDO_TAGS)
+
+
+async def _await_upsert(
+    evento: Optional[str],
+    key: str,
+    sent: Awaitable[Dict[str, Any]],
+    mark: Optional[Tuple[str, str, Optional[str]]] = None,
+) -> Dict[str, Any]:
     try:
-        body = await request.json()
+        upserted = await sent
     except Exception as e:
-        raise HTTPException(status_code=422, detail=f"JSON inválido: {e}")
+        await _unmark_processed(key)
+        _rollback_watermark(mark)
+        return _error_result(evento, e)
+    if upserted is _UNCHANGED:
+        return {"evento": evento, "status": "unchanged", "idempotency_key": key}
+    return {"evento": evento, "status": "ok", "contact": upserted, "idempotency_key": key}
+
+
+async def _await_excluido(
+    evento: Optional[str],
+    key: str,
+    sent: Awaitable[None],
+    mark: Optional[Tuple[str, str, Optional[str]]] = None,
+) -> Dict[str, Any]:
+    try:
+        await sent
+    except Exception as e:
+        await _unmark_processed(key)
+        _rollback_watermark(mark)
+        return _error_result(evento, e)
+    return {"evento": evento, "status": "tagged_excluded", "idempotency_key": key}
+
+
+def _dispatch_event(
+    item: Dict[str, Any],
+    key: str,
+    claimed: bool,
+    semaphore: asyncio.Semaphore,
+    tenant: Optional[Tenant] = None,
+) -> Awaitable[Dict[str, Any]]:
+    """
+    Valida e mapeia um item e o submete ao Coalescer (fila ordenada por e-mail).
+    Roda de forma síncrona, na ordem do lote; devolve um awaitable com o resultado.
+    Com `tenant`, envia pelo cliente do tenant e usa as chaves no namespace dele.
+    """
+    evento = (item or {}).get("evento")
+    dados = (item or {}).get("dados", {})
 
-    if not isinstance(body, list) or not body:
+    # 3) Idempotência por item (reserva feita para o lote inteiro)
+    if not claimed:
+        return _resolved({"evento": evento, "status": "duplicate", "idempotency_key": key})
+
+    try:
+        # 4) Mapeia direto do dict (só os campos da especificação, sem montar o modelo)
+        started = time.perf_counter()
+        rd_payload = _MAPPER(dados)
+        elapsed = time.perf_counter() - started
+        _MAPPING_SECONDS.observe(elapsed)
+        trace = tracing.current()
+        if trace is not None:
+            trace.add("map", elapsed)
+        email = _event_email(item)
+        if not email:
+            return _unmarked(key, {"evento": evento, "status": "ignored", "reason": "sem email"})
+        if not isinstance(email, str) or not _EMAIL.match(email):
+            raise ValueError(f"e-mail inválido: {email!r}")
+
+        # 5) Ordem por contato: evento mais antigo que o último aplicado não vai ao RD
+        mark = None
+        version = _event_version(dados) if evento in _KNOWN_EVENTS and _WATERMARKS.max_entries > 0 else None
+        if version is not None:
+            wkey = _scoped(tenant, _watermark_key(dados, email))
+            accepted, previous = _advance_watermark(wkey, version)
+            if not accepted:
+                return _resolved(
+                    {"evento": evento, "status": "stale", "last_applied": previous, "idempotency_key": key}
+                )
+            mark = (wkey, version, previous)
+
+        # 6) Roteia por tipo de evento
+        if evento in UPSERT_EVENTS:
+            # Aplica tags padrão + tag do evento (para auditoria de origem)
+            default_tags = DEFAULT_TAGS if tenant is None or tenant.config.default_tags is None else tenant.config.default_tags
+            tags_to_add = [*default_tags, evento]
+            sent = _COALESCER.submit(
+                _scoped(tenant, email),
+                rd_payload,
+                tags_to_add,
+                lambda payload, tags: _send_upsert(email, semaphore, payload, tags, tenant),
+            )
+            return _await_upsert(evento, key, sent, mark)
+
+        elif evento == "cliente.excluido":
+            sent = _COALESCER.run(_scoped(tenant, email), lambda: _send_excluido(email, semaphore, tenant))
+            return _await_excluido(evento, key, sent, mark)
+        else:
+            # Evento não tratado explicitamente
+            return _resolved({"evento": evento, "status": "ignored", "reason": "evento não suportado", "idempotency_key": key})
+
+    except Exception as e:
+        # Qualquer falha inesperada: liberar chave para permitir retentativa do Mercos
+        return _unmarked(key, _error_result(evento, e))
+
+
+async def _recorded(
+    item: Any, key: str, sent: Awaitable[Dict[str, Any]], tenant: Optional[Tenant] = None
+) -> Dict[str, Any]:
+    """Erro → registro de falhas (para replay); sucesso de um evento registrado → resolvido."""
+    result = await sent
+    store = _FAILED
+    if store is not None:
+        if result.get("status") == "error":
+            store.record(key, item, str(result.get("error")), tenant.name if tenant is not None else None)
+        elif key in store:
+            store.resolve(key)
+    return result
+
+
+async def _dispatch_batch(
+    items: List[Any],
+    now: float,
+    semaphore: asyncio.Semaphore,
+    record_failures: bool = False,
+    tenant: Optional[Tenant] = None,
+) -> List[Awaitable[Dict[str, Any]]]:
+    """Reserva as chaves dos itens de uma vez (uma consulta ao backend) e despacha em ordem."""
+    keys = [_idempotency_key_for_event(item, tenant) for item in items]
+    with tracing.span("idempotency"):
+        claimed = await _IDEMPOTENCY.aclaim_many(keys, now)
+    hits = claimed.count(False)
+    _IDEMPOTENCY_HITS.inc(hits)
+    _IDEMPOTENCY_MISSES.inc(len(claimed) - hits)
+    sent = [_dispatch_event(item, key, ok, semaphore, tenant) for item, key, ok in zip(items, keys, claimed)]
+    if record_failures and _FAILED is not None:
+        sent = [_recorded(item, key, s, tenant) for item, key, s in zip(items, keys, sent)]
+    return sent
+
+
+async def _process_events(items: List[Any], now: float, tenant: Optional[Tenant] = None) -> List[Dict[str, Any]]:
+    """
+    Processa o lote com concorrência limitada (WEBHOOK_CONCURRENCY).
+
+    Os itens são submetidos em ordem ao Coalescer: eventos do mesmo e-mail
+    executam em série, na ordem recebida (upserts consecutivos são fundidos),
+    e-mails diferentes rodam em paralelo. Os resultados voltam na ordem de entrada.
+
+    As chaves de idempotência do lote são reservadas de uma vez (uma consulta
+    ao backend por lote); a chave é liberada se o evento falhar.
+    """
+    semaphore = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+    results = list(await asyncio.gather(*await _dispatch_batch(items, now, semaphore, tenant=tenant)))
+    _count_results(results)
+    return results
+
+
+async def _process_event_stream(
+    chunks: AsyncIterator[List[Any]], now: float, tenant: Optional[Tenant] = None
+) -> List[Dict[str, Any]]:
+    """
+    Como _process_events, mas para eventos que chegam aos poucos (corpo em
+    streaming): cada grupo é reservado e despachado assim que é lido, então
+    a primeira chamada ao RD sai antes do fim do corpo.
+
+    Com mais de WEBHOOK_MAX_PENDING eventos em andamento, para de ler o corpo
+    até o mais antigo terminar. Se a leitura falhar no meio, espera os
+    eventos já despachados antes de propagar o erro. Eventos com erro vão
+    para o registro de falhas (_FAILED).
+    """
+    semaphore = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+    results: List[Any] = []  # resultado pronto ou Task, na ordem de entrada
+    pending: "deque[int]" = deque()
+    try:
+        async for items in chunks:
+            for sent in await _dispatch_batch(items, now, semaphore, record_failures=True, tenant=tenant):
+                pending.append(len(results))
+                results.append(asyncio.ensure_future(sent))
+            while pending and (results[pending[0]].done() or len(pending) > WEBHOOK_MAX_PENDING):
+                index = pending.popleft()
+                results[index] = await results[index]
+    finally:
+        tasks = [results[index] for index in pending]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    results = [r.result() if isinstance(r, asyncio.Future) else r for r in results]
+    _count_results(results)
+    return results
+
+
+async def _read_events(request: Request) -> AsyncIterator[List[Any]]:
+    """
+    Lê o corpo em streaming e devolve os eventos do array de topo em grupos
+    (os que ficaram completos a cada pedaço recebido). Só o evento em
+    andamento fica em memória, não o corpo inteiro.
+    """
+    parser = ArrayStreamParser(WEBHOOK_MAX_EVENT_BYTES)
+    stream = request.stream()
+    received = 0
+    chunk = b""
+    try:
+        async for chunk in stream:
+            with tracing.span("parse"):
+                items = parser.feed(chunk)
+            received += len(items)
+            if items:
+                yield items
+        with tracing.span("parse"):
+            items = parser.close()
+    except NotAnArrayError:
+        # não é array: lê o resto só para diferenciar JSON válido (400) de inválido (422),
+        # com o mesmo teto de um evento (um corpo que não é lista não vira vários itens)
+        parts, size = [chunk], len(chunk)
+        async for part in stream:
+            size += len(part)
+            if size > WEBHOOK_MAX_EVENT_BYTES:
+                raise HTTPException(status_code=413, detail=f"Corpo maior que {WEBHOOK_MAX_EVENT_BYTES} bytes")
+            parts.append(part)
+        body = b"".join(parts)
+        try:
+            fastjson.loads(body)
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"JSON inválido: {e}")
+        raise HTTPException(status_code=400, detail="Formato inesperado: esperado lista de eventos")
+    except JSONStreamError as e:
+        raise HTTPException(status_code=422, detail=f"JSON inválido: {e}")
+    received += len(items)
+    if items:
+        yield items
+    if not received:
         raise HTTPException(status_code=400, detail="Formato inesperado: esperado lista de eventos")
 
+
+# -----------------------------
+# Fila durável: workers em background
+# -----------------------------
+_QUEUE_WORKER_MAX_BACKOFF = 30.0
+
+
+async def _drain_batch(queue: EventQueue, batch: List[QueuedEvent]) -> None:
+    """Processa eventos reservados da fila: sucesso → ack; erro → retry/dead-letter."""
+    trace, trace_token = tracing.start() if _TRACE_LOG else (None, None)
+    try:
+        results = await _process_queued(batch)
+    finally:
+        if trace is not None:
+            tracing.finish(trace_token)
+            logger.info(json.dumps({"trace": "queue_batch", "events": len(batch), **trace.as_dict()}))
+    for event, result in zip(batch, results):
+        if "retry_after" in result:
+            # circuito aberto: adia sem gastar tentativa (não vai para dead-letter por queda do RD)
+            await asyncio.to_thread(queue.release, event.id, result["retry_after"])
+        elif result.get("status") == "error":
+            await asyncio.to_thread(queue.fail, event.id, str(result.get("error")))
+        else:
+            await asyncio.to_thread(queue.ack, event.id)
+
+
+async def _process_queued(batch: List[QueuedEvent]) -> List[Dict[str, Any]]:
+    """Processa o lote da fila separado por tenant; resultados na ordem do lote."""
+    groups: Dict[Optional[str], List[int]] = {}
+    for index, event in enumerate(batch):
+        groups.setdefault(event.tenant, []).append(index)
+    results: List[Dict[str, Any]] = [{} for _ in batch]
     now = time.time()
-    _clean_idempotency_cache(now)
 
-    results: List[Dict[str, Any]] = []
+    async def run(name: Optional[str], indexes: List[int]) -> None:
+        try:
+            processed = await _process_events([batch[i].item for i in indexes], now, _tenant_named(name))
+        except Exception as e:
+            processed = [{"status": "error", "error": str(e)} for _ in indexes]
+        for i, result in zip(indexes, processed):
+            results[i] = result
 
-    for item in body:
-        evento = (item or {}).get("evento")
-        dados = (item or {}).get("dados", {})
+    await asyncio.gather(*(run(name, indexes) for name, indexes in groups.items()))
+    return results
 
-        # 3) Idempotência por item
-        key = _idempotency_key_for_event(item)
-        if key in _IDEMPOTENCY_CACHE and now - _IDEMPOTENCY_CACHE[key] <= IDEMPOTENCY_TTL_SECONDS:
-            results.append({"evento": evento, "status": "duplicate", "idempotency_key": key})
-            continue  # pula reprocesamento
-        # marca preventivamente como processado; se falhar, removemos a marca
-        _mark_processed(key)
 
+async def _queue_worker(queue: EventQueue) -> None:
+    failures = 0
+    while True:
         try:
-            # 4) Normaliza cliente
-            cliente = MercosCliente.model_validate(dados)
-            email = cliente.principal_email()
-            if not email:
-                _unmark_processed(key)
-                results.append({"evento": evento, "status": "ignored", "reason": "sem email"})
+            wait = _circuit_retry_after()
+            if wait is not None:
+                # RD fora: nem reserva eventos até o circuito permitir um teste
+                await asyncio.sleep(wait)
                 continue
-
-            rd_payload = map_mercos_to_rd(cliente)
-
-            # 5) Roteia por tipo de evento
-            if evento in ("cliente.cadastrado", "cliente.atualizado", "cliente.bloqueioatualizado"):
-                upserted = await rd.upsert_contact_by_email(email, rd_payload)
-
-                # Aplica tags padrão + tag do evento
-                tags_to_add = []
-                if DEFAULT_TAGS:
-                    tags_to_add.extend(DEFAULT_TAGS)
-                # Tag do nome do evento (para auditoria de origem)
-                if evento:
-                    tags_to_add.append(evento)
-
-                if tags_to_add:
-                    try:
-                        await rd.add_tags("email", email, tags_to_add)
-                    except Exception:
-                        # não falha o processamento por erro ao taguear
-                        pass
-
-                results.append({"evento": evento, "status": "ok", "contact": upserted, "idempotency_key": key})
-
-            elif evento == "cliente.excluido":
-                # Não há delete oficial no RD. Marcar com tag especial solicitada:
-                try:
-                    await rd.add_tags("email", email, ["excluido_no_mercos"])
-                    results.append({"evento": evento, "status": "tagged_excluded", "idempotency_key": key})
-                except Exception as e:
-                    _unmark_processed(key)
-                    results.append({"evento": evento, "status": "error", "error": str(e)})
+            coordinator = _COORDINATOR
+            if coordinator is None:
+                batch = await asyncio.to_thread(queue.claim, EVENT_QUEUE_BATCH_SIZE)
             else:
-                # Evento não tratado explicitamente
-                results.append({"evento": evento, "status": "ignored", "reason": "evento não suportado", "idempotency_key": key})
-
-        except HTTPException:
-            # erros já com status correto
-            raise
+                # só as partições deste processo: o mesmo contato fica sempre no mesmo processo
+                batch = await asyncio.to_thread(
+                    queue.claim,
+                    EVENT_QUEUE_BATCH_SIZE,
+                    partitions=coordinator.owned,
+                    partition_count=coordinator.partitions,
+                )
+            if not batch:
+                failures = 0
+                await asyncio.sleep(EVENT_QUEUE_POLL_SECONDS)
+                continue
+            await _drain_batch(queue, batch)
+            failures = 0
         except Exception as e:
-            # Qualquer falha inesperada: liberar chave para permitir retentativa do Mercos
-            _unmark_processed(key)
-            results.append({"evento": evento, "status": "error", "error": str(e)})
+            # ex.: "database is locked" com outro processo escrevendo; o worker não pode morrer
+            # (eventos reservados e não confirmados voltam para a fila quando o lock vence)
+            failures += 1
+            delay = min(_QUEUE_WORKER_MAX_BACKOFF, max(EVENT_QUEUE_POLL_SECONDS, 0.05) * 2 ** (failures - 1))
+            logger.warning("worker da fila falhou (tentativa %d, nova em %.1fs): %r", failures, delay, e)
+            await asyncio.sleep(delay)
+
+
+# -----------------------------
+# Handler geral de eventos de clientes
+# -----------------------------
+@app.post("/webhooks/mercos/clientes")
+async def mercos_clientes(request: Request, response: Response, token: Optional[str] = None):
+    started = time.perf_counter()
+    trace, trace_token = tracing.start() if (_TRACE_HEADER or _TRACE_LOG) else (None, None)
+    profile = _PROFILER.start()
+    status = 500
+    try:
+        result = await _handle_clientes(request, token)
+        status = result.status_code if isinstance(result, Response) else 200
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    finally:
+        _REQUEST_SECONDS.observe(time.perf_counter() - started)
+        if profile is not None:
+            _PROFILER.stop(profile, "webhook")
+        if trace is not None:
+            tracing.finish(trace_token)
+            if _TRACE_LOG:
+                logger.info(json.dumps({"trace": "webhook", "status": status, **trace.as_dict()}))
+
+    if trace is not None and _TRACE_HEADER:
+        # Response retornada direto (202 da fila) não usa os headers de `response`
+        (result if isinstance(result, Response) else response).headers["Server-Timing"] = trace.server_timing()
+    return result
+
+
+async def _handle_clientes(request: Request, token: Optional[str]):
+    # 1) Validação do token via query string (?token=...); com TENANTS_PATH, o token escolhe o tenant
+    tenant = _webhook_tenant(token)
+
+    # 2) Ler o corpo em streaming (precisa ser uma lista de eventos)
+    events = _read_events(request)
+
+    # RD fora (circuito aberto): recusa já, com status que o Mercos reenvia,
+    # sem ler o corpo nem segurar a conexão (no modo fila o evento é aceito)
+    wait = _circuit_retry_after(tenant)
+    if wait is not None and not _QUEUE:
+        raise HTTPException(
+            status_code=503,
+            detail="RD Station indisponível; tente novamente",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+    # Modo fila: grava e confirma (202); o processamento ocorre nos workers
+    if _QUEUE:
+        body = [item async for items in events for item in items]
+        if not all(isinstance(item, dict) for item in body):
+            raise HTTPException(status_code=400, detail="Formato inesperado: eventos devem ser objetos")
+        with tracing.span("enqueue"):
+            partitions = [_event_email(item) for item in body]
+            if tenant is not None:
+                partitions = [_scoped(tenant, p) if p is not None else None for p in partitions]
+            queued = await asyncio.to_thread(
+                _QUEUE.enqueue_many, body, partitions, tenant.name if tenant is not None else None
+            )
+        return JSONResponse(status_code=202, content={"status": "queued", "queued": queued})
+
+    now = time.time()
+    with tracing.span("idempotency"):
+        await _clean_idempotency_cache(now)
+
+    # 3) Eventos são processados à medida que chegam
+    results = await _process_event_stream(events, now, tenant)
+
+    # Circuito abriu no meio do lote: os eventos não enviados tiveram a chave
+    # liberada; 503 + Retry-After faz o Mercos reenviar (os já enviados viram "duplicate")
+    wait = _retry_after_of(results)
+    if wait is not None:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "rd_unavailable", "results": results},
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
 
     return {"status": "processed", "results": results}
@@ -0,0 +1,308 @@
+"""
+Carga inicial / re-sincronização em massa: Mercos → RD Station.
+
+Lê um export de clientes do Mercos em streaming (array JSON ou NDJSON, um
+registro "dados" por item; itens no formato de evento {"evento", "dados"}
+também servem e seguem o roteamento do webhook: cliente.excluido recebe a
+tag de excluído, eventos desconhecidos são ignorados), mapeia com
+map_mercos_to_rd e envia ao RD com concorrência limitada e rate limit.
+
+A memória fica limitada: só os registros em andamento e os concluídos à
+frente do mais antigo ainda em andamento (no máximo max_buffered) ficam
+carregados; com o limite cheio a leitura espera.
+
+O progresso vai para um checkpoint (JSON, gravado de forma atômica): rodar
+de novo o mesmo comando continua do primeiro registro ainda não concluído.
+Registros que falharam vão para um NDJSON no mesmo formato de entrada, que
+pode ser reprocessado com este mesmo script.
+
+Uso:
+    python backfill.py clientes.ndjson [--concurrency 10] [--rate 2]
+        [--checkpoint clientes.ndjson.checkpoint] [--tag carga_inicial] [--restart]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, TextIO, Tuple
+
+from jsonstream import iter_records
+from rd_client import RDClient
+from settings import Settings
+
+EXCLUIDO_EVENT = "cliente.excluido"
+
+
+class Checkpoint:
+    """Posição (registros já concluídos, em ordem) + contadores da execução."""
+
+    def __init__(self, path: str, source: str):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.position = 0
+        self.counters: Dict[str, int] = {}
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+        if data.get("source") != self.source:
+            raise SystemExit(
+                f"checkpoint {self.path} é de outro arquivo ({data.get('source')}); use --restart ou outro --checkpoint"
+            )
+        self.position = int(data.get("position", 0))
+        self.counters = dict(data.get("counters") or {})
+        return True
+
+    def save(self, position: int, counters: Dict[str, int]) -> None:
+        self.position = position
+        self.counters = dict(counters)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(
+                {"source": self.source, "position": position, "counters": counters, "updated_at": time.time()},
+                fh,
+            )
+        os.replace(tmp, self.path)
+
+
+class Backfill:
+    """
+    Envia os registros ao RD com no máximo `concurrency` em andamento.
+
+    A posição salva é a do registro mais antigo ainda em andamento (marca
+    d'água): ao retomar, nada concluído se perde e só os registros que
+    estavam em voo podem ser reenviados — o upsert no RD é idempotente.
+    Registros concluídos depois da marca só entram nos contadores (e no
+    arquivo de falhas) quando a marca passa por eles, então um registro
+    reenviado na retomada é contado uma vez só.
+
+    Itens no formato de evento: `upsert_events` (None = todos menos
+    cliente.excluido) são sincronizados; cliente.excluido recebe
+    `excluded_tags` (None = pula); os demais são ignorados.
+    """
+
+    def __init__(
+        self,
+        rd: RDClient,
+        mapper: Callable[[Dict[str, Any]], Dict[str, Any]],
+        email_of: Callable[[Dict[str, Any]], Optional[str]],
+        tags: List[str],
+        *,
+        concurrency: int = 10,
+        checkpoint: Optional[Checkpoint] = None,
+        failures_path: Optional[str] = None,
+        checkpoint_every: float = 2.0,
+        report_every: float = 5.0,
+        out: Optional[TextIO] = None,
+        upsert_events: Optional[Iterable[str]] = None,
+        excluded_tags: Optional[List[str]] = None,
+        max_buffered: Optional[int] = None,
+    ):
+        self.rd = rd
+        self.mapper = mapper
+        self.email_of = email_of
+        self.tags = tags
+        self.concurrency = max(1, concurrency)
+        self.checkpoint = checkpoint
+        self.failures_path = failures_path
+        self.checkpoint_every = checkpoint_every
+        self.report_every = report_every
+        self.out = out
+        self.upsert_events = frozenset(upsert_events) if upsert_events is not None else None
+        self.excluded_tags = excluded_tags
+        self.counters = {"ok": 0, "created": 0, "failed": 0, "skipped": 0, "tag_errors": 0, "excluded": 0, "ignored": 0}
+        if checkpoint is not None:
+            # contadores acumulam entre execuções retomadas
+            self.counters.update(checkpoint.counters)
+        self._in_flight: set = set()
+        # concluídos ainda à frente da marca d'água: índice → (contadores, linha de falha);
+        # um registro lento segura a marca, então o buffer tem teto
+        self._finished: Dict[int, Tuple[List[str], Optional[Dict[str, Any]]]] = {}
+        self.max_buffered = max_buffered if max_buffered is not None else max(100, 10 * self.concurrency)
+        self._progress = asyncio.Event()
+        self._next = 0
+        self._started = 0.0
+        self._done_this_run = 0
+
+    async def run(self, records: Iterable[Any], start: int = 0) -> Dict[str, Any]:
+        self._started = time.monotonic()
+        self._next = start
+        last_checkpoint = last_report = self._started
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: set = set()
+
+        for index, record in enumerate(records):
+            if index < start:
+                continue
+            await semaphore.acquire()
+            await self._wait_for_buffer()
+            self._in_flight.add(index)
+            self._next = index + 1
+            task = asyncio.create_task(self._sync_one(index, record))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _t: semaphore.release())
+
+            now = time.monotonic()
+            if self.checkpoint is not None and now - last_checkpoint >= self.checkpoint_every:
+                self.checkpoint.save(self._commit(), self.counters)
+                last_checkpoint = now
+            if self.out is not None and now - last_report >= self.report_every:
+                self._commit()
+                self._report()
+                last_report = now
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        position = self._commit()
+        if self.checkpoint is not None:
+            self.checkpoint.save(position, self.counters)
+        if self.out is not None:
+            self._report(final=True)
+        return {**self.counters, "position": position, "rate": self.rate()}
+
+    @property
+    def watermark(self) -> int:
+        """Todos os registros antes desta posição já foram concluídos."""
+        return min(self._in_flight) if self._in_flight else self._next
+
+    def rate(self) -> float:
+        """Contatos sincronizados por segundo nesta execução."""
+        elapsed = time.monotonic() - self._started
+        return self._done_this_run / elapsed if elapsed > 0 else 0.0
+
+    async def _wait_for_buffer(self) -> None:
+        """Com o buffer de concluídos cheio, espera a marca d'água andar antes de ler mais."""
+        while len(self._finished) >= self.max_buffered:
+            self._commit()
+            if len(self._finished) < self.max_buffered:
+                return
+            self._progress.clear()
+            await self._progress.wait()
+
+    def _commit(self) -> int:
+        """Soma nos contadores (e grava as falhas de) os concluídos antes da marca d'água; devolve a marca."""
+        watermark = self.watermark
+        for index in sorted(i for i in self._finished if i < watermark):
+            outcome, failure = self._finished.pop(index)
+            for counter in outcome:
+                self.counters[counter] += 1
+            if failure is not None and self.failures_path:
+                with open(self.failures_path, "a", encoding="utf-8") as fh:
+                    fh.write(json.dumps(failure, ensure_ascii=False) + "\n")
+        return watermark
+
+    async def _sync_one(self, index: int, record: Any) -> None:
+        event_format = isinstance(record, dict) and isinstance(record.get("dados"), dict)
+        dados = record["dados"] if event_format else record
+        evento = record.get("evento") if event_format else None
+        email = None
+        outcome: List[str] = []
+        failure = None
+        try:
+            if not isinstance(dados, dict):
+                raise ValueError("registro não é um objeto JSON")
+            email = self.email_of(dados)
+            if not email:
+                outcome = ["skipped"]
+            elif evento == EXCLUIDO_EVENT:
+                if self.excluded_tags is None:
+                    outcome = ["ignored"]
+                else:
+                    await self.rd.add_tags("email", email, self.excluded_tags)
+                    outcome = ["excluded"]
+            elif evento is not None and self.upsert_events is not None and evento not in self.upsert_events:
+                outcome = ["ignored"]
+            else:
+                result = await self.rd.sync_contact(email, self.mapper(dados), self.tags)
+                outcome = ["ok"]
+                if result.created:
+                    outcome.append("created")
+                if result.tags_error is not None:
+                    outcome.append("tag_errors")
+        except Exception as e:
+            outcome = ["failed"]
+            failure = {"index": index, "email": email, "erro": str(e), "dados": dados}
+            if self.out is not None:
+                print(f"[backfill] registro {index} ({email or 'sem email'}): {e}", file=self.out)
+        else:
+            if "ok" in outcome or "excluded" in outcome:
+                self._done_this_run += 1
+        finally:
+            self._finished[index] = (outcome, failure)
+            self._in_flight.discard(index)
+            self._progress.set()
+
+    def _report(self, final: bool = False) -> None:
+        c = self.counters
+        prefix = "[backfill] fim:" if final else "[backfill]"
+        print(
+            f"{prefix} posição {self.watermark} | ok {c['ok']} (novos {c['created']}) | excluídos {c['excluded']} | "
+            f"falhas {c['failed']} | sem email {c['skipped']} | ignorados {c['ignored']} | {self.rate():.1f} contatos/s",
+            file=self.out,
+            flush=True,
+        )
+
+
+async def _main(args: argparse.Namespace) -> int:
+    # mesma configuração do serviço (.env incluso): mapeamento, RD_DEFAULT_TAGS, credenciais
+    import app
+
+    settings = Settings.from_env(dotenv=True)
+    app.configure(settings, open_stores=False)
+    client_id, client_secret, refresh_token = settings.rd_credentials()
+
+    checkpoint = Checkpoint(args.checkpoint or f"{args.path}.checkpoint", args.path)
+    if args.restart:
+        for path in (checkpoint.path, f"{checkpoint.path}.failed.ndjson"):
+            if os.path.exists(path):
+                os.remove(path)
+    elif checkpoint.load():
+        print(f"[backfill] retomando da posição {checkpoint.position}", file=sys.stderr)
+
+    rate = args.rate if args.rate is not None else settings.rd_rate_limit_contacts
+    rd = RDClient(
+        client_id=client_id,
+        client_secret=client_secret,
+        refresh_token=refresh_token,
+        rate_limits={"contacts": rate, "tag": rate},
+        max_connections=args.concurrency * 2,
+        max_keepalive_connections=args.concurrency * 2,
+    )
+    backfill = Backfill(
+        rd,
+        app.map_mercos_to_rd,
+        lambda dados: app._first_email(dados.get("emails")),
+        [*app.DEFAULT_TAGS, *args.tag],
+        concurrency=args.concurrency,
+        checkpoint=checkpoint,
+        failures_path=f"{checkpoint.path}.failed.ndjson",
+        report_every=args.report_every,
+        out=sys.stderr,
+        upsert_events=app.UPSERT_EVENTS,
+        excluded_tags=app.EXCLUIDO_TAGS,
+    )
+    async with rd:
+        with open(args.path, "rb") as fh:
+            result = await backfill.run(iter_records(fh), start=checkpoint.position)
+    return 1 if result["failed"] else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="export do Mercos (array JSON ou NDJSON)")
+    parser.add_argument("--concurrency", type=int, default=10, help="contatos em andamento ao mesmo tempo")
+    parser.add_argument("--rate", type=float, default=None, help="req/s ao RD (padrão: RD_RATE_LIMIT_CONTACTS; 0 = sem limite)")
+    parser.add_argument("--checkpoint", default=None, help="arquivo de progresso (padrão: <path>.checkpoint)")
+    parser.add_argument("--tag", action="append", default=[], help="tag extra (repetível), além de RD_DEFAULT_TAGS")
+    parser.add_argument("--report-every", type=float, default=5.0, help="segundos entre linhas de progresso")
+    parser.add_argument("--restart", action="store_true", help="ignora o checkpoint e começa do início")
+    return asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Microbenchmark do cache de idempotência.
+
+Compara o cache antigo (dict + varredura/sorted a cada marcação) com o
+MemoryIdempotencyStore (dict + heap por timestamp) com o cache
+pré-carregado com N chaves, medindo o custo de um lote de webhook
+(consulta + marcação por evento).
+
+Uso:
+    python benchmarks/bench_idempotency.py [--keys 100000] [--batch 200]
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idempotency import MemoryIdempotencyStore  # noqa: E402
+
+TTL = 3600.0
+
+
+class LegacyDictCache:
+    """Reprodução do cache original de app.py (dict + scan + sorted)."""
+
+    def __init__(self, ttl_seconds: float, max_keys: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self._cache: Dict[str, float] = {}
+
+    def seen(self, key: str, now: float) -> bool:
+        return key in self._cache and now - self._cache[key] <= self.ttl_seconds
+
+    def mark(self, key: str, now: float) -> None:
+        self._cache[key] = now
+        self.expire(now)
+
+    def expire(self, now: float) -> None:
+        expired = [k for k, ts in self._cache.items() if now - ts > self.ttl_seconds]
+        for k in expired:
+            self._cache.pop(k, None)
+        if len(self._cache) > self.max_keys:
+            overflow = len(self._cache) - self.max_keys
+            for k, _ in sorted(self._cache.items(), key=lambda kv: kv[1])[:overflow]:
+                self._cache.pop(k, None)
+
+
+def _prefill(store, size: int, now: float) -> None:
+    if isinstance(store, LegacyDictCache):
+        # marcar uma a uma no cache legado seria O(n²); carrega direto
+        store._cache.update((f"pre-{i}", now) for i in range(size))
+        return
+    for i in range(size):
+        store.mark(f"pre-{i}", now)
+
+
+def _request_latency(store, batch: int, rounds: int) -> float:
+    """Tempo médio (ms) de um lote: expire no início + seen/mark por evento."""
+    total = 0.0
+    for _ in range(rounds):
+        keys = [uuid.uuid4().hex for _ in range(batch)]
+        start = time.perf_counter()
+        now = time.time()
+        store.expire(now)
+        for key in keys:
+            if not store.seen(key, now):
+                store.mark(key, now)
+        total += time.perf_counter() - start
+    return total / rounds * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=100_000, help="chaves pré-carregadas (= IDEMPOTENCY_MAX_KEYS)")
+    parser.add_argument("--batch", type=int, default=200, help="eventos por lote")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"cache com {args.keys} chaves, lote de {args.batch} eventos")
+    for name, cls in (("dict (legado)", LegacyDictCache), ("MemoryIdempotencyStore", MemoryIdempotencyStore)):
+        for size in (0, args.keys):
+            store = cls(TTL, args.keys)
+            _prefill(store, size, time.time())
+            ms = _request_latency(store, args.batch, args.rounds)
+            print(f"  {name:<24} cache={size:>7}  {ms:10.2f} ms/lote  {ms * 1000 / args.batch:10.1f} us/evento")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark do mapeamento Mercos → RD por evento.
+
+Usa os "dados" de _docs/*.example.json replicados até N eventos e compara:
+  - legado:   MercosCliente.model_validate + if por campo (map_mercos_to_rd original)
+  - compilado: função gerada a partir de mapping.json, direto sobre o dict
+
+Uso:
+    python benchmarks/bench_mapping.py [--events 20000] [--rounds 5]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+for var in ("RD_CLIENT_ID", "RD_CLIENT_SECRET", "RD_REFRESH_TOKEN"):
+    os.environ.setdefault(var, "bench")
+
+from app import MercosCliente  # noqa: E402
+from mapping import load_mapper  # noqa: E402
+
+
+def legacy_map(dados):
+    mercos = MercosCliente.model_validate(dados)
+    body = {}
+    if mercos.razao_social:
+        body["name"] = mercos.razao_social
+    tel = mercos.principal_telefone()
+    if tel:
+        body["personal_phone"] = tel
+    if mercos.cidade:
+        body["city"] = mercos.cidade
+    if mercos.estado:
+        body["state"] = mercos.estado
+    if mercos.pais:
+        body["country"] = mercos.pais
+    custom_fields = {}
+    for field in ("cnpj", "nome_fantasia", "cep", "rua", "bairro", "numero", "complemento"):
+        value = getattr(mercos, field)
+        if value:
+            custom_fields[field] = value
+    if custom_fields:
+        body["custom_fields"] = custom_fields
+    return body
+
+
+def build_events(events: int):
+    samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "_docs", "*.example.json"))):
+        with open(path, encoding="utf-8") as fh:
+            samples.extend(item["dados"] for item in json.load(fh))
+    return [dict(samples[i % len(samples)], id=i) for i in range(events)]
+
+
+def measure(func, events, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for dados in events:
+            func(dados)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    events = build_events(args.events)
+    mapper = load_mapper()
+    assert all(mapper(d) == legacy_map(d) for d in events[:100])
+    print(f"{args.events} eventos")
+    baseline = None
+    for name, func in (("legado", legacy_map), ("compilado", mapper)):
+        seconds = measure(func, events, args.rounds)
+        baseline = baseline or seconds
+        print(f"  {name:<10} {seconds * 1000:9.1f} ms  {seconds * 1e6 / args.events:7.2f} us/evento  ({baseline / seconds:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
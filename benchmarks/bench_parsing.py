@@ -0,0 +1,94 @@
+"""
+Benchmark do caminho de parsing por evento.
+
+Monta um lote com os exemplos de _docs/*.example.json replicados até N eventos
+(e-mails/ids distintos) e compara:
+  - stdlib: json.loads do corpo + json.dumps(sort_keys) + sha256 + model_validate
+  - fast:   fastjson.loads (orjson) + canonical_digest + model_validate
+  - stream: o caminho do webhook — ArrayStreamParser em pedaços de 64 KiB
+            (fronteiras dos itens + fastjson.loads por item) + digest + validate
+
+Uso:
+    python benchmarks/bench_parsing.py [--events 5000] [--rounds 5]
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+for var in ("RD_CLIENT_ID", "RD_CLIENT_SECRET", "RD_REFRESH_TOKEN"):
+    os.environ.setdefault(var, "bench")
+
+import fastjson  # noqa: E402
+from app import MercosCliente  # noqa: E402
+from jsonstream import ArrayStreamParser  # noqa: E402
+
+
+def build_body(events: int) -> bytes:
+    samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "_docs", "*.example.json"))):
+        with open(path, encoding="utf-8") as fh:
+            samples.extend(json.load(fh))
+    batch = []
+    for i in range(events):
+        item = json.loads(json.dumps(samples[i % len(samples)]))
+        item["dados"]["id"] = i
+        item["dados"]["emails"] = [{"tipo": "T", "email": f"cliente{i}@mercos.com", "id": i}]
+        batch.append(item)
+    return json.dumps(batch, ensure_ascii=False).encode("utf-8")
+
+
+def stdlib_path(body: bytes) -> None:
+    for item in json.loads(body):
+        serialized = json.dumps(item, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+        MercosCliente.model_validate(item.get("dados", {}))
+
+
+def fast_path(body: bytes) -> None:
+    for item in fastjson.loads(body):
+        fastjson.canonical_digest(item)
+        MercosCliente.model_validate(item.get("dados", {}))
+
+
+def stream_path(body: bytes) -> None:
+    parser = ArrayStreamParser()
+    for i in range(0, len(body), 1 << 16):
+        for item in parser.feed(body[i:i + (1 << 16)]):
+            fastjson.canonical_digest(item)
+            MercosCliente.model_validate(item.get("dados", {}))
+    parser.close()
+
+
+def measure(func, body: bytes, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(body)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    body = build_body(args.events)
+    print(f"{args.events} eventos, corpo de {len(body) / 1024:.0f} KiB, orjson={'sim' if fastjson.orjson else 'não'}")
+    baseline = None
+    for name, func in (("stdlib", stdlib_path), ("fast", fast_path), ("stream", stream_path)):
+        seconds = measure(func, body, args.rounds)
+        baseline = baseline or seconds
+        print(f"  {name:<7} {seconds * 1000:9.1f} ms/lote  {seconds * 1e6 / args.events:7.1f} us/evento  ({baseline / seconds:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
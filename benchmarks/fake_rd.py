@@ -0,0 +1,137 @@
+"""
+Dublê local da API do RD Station (ASGI) para benchmarks e testes de carga.
+
+Implementa só o que o RDClient usa — POST /auth/token, PATCH/GET
+/platform/contacts/email:{email}, POST /platform/contacts e POST
+.../tag — com comportamento configurável e reprodutível (seed):
+
+  - latency / jitter: atraso por requisição (segundos)
+  - rate_429 / rate_5xx: fração de respostas 429 (com Retry-After) e 503
+  - ratio_404: fração de e-mails "novos" (PATCH → 404 até o POST de criação)
+  - token_expiry: validade do access_token; token vencido → 401
+
+Uso em processo, sem rede:
+    fake = FakeRD(FakeRDConfig(latency=0.02, rate_429=0.01))
+    rd = RDClient(..., transport=httpx.ASGITransport(app=fake))
+"""
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import unquote
+
+
+@dataclass
+class FakeRDConfig:
+    latency: float = 0.02
+    jitter: float = 0.005
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    ratio_404: float = 0.1
+    token_expiry: int = 900
+    retry_after: float = 0.05
+    seed: int = 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class FakeRD:
+    def __init__(self, config: Optional[FakeRDConfig] = None):
+        self.config = config or FakeRDConfig()
+        self.calls: Counter = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(self.config.seed)
+        self._tokens: Dict[str, float] = {}
+        self._created: set = set()
+
+    def reset(self) -> None:
+        self.__init__(self.config)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(count for route, count in self.calls.items() if route != "token")
+
+    # ------------- ASGI ------------- #
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            status, payload, headers = await self._handle(scope, body)
+        finally:
+            self.in_flight -= 1
+
+        data = json.dumps(payload).encode()
+        raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())]
+        raw_headers += [(k.encode(), v.encode()) for k, v in headers.items()]
+        await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": data})
+
+    async def _handle(self, scope, body: bytes) -> Tuple[int, Any, Dict[str, str]]:
+        method, path = scope["method"], unquote(scope["path"])
+        cfg = self.config
+
+        if path == "/auth/token" and method == "POST":
+            self.calls["token"] += 1
+            token = f"tok-{self.calls['token']}"
+            self._tokens[token] = time.monotonic() + cfg.token_expiry
+            return 200, {"access_token": token, "expires_in": cfg.token_expiry}, {}
+
+        route = self._route(method, path)
+        self.calls[route] += 1
+        if cfg.latency or cfg.jitter:
+            await asyncio.sleep(max(0.0, cfg.latency + self._random.uniform(-cfg.jitter, cfg.jitter)))
+
+        auth = dict(scope["headers"]).get(b"authorization", b"").decode()
+        expires = self._tokens.get(auth.removeprefix("Bearer "))
+        if expires is None or time.monotonic() >= expires:
+            return 401, {"errors": "invalid token"}, {}
+
+        roll = self._random.random()
+        if roll < cfg.rate_429:
+            return 429, {"errors": "too many requests"}, {"Retry-After": str(cfg.retry_after)}
+        if roll < cfg.rate_429 + cfg.rate_5xx:
+            return 503, {"errors": "unavailable"}, {}
+
+        if route == "create":
+            email = json.loads(body or b"{}").get("email", "")
+            self._created.add(email)
+            return 200, {"uuid": _uuid(email), "email": email}, {}
+        if route == "tag":
+            return 200, {}, {}
+        email = path.split("email:", 1)[1]
+        if email not in self._created and _ratio(email) < cfg.ratio_404:
+            return 404, {"errors": "not found"}, {}
+        return 200, {"uuid": _uuid(email), "email": email}, {}
+
+    @staticmethod
+    def _route(method: str, path: str) -> str:
+        if path.endswith("/tag"):
+            return "tag"
+        if path == "/platform/contacts":
+            return "create"
+        return "patch" if method == "PATCH" else method.lower()
+
+
+def _ratio(email: str) -> float:
+    """Fração estável por e-mail (o mesmo e-mail é sempre "novo" ou sempre "existente")."""
+    return int(hashlib.md5(email.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+
+
+def _uuid(email: str) -> str:
+    return hashlib.md5(email.encode()).hexdigest()
@@ -0,0 +1,270 @@
+"""
+Teste de carga reprodutível: app FastAPI real contra o dublê local do RD.
+
+Gera lotes Mercos (a partir de _docs/*.example.json) de vários tamanhos e
+com uma fração de eventos repetidos, envia ao webhook em processo (ASGI,
+sem rede) com N requisições simultâneas e mede, por cenário:
+
+  - eventos/s e latência do webhook (p50/p99)
+  - chamadas ao RD por evento (sem contar /auth/token)
+  - memória: pico de RSS do processo (e pico do tracemalloc com --tracemalloc)
+
+Os resultados vão para um JSON (--output); com --compare, cada cenário é
+comparado com um resultado anterior e o script sai com código 1 se
+eventos/s cair ou p99 subir mais que --tolerance.
+
+Uso:
+    python benchmarks/loadtest.py [--batch-sizes 1,10,100] [--requests 40]
+        [--concurrency 8] [--duplicate-ratio 0.1] [--latency 0.02] [--rate-429 0.01]
+        [--rate-5xx 0] [--ratio-404 0.1] [--token-expiry 900]
+        [--output benchmarks/results/x.json] [--compare anterior.json]
+"""
+import argparse
+import asyncio
+import copy
+import glob
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+for var, value in (
+    ("RD_CLIENT_ID", "bench"),
+    ("RD_CLIENT_SECRET", "bench"),
+    ("RD_REFRESH_TOKEN", "bench"),
+    ("MERCOS_WEBHOOK_TOKEN", "bench"),
+):
+    os.environ.setdefault(var, value)
+# estado só em memória: nada de fila/arquivos de outra execução
+os.environ["EVENT_QUEUE_PATH"] = ""
+os.environ["CONTACT_STATE_PATH"] = ""
+os.environ["IDEMPOTENCY_BACKEND"] = "memory"
+
+import httpx  # noqa: E402
+
+import app as app_module  # noqa: E402
+from fake_rd import FakeRD, FakeRDConfig  # noqa: E402
+from rd_client import RDClient  # noqa: E402
+
+WEBHOOK = f"/webhooks/mercos/clientes?token={os.environ['MERCOS_WEBHOOK_TOKEN']}"
+
+
+def _samples() -> List[Dict[str, Any]]:
+    samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "_docs", "*.example.json"))):
+        with open(path, encoding="utf-8") as fh:
+            samples.extend(json.load(fh))
+    return samples
+
+
+class BatchGenerator:
+    """Lotes determinísticos (seed): e-mails de um conjunto fixo, versões crescentes, duplicatas sorteadas."""
+
+    def __init__(self, contacts: int, duplicate_ratio: float, seed: int):
+        self.samples = _samples()
+        self.contacts = contacts
+        self.duplicate_ratio = duplicate_ratio
+        self.random = random.Random(seed)
+        self.sent: List[Dict[str, Any]] = []
+        self.version = 0
+
+    def batch(self, size: int) -> List[Dict[str, Any]]:
+        items = []
+        for _ in range(size):
+            if self.sent and self.random.random() < self.duplicate_ratio:
+                items.append(self.random.choice(self.sent))
+                continue
+            self.version += 1
+            item = copy.deepcopy(self.random.choice(self.samples))
+            n = self.random.randrange(self.contacts)
+            item["dados"]["id"] = n
+            item["dados"]["emails"] = [{"tipo": "T", "email": f"carga{n}@mercos.com", "id": n}]
+            item["dados"]["razao_social"] = f"Cliente {n} v{self.version}"
+            items.append(item)
+            if len(self.sent) < 10_000:
+                self.sent.append(item)
+        return items
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _rss_mb() -> float:
+    # ru_maxrss: KiB no Linux, bytes no macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def run_scenario(args: argparse.Namespace, batch_size: int, fake: FakeRD) -> Dict[str, Any]:
+    fake.reset()
+    app_module._IDEMPOTENCY.clear()
+    app_module._CONTACT_STATE.clear()
+    generator = BatchGenerator(args.contacts, args.duplicate_ratio, args.seed)
+    batches = [generator.batch(batch_size) for _ in range(args.requests)]
+    events = sum(len(b) for b in batches)
+
+    rd = RDClient("bench", "bench", "bench", transport=httpx.ASGITransport(app=fake), backoff_base=0.01)
+    app_module.rd = rd
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    http_errors = 0
+    queue = list(batches)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://bench") as client:
+
+        async def worker():
+            nonlocal http_errors
+            while queue:
+                body = queue.pop()
+                started = time.perf_counter()
+                r = await client.post(WEBHOOK, json=body)
+                latencies.append(time.perf_counter() - started)
+                if r.status_code != 200:
+                    http_errors += 1
+                    continue
+                for result in r.json()["results"]:
+                    statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - started
+
+    traced_peak = None
+    if args.tracemalloc:
+        traced_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    await rd.aclose()
+
+    return {
+        "name": f"batch{batch_size}",
+        "batch_size": batch_size,
+        "requests": args.requests,
+        "events": events,
+        "seconds": round(wall, 3),
+        "events_per_s": round(events / wall, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "rd_calls_per_event": round(fake.total_calls / events, 3),
+        "rd_calls": dict(fake.calls),
+        "rd_max_in_flight": fake.max_in_flight,
+        "statuses": statuses,
+        "http_errors": http_errors,
+        "rss_peak_mb": round(_rss_mb(), 1),
+        "tracemalloc_peak_mb": round(traced_peak, 2) if traced_peak is not None else None,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """Imprime as variações por cenário; False se houver regressão acima da tolerância."""
+    previous = {s["name"]: s for s in baseline.get("scenarios", [])}
+    ok = True
+    print(f"\ncomparação com {baseline.get('meta', {}).get('git_rev', '?')} (tolerância {tolerance:.0%}):")
+    for scenario in current["scenarios"]:
+        before = previous.get(scenario["name"])
+        if before is None:
+            print(f"  {scenario['name']:<10} (sem referência)")
+            continue
+        eps = scenario["events_per_s"] / before["events_per_s"] - 1 if before["events_per_s"] else 0.0
+        p99 = scenario["p99_ms"] / before["p99_ms"] - 1 if before["p99_ms"] else 0.0
+        calls = scenario["rd_calls_per_event"] - before["rd_calls_per_event"]
+        regressed = eps < -tolerance or p99 > tolerance
+        ok = ok and not regressed
+        flag = "  REGRESSÃO" if regressed else ""
+        print(f"  {scenario['name']:<10} eventos/s {eps:+.1%}  p99 {p99:+.1%}  chamadas RD/evento {calls:+.3f}{flag}")
+    return ok
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    config = FakeRDConfig(
+        latency=args.latency,
+        jitter=args.latency / 4,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        ratio_404=args.ratio_404,
+        token_expiry=args.token_expiry,
+        seed=args.seed,
+    )
+    fake = FakeRD(config)
+    scenarios = []
+    for size in args.batch_sizes:
+        result = await run_scenario(args, size, fake)
+        scenarios.append(result)
+        print(
+            f"  {result['name']:<10} {result['events']:>6} eventos  {result['events_per_s']:>8.1f} ev/s  "
+            f"p50 {result['p50_ms']:>8.1f} ms  p99 {result['p99_ms']:>8.1f} ms  "
+            f"RD/evento {result['rd_calls_per_event']:.2f}  RSS {result['rss_peak_mb']:.0f} MB"
+        )
+    return {
+        "meta": {
+            "git_rev": _git_rev(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "fake_rd": config.as_dict(),
+        },
+        "scenarios": scenarios,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1, 10, 100])
+    parser.add_argument("--requests", type=int, default=40, help="requisições por cenário")
+    parser.add_argument("--concurrency", type=int, default=8, help="requisições simultâneas ao webhook")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1)
+    parser.add_argument("--contacts", type=int, default=5000, help="e-mails distintos sorteados")
+    parser.add_argument("--latency", type=float, default=0.02, help="latência do RD falso (s)")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--ratio-404", type=float, default=0.1)
+    parser.add_argument("--token-expiry", type=int, default=900)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="mede o pico de alocação Python (mais lento)")
+    parser.add_argument("--output", default=None, help="JSON de saída (padrão: benchmarks/results/<data>-<rev>.json)")
+    parser.add_argument("--compare", default=None, help="JSON de uma execução anterior")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    print(f"loadtest: lotes {args.batch_sizes}, {args.requests} req/cenário, concorrência {args.concurrency}")
+    results = asyncio.run(main_async(args))
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"{time.strftime('%Y%m%d-%H%M%S')}-{results['meta']['git_rev'] or 'local'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2, ensure_ascii=False)
+    print(f"resultado: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            return 0 if compare(results, json.load(fh), args.tolerance) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
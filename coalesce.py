@@ -0,0 +1,133 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+def merge_rd_payloads(base: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Funde dois payloads de contato: campos do mais recente prevalecem (custom_fields campo a campo)."""
+    merged = {**base, **update}
+    if "custom_fields" in base and "custom_fields" in update:
+        merged["custom_fields"] = {**base["custom_fields"], **update["custom_fields"]}
+    return merged
+
+
+def merge_tags(base: List[str], update: List[str]) -> List[str]:
+    """União das tags preservando a ordem de chegada."""
+    return list(dict.fromkeys([*base, *update]))
+
+
+class _Entry:
+    __slots__ = ("payload", "tags", "send", "future")
+
+    def __init__(self, payload, tags, send, future):
+        self.payload = payload
+        self.tags = tags
+        self.send = send
+        self.future = future
+
+
+class Coalescer:
+    """
+    Fila ordenada por contato (chave = e-mail) com fusão de atualizações.
+
+    - submit(): upsert "fundível". Enquanto o envio anterior não começou
+      (janela de window_seconds + espera pelo envio anterior do mesmo contato),
+      novos upserts são fundidos nele: payload mesclado, tags unidas, e todos
+      recebem o mesmo resultado. Só o estado final vai para o RD.
+    - run(): operação que não se funde (ex.: tag de exclusão); respeita a ordem
+      e fecha a janela de fusão do contato.
+
+    Operações de um mesmo contato executam na ordem de submissão.
+    """
+
+    def __init__(self, window_seconds: float = 0.0, *, calls_per_send: int = 2):
+        self.window_seconds = window_seconds
+        # chamadas ao RD por envio de upsert (PATCH + tag) — base do contador de economia
+        self.calls_per_send = calls_per_send
+        self._open: Dict[str, _Entry] = {}
+        self._tail: Dict[str, "asyncio.Task[Any]"] = {}
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+
+    def submit(
+        self,
+        key: str,
+        payload: Dict[str, Any],
+        tags: List[str],
+        send: Callable[[Dict[str, Any], List[str]], Awaitable[Any]],
+    ) -> "asyncio.Future[Any]":
+        self.submitted += 1
+        entry = self._open.get(key)
+        if entry is not None:
+            entry.payload = merge_rd_payloads(entry.payload, payload)
+            entry.tags = merge_tags(entry.tags, tags)
+            self.coalesced += 1
+            return entry.future
+
+        entry = _Entry(payload, list(tags), send, asyncio.get_running_loop().create_future())
+        self._open[key] = entry
+        self._chain(key, self._send_entry(key, entry, self._tail.get(key)))
+        return entry.future
+
+    def run(self, key: str, func: Callable[[], Awaitable[Any]]) -> "asyncio.Future[Any]":
+        self.submitted += 1
+        self._open.pop(key, None)
+        future = asyncio.get_running_loop().create_future()
+        self._chain(key, self._run_op(func, future, self._tail.get(key)))
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_seconds": self.window_seconds,
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "rd_calls_saved": self.coalesced * self.calls_per_send,
+            "pending_contacts": len(self._tail),
+        }
+
+    # ------------- Internos ------------- #
+
+    def _chain(self, key: str, coro: Awaitable[Any]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tail[key] = task
+
+        def _cleanup(done: "asyncio.Task[Any]") -> None:
+            if self._tail.get(key) is done:
+                del self._tail[key]
+
+        task.add_done_callback(_cleanup)
+
+    async def _send_entry(self, key: str, entry: _Entry, previous: Optional["asyncio.Task[Any]"]) -> None:
+        if self.window_seconds > 0:
+            await asyncio.sleep(self.window_seconds)
+        else:
+            # deixa os demais eventos do mesmo lote chegarem antes de fechar a fusão
+            await asyncio.sleep(0)
+        if previous is not None:
+            await asyncio.wait({previous})
+        if self._open.get(key) is entry:
+            del self._open[key]
+        self.sent += 1
+        await self._resolve(entry.future, entry.send(entry.payload, entry.tags))
+
+    async def _run_op(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        future: "asyncio.Future[Any]",
+        previous: Optional["asyncio.Task[Any]"],
+    ) -> None:
+        if previous is not None:
+            await asyncio.wait({previous})
+        await self._resolve(future, func())
+
+    @staticmethod
+    async def _resolve(future: "asyncio.Future[Any]", coro: Awaitable[Any]) -> None:
+        try:
+            result = await coro
+        except Exception as e:
+            if not future.cancelled():
+                future.set_exception(e)
+        else:
+            if not future.cancelled():
+                future.set_result(result)
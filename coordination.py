@@ -0,0 +1,319 @@
+"""
+Coordenação entre processos (vários workers do uvicorn ou réplicas no mesmo
+host) num arquivo SQLite (COORDINATION_PATH), sem serviço externo.
+
+- Partições: os contatos são divididos em N partições pelo hash do e-mail
+  (event_queue.partition_hash). Cada processo vivo fica com uma fatia justa
+  das partições (lease renovado por heartbeat) e os workers da fila só
+  reservam eventos das suas: o mesmo contato é sempre processado pelo mesmo
+  processo (cache de estado, fusão e contatos conhecidos continuam valendo).
+  Quando um processo entra ou sai, as partições são redistribuídas em até
+  dois heartbeats; a fila continua entregando um evento por e-mail por vez,
+  então a ordem por contato se mantém durante a troca.
+- Locks por contato: sem fila, o processo que recebeu o evento envia ao RD
+  segurando o lock do contato; dois processos nunca atualizam o mesmo
+  contato ao mesmo tempo.
+- SharedTokenBucket: o limite de requisições/s ao RD (RD_RATE_LIMIT_*) vale
+  para todos os processos juntos, inclusive a redução após 429.
+
+As transações (BEGIN IMMEDIATE) podem esperar o lock de escrita de outro
+processo; quem roda no event loop usa as variantes assíncronas, que levam o
+SQLite para uma thread (asyncio.to_thread) em vez de travar o loop.
+"""
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class Coordinator:
+    """
+    Leases de partição, locks por contato e baldes de taxa num SQLite (WAL)
+    compartilhado. heartbeat() deve rodar a cada lease_seconds / 3: registra
+    o processo, renova o que ele segura e rebalanceia as partições.
+
+    Os métodos síncronos bloqueiam enquanto outro processo escreve; no event
+    loop use aheartbeat(), contact() e SharedTokenBucket.acquire().
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        partitions: int = 64,
+        lease_seconds: float = 30.0,
+        owner: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.partitions = max(1, partitions)
+        self.lease_seconds = lease_seconds
+        self.owner = owner or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.clock = clock
+        self.owned: FrozenSet[int] = frozenset()
+        self.heartbeats = 0
+        self.lock_waits = 0
+        self.lock_wait_seconds = 0.0
+        self.workers = 0
+
+        # uma conexão para o processo: as threads do to_thread usam em série
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS workers (
+                owner TEXT PRIMARY KEY,
+                seen_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS partition_leases (
+                partition INTEGER PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS contact_locks (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                rate REAL NOT NULL,
+                paused_until REAL NOT NULL DEFAULT 0
+            );
+            """
+        )
+
+    def close(self) -> None:
+        """Libera partições e locks deste processo (os outros assumem já no próximo heartbeat)."""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM partition_leases WHERE owner = ?", (self.owner,))
+            self._conn.execute("DELETE FROM contact_locks WHERE owner = ?", (self.owner,))
+            self._conn.execute("DELETE FROM workers WHERE owner = ?", (self.owner,))
+        self.owned = frozenset()
+        self._conn.close()
+
+    # ------------- Partições ------------- #
+
+    def heartbeat(self) -> FrozenSet[int]:
+        """Renova leases/locks e fica com a fatia justa das partições; devolve as partições deste processo."""
+        now = self.clock()
+        expires = now + self.lease_seconds
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("INSERT OR REPLACE INTO workers (owner, seen_at) VALUES (?, ?)", (self.owner, now))
+            self._conn.execute("DELETE FROM workers WHERE seen_at < ?", (now - self.lease_seconds,))
+            # expirados ou de uma configuração com mais partições
+            self._conn.execute(
+                "DELETE FROM partition_leases WHERE expires_at < ? OR partition >= ?", (now, self.partitions)
+            )
+            self._conn.execute("DELETE FROM contact_locks WHERE expires_at < ?", (now,))
+            (live,) = self._conn.execute("SELECT COUNT(*) FROM workers").fetchone()
+            share = math.ceil(self.partitions / max(1, live))
+
+            taken = dict(self._conn.execute("SELECT partition, owner FROM partition_leases").fetchall())
+            mine = sorted(p for p, owner in taken.items() if owner == self.owner)
+            if len(mine) > share:
+                # entrou processo novo: devolve o excedente para ele pegar
+                self._conn.executemany(
+                    "DELETE FROM partition_leases WHERE partition = ? AND owner = ?",
+                    [(p, self.owner) for p in mine[share:]],
+                )
+                mine = mine[:share]
+            free = [p for p in range(self.partitions) if p not in taken][: share - len(mine)]
+            self._conn.executemany(
+                "INSERT INTO partition_leases (partition, owner, expires_at) VALUES (?, ?, ?)",
+                [(p, self.owner, expires) for p in free],
+            )
+            self._conn.execute("UPDATE partition_leases SET expires_at = ? WHERE owner = ?", (expires, self.owner))
+            self._conn.execute("UPDATE contact_locks SET expires_at = ? WHERE owner = ?", (expires, self.owner))
+        self.owned = frozenset(mine + free)
+        self.workers = live
+        self.heartbeats += 1
+        return self.owned
+
+    async def aheartbeat(self) -> FrozenSet[int]:
+        return await asyncio.to_thread(self.heartbeat)
+
+    # ------------- Locks por contato ------------- #
+
+    def try_lock(self, key: str) -> bool:
+        now = self.clock()
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                INSERT INTO contact_locks (key, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE contact_locks.expires_at < ? OR contact_locks.owner = excluded.owner
+                """,
+                (key, self.owner, now + self.lease_seconds, now),
+            )
+            return cursor.rowcount == 1
+
+    def unlock(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM contact_locks WHERE key = ? AND owner = ?", (key, self.owner))
+
+    @asynccontextmanager
+    async def contact(self, key: str) -> AsyncIterator[None]:
+        """Segura o lock do contato entre processos (espera quem estiver com ele)."""
+        if not await asyncio.to_thread(self.try_lock, key):
+            started = time.monotonic()
+            delay = 0.005
+            while not await asyncio.to_thread(self.try_lock, key):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.1)
+            self.lock_waits += 1
+            self.lock_wait_seconds += time.monotonic() - started
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.unlock, key)
+
+    # ------------- Taxa compartilhada ------------- #
+
+    def bucket(self, name: str, rate: float, **kwargs: Any) -> "SharedTokenBucket":
+        return SharedTokenBucket(self, name, rate, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        # contagem do último heartbeat: /stats não espera o lock do SQLite
+        return {
+            "owner": self.owner,
+            "workers": self.workers,
+            "partitions": self.partitions,
+            "owned": len(self.owned),
+            "heartbeats": self.heartbeats,
+            "lock_waits": self.lock_waits,
+            "lock_wait_seconds": round(self.lock_wait_seconds, 3),
+        }
+
+
+class SharedTokenBucket:
+    """
+    Mesmo contrato do rd_client.TokenBucket (acquire/on_success/on_throttle/
+    stats), mas com o saldo e a taxa adaptativa numa linha do SQLite do
+    Coordinator: todos os processos gastam do mesmo orçamento e um 429 visto
+    por um deles reduz a taxa de todos.
+
+    on_success/on_throttle continuam síncronos (contrato do TokenBucket): no
+    event loop a gravação vai para uma thread e o próximo acquire() deste
+    balde espera ela terminar.
+    """
+
+    def __init__(
+        self,
+        coordinator: Coordinator,
+        name: str,
+        rate: float,
+        *,
+        burst: Optional[float] = None,
+        min_rate: float = 0.1,
+        increase_step: Optional[float] = None,
+    ):
+        self._coord = coordinator
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.min_rate = min(min_rate, rate)
+        self.increase_step = increase_step if increase_step is not None else rate * 0.05
+
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+        self._pending: Set["asyncio.Future[Any]"] = set()
+
+    def _update(self, change: Callable[[float, float, float, float], Any]) -> Any:
+        """Lê a linha do balde (com refill), aplica `change` e grava, numa transação."""
+        conn = self._coord._conn
+        now = self._coord.clock()
+        with self._coord._lock, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tokens, updated, rate, paused_until FROM rate_buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            tokens, updated, rate, paused_until = row if row is not None else (self.burst, now, self.max_rate, 0.0)
+            rate = min(rate, self.max_rate)  # limite reduzido na configuração vale na hora
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * rate)
+            tokens, rate, paused_until, result = change(now, tokens, rate, paused_until)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (name, tokens, updated, rate, paused_until) VALUES (?, ?, ?, ?, ?)",
+                (self.name, tokens, now, rate, paused_until),
+            )
+        self.rate = rate
+        return result
+
+    def _update_soon(self, change: Callable[[float, float, float, float], Any]) -> None:
+        """_update sem bloquear o event loop (síncrono fora dele)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._update(change)
+            return
+        future = loop.create_task(asyncio.to_thread(self._update, change))
+        self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future: "asyncio.Future[Any]") -> None:
+        self._pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("balde %s: falha ao gravar no SQLite: %r", self.name, future.exception())
+
+    async def acquire(self) -> float:
+        """Reserva um token do orçamento compartilhado; retorna quanto tempo esperou (segundos)."""
+
+        def take(now, tokens, rate, paused_until):
+            tokens -= 1
+            return tokens, rate, paused_until, max(0.0, -tokens / rate, paused_until - now)
+
+        if self._pending:
+            # ajuste de taxa ainda gravando (429 recente): vale já para este acquire
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        wait = await asyncio.to_thread(self._update, take)
+        self.acquired += 1
+        if wait > 0:
+            self.waits += 1
+            self.wait_seconds += wait
+            await asyncio.sleep(wait)
+        return wait
+
+    def on_success(self) -> None:
+        # só grava enquanto a taxa estiver abaixo da configurada (recuperação depois de um 429)
+        if self.rate < self.max_rate:
+            self._update_soon(
+                lambda now, tokens, rate, paused: (tokens, min(self.max_rate, rate + self.increase_step), paused, None)
+            )
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        self.throttled += 1
+
+        def throttle(now, tokens, rate, paused_until):
+            if retry_after:
+                paused_until = max(paused_until, now + retry_after)
+            return min(tokens, 0.0), max(self.min_rate, rate / 2), paused_until, None
+
+        self._update_soon(throttle)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": round(self.rate, 3),
+            "max_rate": self.max_rate,
+            "acquired": self.acquired,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "throttled": self.throttled,
+            "shared": True,
+        }
@@ -0,0 +1,238 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Collection, Dict, List, NamedTuple, Optional
+
+
+def partition_hash(partition: Optional[str]) -> int:
+    """Hash estável (igual em todos os processos) da chave de ordenação."""
+    return zlib.crc32((partition or "").encode("utf-8"))
+
+
+class QueuedEvent(NamedTuple):
+    id: int
+    item: Dict[str, Any]
+    attempts: int
+    enqueued_at: float
+    tenant: Optional[str] = None
+
+
+class EventQueue:
+    """
+    Fila durável (SQLite) de eventos do webhook:
+      - enqueue grava o lote numa única transação (sobrevive a restart)
+      - claim entrega eventos com "lease": se o processo cair, o evento volta
+        para a fila quando o lease expira
+      - eventos do mesmo e-mail (partition) saem um por vez, na ordem de chegada
+      - após max_retries falhas o evento vai para a tabela dead_letter
+      - com vários processos, claim(partitions=...) reserva só as partições
+        (hash da chave % partition_count) que o processo segura (coordination.py)
+
+    Os métodos de escrita esperam o lock de outro processo (timeout padrão do
+    sqlite3, 5 s): no event loop chame-os via asyncio.to_thread. Um
+    threading.Lock serializa a conexão entre essas threads; stats() e
+    dead_letters() leem por uma conexão própria, sem esperar quem escreve.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        max_retries: int = 5,
+        retry_backoff: float = 5.0,  # segundos
+        lease_seconds: float = 300.0,
+    ):
+        self.path = path
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                partition TEXT,
+                partition_hash INTEGER NOT NULL DEFAULT 0,
+                tenant TEXT,
+                payload TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                locked_until REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS events_partition ON events (partition, id);
+            CREATE INDEX IF NOT EXISTS events_available ON events (available_at);
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY,
+                partition TEXT,
+                tenant TEXT,
+                payload TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                failed_at REAL NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT
+            );
+            """
+        )
+        # filas criadas antes das colunas tenant / partition_hash
+        for table in ("events", "dead_letter"):
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if "tenant" not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN tenant TEXT")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(events)")}
+        if "partition_hash" not in columns:
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute("ALTER TABLE events ADD COLUMN partition_hash INTEGER NOT NULL DEFAULT 0")
+                rows = self._conn.execute("SELECT id, partition FROM events").fetchall()
+                self._conn.executemany(
+                    "UPDATE events SET partition_hash = ? WHERE id = ?",
+                    [(partition_hash(partition), event_id) for event_id, partition in rows],
+                )
+        self._reader = sqlite3.connect(path, timeout=1, isolation_level=None, check_same_thread=False)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+        self._reader.close()
+
+    # ------------- Produção ------------- #
+
+    def enqueue_many(
+        self, items: List[Dict[str, Any]], partitions: List[Optional[str]], tenant: Optional[str] = None
+    ) -> int:
+        """Grava os itens (com a chave de ordenação de cada um) numa única transação."""
+        now = time.time()
+        rows = [
+            (partition, partition_hash(partition), tenant, json.dumps(item, ensure_ascii=False), now, now)
+            for item, partition in zip(items, partitions)
+        ]
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT INTO events (partition, partition_hash, tenant, payload, enqueued_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    # ------------- Consumo ------------- #
+
+    def claim(
+        self, limit: int, *, partitions: Optional[Collection[int]] = None, partition_count: int = 1
+    ) -> List[QueuedEvent]:
+        """
+        Reserva até `limit` eventos prontos. Só a cabeça de cada partition é
+        elegível, o que mantém a ordem por e-mail mesmo com vários workers.
+        Com `partitions`, só eventos cujo partition_hash % partition_count
+        está entre elas (vazio = nenhum).
+        """
+        now = time.time()
+        shard_filter, params = "", ()
+        if partitions is not None:
+            if not partitions:
+                return []
+            shard_filter = f"AND partition_hash % ? IN ({','.join('?' * len(partitions))})"
+            params = (partition_count, *partitions)
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                f"""
+                SELECT id, payload, attempts, enqueued_at, tenant FROM events e
+                WHERE available_at <= ? AND locked_until <= ? {shard_filter}
+                  AND NOT EXISTS (
+                    SELECT 1 FROM events p WHERE p.partition = e.partition AND p.id < e.id
+                  )
+                ORDER BY id LIMIT ?
+                """,
+                (now, now, *params, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE events SET locked_until = ? WHERE id = ?",
+                [(now + self.lease_seconds, row[0]) for row in rows],
+            )
+        return [QueuedEvent(row[0], json.loads(row[1]), row[2], row[3], row[4]) for row in rows]
+
+    def ack(self, event_id: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+
+    def fail(self, event_id: int, error: str) -> bool:
+        """
+        Registra uma falha. Reagenda com backoff exponencial ou, esgotadas as
+        tentativas, move para dead_letter. Retorna True se foi para dead_letter.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(
+                "SELECT partition, payload, enqueued_at, attempts, tenant FROM events WHERE id = ?",
+                (event_id,),
+            ).fetchone()
+            if row is None:
+                return False
+            attempts = row[3] + 1
+            if attempts >= self.max_retries:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dead_letter "
+                    "(id, partition, tenant, payload, enqueued_at, failed_at, attempts, last_error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (event_id, row[0], row[4], row[1], row[2], now, attempts, error),
+                )
+                self._conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+                return True
+            self._conn.execute(
+                "UPDATE events SET attempts = ?, last_error = ?, locked_until = 0, available_at = ? WHERE id = ?",
+                (attempts, error, now + self.retry_backoff * (2 ** (attempts - 1)), event_id),
+            )
+            return False
+
+    def release(self, event_id: int, delay: float) -> None:
+        """Devolve o evento à fila para daqui a `delay` segundos, sem contar tentativa."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE events SET locked_until = 0, available_at = ? WHERE id = ?",
+                (time.time() + delay, event_id),
+            )
+
+    # ------------- Observabilidade ------------- #
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        depth, in_flight, oldest = self._reader.execute(
+            "SELECT COUNT(*), COALESCE(SUM(locked_until > ?), 0), MIN(enqueued_at) FROM events",
+            (now,),
+        ).fetchone()
+        (dead,) = self._reader.execute("SELECT COUNT(*) FROM dead_letter").fetchone()
+        return {
+            "depth": depth,
+            "in_flight": in_flight,
+            "lag_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "dead_letter": dead,
+        }
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = self._reader.execute(
+            "SELECT id, payload, enqueued_at, failed_at, attempts, last_error, tenant "
+            "FROM dead_letter ORDER BY failed_at DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [
+            {
+                "id": row[0],
+                "item": json.loads(row[1]),
+                "enqueued_at": row[2],
+                "failed_at": row[3],
+                "attempts": row[4],
+                "error": row[5],
+                "tenant": row[6],
+            }
+            for row in rows
+        ]
@@ -0,0 +1,378 @@
+"""
+Eventos do webhook que terminaram em erro + reprocessamento (replay).
+
+O webhook grava cada evento com `status: "error"` (item bruto, erro e
+número de tentativas) num NDJSON só de acréscimo; quando o mesmo evento
+depois dá certo (reenvio do Mercos ou replay), uma linha de resolução o
+tira da lista de pendentes. O replay passa os pendentes pelo mesmo
+pipeline do webhook (idempotência, mapeamento, ordem, RD) com taxa e
+concorrência limitadas.
+
+Uso (com o serviço no ar o replay é melhor via POST /admin/failed-events/replay;
+list e compact podem rodar a qualquer momento):
+    python failed_events.py list [--limit 20]
+    python failed_events.py replay [--rate 5] [--concurrency 5] [--limit N]
+    python failed_events.py compact
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, NamedTuple, Optional, TextIO
+
+try:  # lock entre processos (Linux/macOS); sem fcntl, vale só o processo atual
+    import fcntl
+except ImportError:  # pragma: no cover - depende da plataforma
+    fcntl = None
+
+import fastjson
+from rd_client import TokenBucket
+
+
+class FailedEvent(NamedTuple):
+    key: str
+    item: Dict[str, Any]
+    error: str
+    attempts: int
+    failed_at: float
+    tenant: Optional[str] = None
+
+
+class FailedEventStore:
+    """
+    NDJSON só de acréscimo: uma linha por falha ({"key", "item", "error",
+    "attempts", "failed_at"}) e uma por resolução ({"key", "resolved_at"}).
+    O índice em memória (chave → tentativas) diz o que está pendente. O
+    arquivo é dividido entre processos (workers, replay pelo CLI): antes de
+    cada leitura ou gravação o índice lê as linhas que outros acrescentaram
+    (e relê tudo se o arquivo foi compactado). compact() regrava o arquivo
+    só com a última falha de cada pendente. Gravações e compactação seguram
+    um flock em `<path>.lock`: o compact do CLI não perde linhas que o
+    serviço acrescente durante a regravação. `key in store` roda a cada
+    evento com sucesso: chave fora do índice só relê o arquivo a cada
+    `refresh_interval` segundos (falha gravada por outro processo nesse
+    meio-tempo sai no replay, que a resolve como "duplicate").
+    """
+
+    def __init__(self, path: str, refresh_interval: float = 1.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._refreshed_at = float("-inf")
+        self._attempts: Dict[str, int] = {}
+        self.lines = 0
+        self.recorded = 0
+        self.resolved = 0
+        # até onde o índice leu o arquivo (e qual arquivo: compact() troca o inode)
+        self._read_pos = 0
+        self._inode: Optional[int] = None
+        self._refresh()
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._attempts)
+
+    def __contains__(self, key: str) -> bool:
+        if key not in self._attempts and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return False
+        self._refresh()
+        return key in self._attempts
+
+    def record(self, key: str, item: Dict[str, Any], error: str, tenant: Optional[str] = None) -> int:
+        """Registra uma falha; devolve o número de tentativas do evento."""
+        with self._locked():
+            self._refresh()
+            attempts = self._attempts.get(key, 0) + 1
+            self._attempts[key] = attempts
+            record = {"key": key, "item": item, "error": error, "attempts": attempts, "failed_at": time.time()}
+            if tenant is not None:
+                record["tenant"] = tenant
+            self._append(record)
+        self.recorded += 1
+        return attempts
+
+    def resolve(self, key: str) -> bool:
+        with self._locked():
+            self._refresh()
+            if self._attempts.pop(key, None) is None:
+                return False
+            self._append({"key": key, "resolved_at": time.time()})
+        self.resolved += 1
+        return True
+
+    def pending(self, limit: Optional[int] = None) -> List[FailedEvent]:
+        """Última falha de cada evento pendente, do mais antigo para o mais novo."""
+        self._refresh()
+        latest: Dict[str, FailedEvent] = {}
+        for record in self._scan():
+            key = record.get("key")
+            if key in self._attempts and "item" in record:
+                latest[key] = FailedEvent(
+                    key,
+                    record["item"],
+                    record.get("error", ""),
+                    int(record.get("attempts", 1)),
+                    record.get("failed_at", 0.0),
+                    record.get("tenant"),
+                )
+        events = list(latest.values())
+        return events[:limit] if limit else events
+
+    def compact(self) -> int:
+        """Regrava só os pendentes (de forma atômica); devolve quantas linhas saíram."""
+        with self._locked():
+            events = self.pending()
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                for event in events:
+                    fh.write(_dumps(event._asdict()))
+            os.replace(tmp, self.path)
+            removed, self.lines = self.lines - len(events), len(events)
+            st = os.stat(self.path)
+            self._inode, self._read_pos = st.st_ino, st.st_size
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        self._refresh()
+        return {
+            "path": self.path,
+            "pending": len(self._attempts),
+            "recorded": self.recorded,
+            "resolved": self.resolved,
+            "lines": self.lines,
+        }
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        """Acrescenta uma linha (chamar com _locked)."""
+        # abre a cada linha: falhas são raras e o arquivo pode ser compactado por outro processo
+        data = _dumps(record).encode("utf-8")
+        with open(self.path, "a+b") as fh:
+            start = fh.seek(0, os.SEEK_END)
+            if start:
+                fh.seek(start - 1)
+                if fh.read(1) != b"\n":
+                    # última linha cortada por uma queda: a nova não pode grudar nela
+                    data = b"\n" + data
+            fh.write(data)
+            inode = os.fstat(fh.fileno()).st_ino
+        if start == self._read_pos and inode == self._inode:
+            # ninguém gravou entre a última leitura e esta linha: o índice já a reflete
+            self._read_pos += len(data)
+            self.lines += 1
+
+    def _refresh(self) -> None:
+        """Aplica no índice as linhas novas do arquivo (de qualquer processo)."""
+        self._refreshed_at = time.monotonic()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != self._inode or st.st_size < self._read_pos:
+            # arquivo novo, compactado ou apagado: relê do começo
+            self._attempts, self.lines, self._read_pos = {}, 0, 0
+            self._inode = st.st_ino if st is not None else None
+        if st is None or st.st_size == self._read_pos:
+            return
+        with open(self.path, "rb") as fh:
+            fh.seek(self._read_pos)
+            for line in fh:
+                if not line.endswith(b"\n"):
+                    break  # linha sendo gravada por outro processo: lê na próxima vez
+                self._read_pos += len(line)
+                record = _loads(line)
+                if record is None:
+                    continue
+                self.lines += 1
+                key = record.get("key")
+                if "resolved_at" in record:
+                    self._attempts.pop(key, None)
+                elif "item" in record:
+                    self._attempts[key] = int(record.get("attempts", 1))
+
+    def _scan(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as fh:
+            for line in fh:
+                record = _loads(line)
+                if record is not None:
+                    yield record
+
+
+def _loads(line: bytes) -> Optional[Dict[str, Any]]:
+    if not line.strip():
+        return None
+    try:
+        return fastjson.loads(line)
+    except ValueError:
+        # linha cortada (queda no meio da gravação): ignora
+        return None
+
+
+def _dumps(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+class Replayer:
+    """
+    Reprocessa os pendentes de um FailedEventStore com `process(items)` (o
+    pipeline do webhook), no máximo `concurrency` eventos em andamento e
+    `rate` eventos/s (0 = sem limite). Cada chave é reenviada uma vez por
+    execução; sucesso (inclusive "duplicate"/"stale": já resolvido por outro
+    caminho) tira o evento da lista, erro soma uma tentativa. Evento de um
+    tenant é reenviado com `process(items, tenant)`.
+    """
+
+    def __init__(
+        self,
+        store: FailedEventStore,
+        process: Callable[..., Awaitable[List[Dict[str, Any]]]],
+        *,
+        rate: float = 0.0,
+        concurrency: int = 5,
+        report_every: float = 5.0,
+        out: Optional[TextIO] = None,
+    ):
+        self.store = store
+        self.process = process
+        self.rate = rate
+        self.concurrency = max(1, concurrency)
+        self.report_every = report_every
+        self.out = out
+        self.total = 0
+        self.done = 0
+        self.statuses: Dict[str, int] = {}
+        self.running = False
+        self._started = 0.0
+
+    async def run(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        events = self.store.pending(limit)
+        self.total = len(events)
+        self.running = True
+        self._started = time.monotonic()
+        bucket = TokenBucket(self.rate, burst=1) if self.rate > 0 else None
+        queue = iter(events)
+
+        async def worker() -> None:
+            for event in queue:
+                if bucket is not None:
+                    await bucket.acquire()
+                await self._replay_one(event)
+
+        reporter = asyncio.ensure_future(self._report_loop()) if self.out is not None else None
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            self.running = False
+            if reporter is not None:
+                reporter.cancel()
+            if self.out is not None:
+                self._report(final=True)
+        return self.progress()
+
+    def progress(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        return {
+            "running": self.running,
+            "total": self.total,
+            "done": self.done,
+            "statuses": dict(self.statuses),
+            "events_per_s": round(self.done / elapsed, 2) if elapsed > 0 else 0.0,
+            "rate": self.rate,
+            "concurrency": self.concurrency,
+        }
+
+    async def _replay_one(self, event: FailedEvent) -> None:
+        try:
+            args = ([event.item], event.tenant) if event.tenant is not None else ([event.item],)
+            result = (await self.process(*args))[0]
+        except Exception as e:
+            result = {"status": "error", "error": str(e)}
+        status = result.get("status", "error")
+        if status == "error":
+            self.store.record(event.key, event.item, str(result.get("error")), event.tenant)
+        else:
+            self.store.resolve(event.key)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.done += 1
+
+    async def _report_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_every)
+            self._report()
+
+    def _report(self, final: bool = False) -> None:
+        p = self.progress()
+        prefix = "[replay] fim:" if final else "[replay]"
+        statuses = " ".join(f"{k} {v}" for k, v in sorted(p["statuses"].items())) or "-"
+        print(f"{prefix} {p['done']}/{p['total']} | {statuses} | {p['events_per_s']:.1f} eventos/s", file=self.out, flush=True)
+
+
+async def _main(args: argparse.Namespace) -> int:
+    # mesmo pipeline e configuração do serviço (.env, idempotência compartilhada, mapeamento)
+    import app
+    from settings import Settings
+
+    settings = Settings.from_env(dotenv=True)
+    path = args.path or settings.failed_events_path
+    if not path:
+        print("FAILED_EVENTS_PATH vazio: armazenamento de falhas desligado", file=sys.stderr)
+        return 2
+    store = FailedEventStore(path)
+
+    if args.command == "list":
+        for event in store.pending(args.limit):
+            print(json.dumps({**event._asdict(), "evento": event.item.get("evento")}, ensure_ascii=False))
+        return 0
+    if args.command == "compact":
+        print(f"[replay] {store.compact()} linhas removidas, {len(store)} pendentes", file=sys.stderr)
+        return 0
+
+    app.configure(settings)
+    await app._start_rd()
+    try:
+        replayer = Replayer(
+            store,
+            lambda items, tenant=None: app._process_events(items, time.time(), app._tenant_named(tenant)),
+            rate=args.rate,
+            concurrency=args.concurrency,
+            report_every=args.report_every,
+            out=sys.stderr,
+        )
+        result = await replayer.run(args.limit)
+    finally:
+        await app._close_rd()
+        await app._CONTACT_STATE.aflush()
+        await app._WATERMARKS.aflush()
+        app._IDEMPOTENCY.close()
+    store.compact()
+    return 1 if result["statuses"].get("error") else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("list", "replay", "compact"))
+    parser.add_argument("--path", default=None, help="arquivo de falhas (padrão: FAILED_EVENTS_PATH)")
+    parser.add_argument("--limit", type=int, default=None, help="máximo de eventos")
+    parser.add_argument("--rate", type=float, default=5.0, help="eventos/s (0 = sem limite)")
+    parser.add_argument("--concurrency", type=int, default=5, help="eventos em andamento ao mesmo tempo")
+    parser.add_argument("--report-every", type=float, default=5.0, help="segundos entre linhas de progresso")
+    return asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
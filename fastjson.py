@@ -0,0 +1,38 @@
+import hashlib
+import json
+from typing import Any
+
+try:  # caminho rápido (C); sem orjson, cai para a stdlib
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+
+def loads(data: bytes) -> Any:
+    """Decodifica JSON (bytes). Erros de sintaxe levantam ValueError nas duas implementações."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # deixa a stdlib gerar a mensagem de erro (e cobrir casos que o orjson recusa)
+    return json.loads(data)
+
+
+def canonical_bytes(obj: Any) -> bytes:
+    """
+    Serialização canônica: chaves ordenadas, sem espaços, UTF-8 sem escapes.
+    Com orjson é uma única passada em C direto para bytes (sem str intermediária);
+    o resultado coincide com json.dumps(sort_keys=True, ensure_ascii=False,
+    separators=(",", ":")) exceto na grafia de floats em notação exponencial.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            pass  # ex.: inteiros fora de 64 bits
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def canonical_digest(obj: Any) -> str:
+    """sha256 (hex) da serialização canônica."""
+    return hashlib.sha256(canonical_bytes(obj)).hexdigest()
@@ -0,0 +1,246 @@
+import asyncio
+import heapq
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+
+class IdempotencyStore(ABC):
+    """
+    Interface dos backends de idempotência.
+
+    claim_many é o ponto central: recebe as chaves de um lote inteiro e, numa
+    única operação, devolve para cada uma se ela foi "reservada" agora (True)
+    ou se já tinha sido vista dentro do TTL (False). Chaves repetidas no mesmo
+    lote contam como duplicadas a partir da segunda ocorrência.
+
+    No event loop use as variantes assíncronas (aclaim_many, aunmark,
+    aexpire): backends com I/O levam o trabalho para uma thread.
+    """
+
+    ttl_seconds: float
+    max_keys: int
+
+    @abstractmethod
+    def claim_many(self, keys: List[str], now: float) -> List[bool]:
+        ...
+
+    @abstractmethod
+    def unmark(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def expire(self, now: float) -> None:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def close(self) -> None:
+        pass
+
+    async def aclaim_many(self, keys: List[str], now: float) -> List[bool]:
+        return self.claim_many(keys, now)
+
+    async def aunmark(self, key: str) -> None:
+        self.unmark(key)
+
+    async def aexpire(self, now: float) -> None:
+        self.expire(now)
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """
+    Chaves de idempotência em memória com TTL + limite de tamanho.
+
+    Além do dict chave → timestamp, um heap (timestamp, chave) aponta sempre
+    a marcação mais antiga: expirar ou descartar o excedente compara os
+    timestamps, mesmo que chamadas concorrentes passem `now` fora de ordem.
+    Entradas do heap de chaves remarcadas ou removidas são descartadas ao
+    chegar ao topo. Inserção e expiração em O(log n), sem varrer o cache.
+    Vale apenas para um processo.
+    """
+
+    def __init__(self, ttl_seconds: float, max_keys: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self._keys: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def seen(self, key: str, now: float) -> bool:
+        """True se a chave foi marcada há no máximo ttl_seconds."""
+        ts = self._keys.get(key)
+        return ts is not None and now - ts <= self.ttl_seconds
+
+    def mark(self, key: str, now: float) -> None:
+        self._keys[key] = now
+        heapq.heappush(self._heap, (now, key))
+        self.expire(now)
+
+    def claim_many(self, keys: List[str], now: float) -> List[bool]:
+        claimed = []
+        for key in keys:
+            if self.seen(key, now):
+                claimed.append(False)
+            else:
+                self.mark(key, now)
+                claimed.append(True)
+        return claimed
+
+    def unmark(self, key: str) -> None:
+        self._keys.pop(key, None)
+
+    def expire(self, now: float) -> None:
+        """Remove entradas vencidas e limita o tamanho (menor timestamp primeiro)."""
+        keys, heap = self._keys, self._heap
+        while heap:
+            ts, key = heap[0]
+            if keys.get(key) != ts:
+                heapq.heappop(heap)  # remarcada ou removida depois desta entrada
+            elif now - ts > self.ttl_seconds or len(keys) > self.max_keys:
+                heapq.heappop(heap)
+                del keys[key]
+            else:
+                break
+        if len(heap) > 2 * len(keys) + 64:
+            # muitas remarcações: reconstrói o heap só com as entradas vivas
+            self._heap = [(ts, key) for key, ts in keys.items()]
+            heapq.heapify(self._heap)
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._heap.clear()
+
+
+class SQLiteIdempotencyStore(IdempotencyStore):
+    """
+    Chaves de idempotência num arquivo SQLite (modo WAL), compartilhável entre
+    vários workers/processos no mesmo host e preservado entre restarts.
+
+    claim_many roda numa transação BEGIN IMMEDIATE: a leitura das chaves do
+    lote e a gravação das novas são atômicas, então dois workers que recebem
+    o mesmo evento não o processam duas vezes. A transação pode esperar o
+    lock de escrita de outro processo (até 30 s): as variantes assíncronas
+    rodam em asyncio.to_thread, e __len__ lê por uma conexão própria (no
+    WAL a leitura não espera quem escreve).
+    """
+
+    # limite conservador de parâmetros por consulta no SQLite
+    _CHUNK = 500
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: float,
+        max_keys: int,
+        *,
+        cleanup_interval: float = 60.0,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+
+        # uma conexão de escrita para o processo: as threads do to_thread usam em série
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS idempotency (
+                key TEXT PRIMARY KEY,
+                marked_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idempotency_marked_at ON idempotency (marked_at);
+            """
+        )
+        self._reader = sqlite3.connect(path, timeout=1, isolation_level=None, check_same_thread=False)
+
+    def __len__(self) -> int:
+        (count,) = self._reader.execute("SELECT COUNT(*) FROM idempotency").fetchone()
+        return count
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+        self._reader.close()
+
+    async def aclaim_many(self, keys: List[str], now: float) -> List[bool]:
+        return await asyncio.to_thread(self.claim_many, keys, now)
+
+    async def aunmark(self, key: str) -> None:
+        await asyncio.to_thread(self.unmark, key)
+
+    async def aexpire(self, now: float) -> None:
+        if now - self._last_cleanup >= self.cleanup_interval:
+            await asyncio.to_thread(self.expire, now)
+
+    def claim_many(self, keys: List[str], now: float) -> List[bool]:
+        unique = list(dict.fromkeys(keys))
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            seen = set()
+            for start in range(0, len(unique), self._CHUNK):
+                chunk = unique[start:start + self._CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT key FROM idempotency WHERE marked_at >= ? AND key IN ({','.join('?' * len(chunk))})",
+                    (now - self.ttl_seconds, *chunk),
+                ).fetchall()
+                seen.update(row[0] for row in rows)
+            fresh = [key for key in unique if key not in seen]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO idempotency (key, marked_at) VALUES (?, ?)",
+                [(key, now) for key in fresh],
+            )
+
+        claimed = []
+        for key in keys:
+            # a primeira ocorrência de uma chave nova fica com a reserva
+            if key in seen:
+                claimed.append(False)
+            else:
+                claimed.append(True)
+                seen.add(key)
+        self.expire(now)
+        return claimed
+
+    def unmark(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+
+    def expire(self, now: float) -> None:
+        """Limpeza periódica (no máximo a cada cleanup_interval): TTL + limite de chaves."""
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM idempotency WHERE marked_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM idempotency WHERE key IN "
+                "(SELECT key FROM idempotency ORDER BY marked_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_keys,),
+            )
+
+
+def create_idempotency_store(
+    backend: str,
+    ttl_seconds: float,
+    max_keys: int,
+    *,
+    path: Optional[str] = None,
+) -> IdempotencyStore:
+    """Instancia o backend configurado ("memory" ou "sqlite")."""
+    backend = (backend or "memory").lower()
+    if backend == "memory":
+        return MemoryIdempotencyStore(ttl_seconds, max_keys)
+    if backend == "sqlite":
+        return SQLiteIdempotencyStore(path or "idempotency.db", ttl_seconds, max_keys)
+    raise ValueError(f"IDEMPOTENCY_BACKEND desconhecido: {backend}")
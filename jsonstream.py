@@ -0,0 +1,267 @@
+"""
+Leitura incremental de JSON: itens de um array de topo (ou linhas NDJSON)
+entregues um a um, sem carregar o documento inteiro na memória.
+"""
+import codecs
+import re
+from typing import Any, AsyncIterable, AsyncIterator, BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
+
+import fastjson
+
+_WS = b" \t\r\n"
+_BOM = codecs.BOM_UTF8
+
+# fronteiras de um item, em bytes ('"', '\\' e os delimitadores são ASCII e
+# nunca aparecem dentro de um caractere UTF-8 multibyte): _SKIP pula, numa
+# chamada em C, tudo que não é colchete/chave fora de strings; o laço em
+# Python só roda nos delimitadores de aninhamento
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_SKIP = re.compile(rb'(?:[^"\[\]{}]+|' + _STRING + rb")*", re.DOTALL)
+_STRING_ITEM = re.compile(_STRING, re.DOTALL)
+_SCALAR_END = re.compile(rb"[ \t\r\n,\]]")
+
+# cortes tentados por pedaço no caminho rápido (cada tentativa falha custa um parse do trecho)
+_BATCH_TRIES = 3
+
+
+def _last_object_end(buf: bytearray, start: int, end: int) -> Optional[int]:
+    """Posição da última ',' em buf[start:end] precedida (fora brancos) por '}' (olha só as últimas vírgulas)."""
+    comma = buf.rfind(b",", start, end)
+    for _ in range(64):
+        if comma <= start:
+            break
+        before = comma - 1
+        while before > start and buf[before] in _WS:
+            before -= 1
+        if buf[before] == 0x7D:  # }
+            return comma
+        comma = buf.rfind(b",", start, comma)
+    return None
+
+
+# estados do parser de array
+_START, _FIRST, _ITEM, _AFTER_ITEM, _DONE = range(5)
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class NotAnArrayError(JSONStreamError):
+    """O documento não começa com '[' (pode ser outro JSON válido ou lixo)."""
+
+
+class ArrayStreamParser:
+    """
+    Parser "push" de um array JSON de topo.
+
+    feed(pedaço) devolve os itens que ficaram completos; close() valida o
+    fim do documento e devolve o que restar. Os itens são decodificados com
+    fastjson.loads (orjson) depois de achadas as fronteiras: os itens
+    completos de um pedaço vão numa chamada só (_batch) e, quando o corte
+    rápido não serve, a varredura de _item_end acha o fim item a item. Só o
+    item em andamento fica no buffer — acima de max_item_size bytes o
+    parser desiste.
+    """
+
+    def __init__(self, max_item_size: int = 1 << 20):
+        self.max_item_size = max_item_size
+        self.count = 0
+        self._buf = bytearray()
+        self._offset = 0
+        self._state = _START
+        # varredura do item em andamento, retomada no próximo pedaço
+        self._scan = 0
+        self._depth = 0
+
+    def feed(self, chunk: Union[bytes, str]) -> List[Any]:
+        self._buf += chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        return self._parse(final=False)
+
+    def close(self) -> List[Any]:
+        items = self._parse(final=True)
+        if self._state != _DONE:
+            raise JSONStreamError("array JSON incompleto" if self._state != _START else "corpo vazio")
+        return items
+
+    def _parse(self, final: bool) -> List[Any]:
+        buf, pos, items = self._buf, 0, []
+        n = len(buf)
+        if self._state == _START and self._offset == 0:
+            if n < len(_BOM) and _BOM.startswith(bytes(buf)) and not final:
+                return items  # BOM possivelmente partido entre pedaços
+            if buf.startswith(_BOM):
+                pos = len(_BOM)
+        while True:
+            while pos < n and buf[pos] in _WS:
+                pos += 1
+            if pos == n:
+                break
+            ch = buf[pos]
+            if self._state == _DONE:
+                raise JSONStreamError(f"conteúdo após o fim do array (posição {self._offset + pos})")
+            if self._state == _START:
+                if ch != 0x5B:  # [
+                    raise NotAnArrayError("esperado um array JSON no topo")
+                self._state = _FIRST
+                pos += 1
+                continue
+            if self._state == _AFTER_ITEM:
+                if ch not in b",]":
+                    raise JSONStreamError(f"esperado ',' ou ']' (posição {self._offset + pos})")
+                self._state = _ITEM if ch == 0x2C else _DONE
+                pos += 1
+                continue
+            if ch == 0x5D and self._state == _FIRST:  # ]
+                self._state = _DONE
+                pos += 1
+                continue
+            if ch in b",]":
+                raise JSONStreamError(f"valor esperado (posição {self._offset + pos})")
+            batch = self._batch(buf, pos, final)
+            if batch is not None:
+                decoded, pos = batch
+                items.extend(decoded)
+                self.count += len(decoded)
+                self._state = _DONE if final else _AFTER_ITEM
+                self._scan = self._depth = 0
+                continue
+            end = self._item_end(buf, pos, final)
+            if end is None:
+                break  # item ainda incompleto: espera o próximo pedaço
+            try:
+                items.append(fastjson.loads(buf[pos:end]))
+            except ValueError as e:
+                raise JSONStreamError(f"JSON inválido (item na posição {self._offset + pos}): {e}") from e
+            self.count += 1
+            self._state = _AFTER_ITEM
+            self._scan = self._depth = 0
+            pos = end
+
+        del buf[:pos]
+        self._offset += pos
+        self._scan = max(0, self._scan - pos)
+        if len(buf) > self.max_item_size:
+            raise JSONStreamError(f"item maior que {self.max_item_size} bytes (ou JSON inválido)")
+        return items
+
+    def _batch(self, buf: bytearray, start: int, final: bool) -> Optional[Tuple[List[Any], int]]:
+        """
+        Caminho rápido: decodifica de uma vez os itens de `start` até um '}'
+        seguido de ',' (ou até o fim do documento, no close). Se o corte cair
+        dentro de uma string ou de um objeto aninhado, o trecho não é JSON
+        válido e o chamador volta para a varredura item a item.
+        """
+        if final:
+            cuts = [len(buf)]
+        else:
+            cuts, end = [], len(buf)
+            while len(cuts) < _BATCH_TRIES:
+                match = _last_object_end(buf, start, end)
+                if match is None:
+                    break
+                cuts.append(match)
+                end = match
+        for cut in cuts:
+            try:
+                decoded = fastjson.loads(b"[" + buf[start:cut] + (b"" if final else b"]"))
+            except ValueError:
+                continue
+            return decoded, cut
+        return None
+
+    def _item_end(self, buf: bytearray, start: int, final: bool) -> Optional[int]:
+        """Fim (exclusivo) do item que começa em `start`, ou None se ainda não chegou."""
+        first = buf[start]
+        if first not in b'{["':
+            # número ou literal: vai até o próximo separador (ou o fim do documento)
+            match = _SCALAR_END.search(buf, start)
+            if match is not None:
+                return match.start()
+            return len(buf) if final else None
+
+        if first == 0x22:  # "
+            match = _STRING_ITEM.match(buf, start)
+            if match is not None:
+                return match.end()
+        else:
+            pos = max(self._scan, start + 1)
+            if self._scan == 0:
+                self._depth = 1
+            n = len(buf)
+            while True:
+                pos = _SKIP.match(buf, pos).end()
+                if pos == n or buf[pos] == 0x22:
+                    break  # fim do buffer ou string ainda sem o fechamento: retoma daqui
+                self._depth += 1 if buf[pos] in b"[{" else -1
+                pos += 1
+                if self._depth == 0:
+                    return pos
+            self._scan = pos
+        if final:
+            raise JSONStreamError("array JSON incompleto")
+        return None
+
+
+def iter_array(chunks: Iterable[Union[bytes, str]], *, max_item_size: int = 1 << 20) -> Iterator[Any]:
+    parser = ArrayStreamParser(max_item_size)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+async def aiter_array(chunks: AsyncIterable[bytes], *, max_item_size: int = 1 << 20) -> AsyncIterator[Any]:
+    parser = ArrayStreamParser(max_item_size)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+    for item in parser.close():
+        yield item
+
+
+def iter_ndjson(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Um valor JSON por linha; linhas em branco são ignoradas."""
+    pending = b""
+    line_no = 0
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield _loads_line(line, line_no)
+    if pending.strip():
+        yield _loads_line(pending, line_no + 1)
+
+
+def _loads_line(line: bytes, line_no: int) -> Any:
+    try:
+        return fastjson.loads(line)
+    except ValueError as e:
+        raise JSONStreamError(f"linha {line_no}: JSON inválido") from e
+
+
+def iter_records(fh: BinaryIO, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Itens de um arquivo aberto em modo binário: array JSON de topo ou NDJSON
+    (detectado pelo primeiro caractere não branco).
+    """
+    first = fh.read(chunk_size)
+    if first.startswith(_BOM):
+        first = first[len(_BOM):]
+    while first and not first.strip():
+        first = fh.read(chunk_size)
+    chunks = _chain_chunks(first, fh, chunk_size)
+    if first.lstrip()[:1] == b"[":
+        return iter_array(chunks)
+    return iter_ndjson(chunks)
+
+
+def _chain_chunks(first: bytes, fh: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+    if first:
+        yield first
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
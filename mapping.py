@@ -0,0 +1,217 @@
+"""
+Motor de mapeamento Mercos → RD guiado por especificação declarativa.
+
+A especificação (JSON, ou YAML se PyYAML estiver instalado) lista os campos:
+
+    {"fields": [
+        {"target": "name", "source": "razao_social"},
+        {"target": "personal_phone", "source": "telefones[].numero|telefone|fone", "transform": "str"},
+        {"target": "country", "source": "pais", "default": "BR"},
+        {"target": "custom_fields.cnpj", "source": "cnpj", "type": "str", "transform": "digits"}
+    ]}
+
+- source: caminho em "dados" com "." para objetos aninhados; "lista[]" percorre
+  os itens e usa o primeiro valor não vazio; "a|b|c" no último trecho tenta as
+  chaves em ordem (em cada item)
+- target: chave no payload do RD; "custom_fields.x" vai para custom_fields
+- default: usado quando a chave não existe em "dados"
+- transform: nome ou lista de nomes em TRANSFORMS, aplicados em sequência
+  ("digits" tira a pontuação do CNPJ/CEP, "e164" normaliza telefones); o
+  mapping.json padrão não usa esses dois, para manter o payload de sempre
+- type: nome em TYPES; valor presente de outro tipo → ValueError (o evento
+  falha em vez de mandar lixo ao RD, como fazia a validação do modelo)
+
+Valores vazios (None, "", [], 0) não são enviados — mesma regra do mapeamento
+original. compile_mapping gera uma única função Python especializada, que lê
+só os caminhos referenciados.
+"""
+import json
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+Mapper = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+DEFAULT_SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mapping.json")
+
+_NON_DIGITS = re.compile(r"\D+")
+
+
+def _digits(value: Any) -> str:
+    """Remove pontuação: "00.000.000/0001-00" → "00000000000100"."""
+    return _NON_DIGITS.sub("", str(value))
+
+
+def _e164(value: Any, default_country: str = "55") -> Optional[str]:
+    """
+    Normaliza telefone para E.164. Números brasileiros sem DDI (10/11 dígitos)
+    recebem +55; "00" internacional vira "+". Curto demais → None (não envia).
+    """
+    raw = str(value).strip()
+    digits = _digits(raw)
+    if raw.startswith("00"):
+        digits = digits[2:]
+    elif not raw.startswith("+") and len(digits) in (10, 11):
+        digits = default_country + digits
+    if len(digits) < 8:
+        return None
+    return f"+{digits}"
+
+
+TRANSFORMS: Dict[str, Callable[[Any], Any]] = {
+    "str": str,
+    "strip": lambda v: str(v).strip(),
+    "upper": lambda v: str(v).upper(),
+    "lower": lambda v: str(v).lower(),
+    "digits": _digits,
+    "e164": _e164,
+}
+
+TYPES: Dict[str, Any] = {
+    "str": str,
+    "int": int,
+    "number": (int, float),
+    "bool": bool,
+}
+
+
+class MappingSpecError(ValueError):
+    pass
+
+
+def load_spec(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as fh:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError as e:
+                raise MappingSpecError("Especificação YAML requer o pacote PyYAML") from e
+            return yaml.safe_load(fh)
+        return json.load(fh)
+
+
+def _compile_source(source: str, indent: str) -> List[str]:
+    """
+    Código que resolve `source` e deixa o valor em `v` (None se ausente).
+    Suporta um trecho "lista[]" seguido do(s) campo(s) lido(s) em cada item.
+    """
+    if "[]" not in source:
+        parts = source.split(".")
+        keys = parts[-1].split("|")
+        container = "dados"
+        lines = []
+        if len(parts) > 1:
+            container = "c"
+            lines.append(f"{indent}c = dados")
+            for part in parts[:-1]:
+                lines.append(f"{indent}c = c.get({part!r}) if isinstance(c, dict) else None")
+            lines.append(f"{indent}c = c if isinstance(c, dict) else EMPTY")
+        lines.append(f"{indent}v = {container}.get({keys[0]!r})")
+        for key in keys[1:]:
+            lines.append(f"{indent}if not v:")
+            lines.append(f"{indent}    v = {container}.get({key!r})")
+        return lines
+
+    head, sep, tail = source.partition("[].")
+    if not sep or "[]" in tail or "[]" in head or not tail:
+        raise MappingSpecError(f"Caminho inválido: {source!r}")
+    lines = [f"{indent}c = dados"]
+    for part in head.split("."):
+        lines.append(f"{indent}c = c.get({part!r}) if isinstance(c, dict) else None")
+    tail_parts = tail.split(".")
+    keys = tail_parts[-1].split("|")
+    lines.append(f"{indent}v = None")
+    lines.append(f"{indent}for it in (c if isinstance(c, list) else ()):")
+    for part in tail_parts[:-1]:
+        lines.append(f"{indent}    it = it.get({part!r}) if isinstance(it, dict) else None")
+    lines.append(f"{indent}    if not isinstance(it, dict):")
+    lines.append(f"{indent}        continue")
+    for key in keys:
+        lines.append(f"{indent}    v = it.get({key!r})")
+        lines.append(f"{indent}    if v:")
+        lines.append(f"{indent}        break")
+    lines.append(f"{indent}else:")
+    lines.append(f"{indent}    v = None")
+    return lines
+
+
+def compile_mapping(spec: Dict[str, Any]) -> Mapper:
+    """Compila a especificação numa função dados → payload RD."""
+    fields = (spec or {}).get("fields")
+    if not isinstance(fields, list) or not fields:
+        raise MappingSpecError("Especificação sem 'fields'")
+
+    namespace: Dict[str, Any] = {"EMPTY": {}}
+    code = [
+        "def mapper(dados):",
+        "    if not isinstance(dados, dict):",
+        "        raise TypeError('dados deve ser um objeto')",
+        "    body = {}",
+    ]
+    for index, field in enumerate(fields):
+        target, source = field.get("target"), field.get("source")
+        if not target or not source:
+            raise MappingSpecError(f"Campo {index}: 'target' e 'source' são obrigatórios")
+
+        code.append(f"    # {target!r} <- {source!r}")
+        code.extend(_compile_source(source, "    "))
+
+        if "default" in field:
+            if "." in source or "[]" in source or "|" in source:
+                raise MappingSpecError(f"Campo {index}: 'default' só vale para campos simples")
+            namespace[f"d{index}"] = field["default"]
+            code.append(f"    if {source!r} not in dados:")
+            code.append(f"        v = d{index}")
+
+        if "type" in field:
+            if field["type"] not in TYPES:
+                raise MappingSpecError(f"Campo {index}: type desconhecido {field['type']!r}")
+            namespace[f"y{index}"] = TYPES[field["type"]]
+            code.append(f"    if v is not None and not isinstance(v, y{index}):")
+            code.append(f"        raise ValueError({source!r} + ': esperado {field['type']}, recebido ' + type(v).__name__)")
+
+        transforms = field.get("transform") or []
+        if isinstance(transforms, str):
+            transforms = [transforms]
+        code.append("    if v:")
+        for step, name in enumerate(transforms):
+            if name not in TRANSFORMS:
+                raise MappingSpecError(f"Campo {index}: transform desconhecido {name!r}")
+            namespace[f"t{index}_{step}"] = TRANSFORMS[name]
+            code.append(f"        v = t{index}_{step}(v)")
+        target_parts = target.split(".")
+        if len(target_parts) == 1:
+            assign = f"body[{target!r}] = v"
+        elif len(target_parts) == 2:
+            assign = f"body.setdefault({target_parts[0]!r}, {{}})[{target_parts[1]!r}] = v"
+        else:
+            raise MappingSpecError(f"Campo {index}: target com mais de um nível: {target!r}")
+        if transforms:
+            code.append("        if v:")
+            code.append(f"            {assign}")
+        else:
+            code.append(f"        {assign}")
+
+    code.append("    return body")
+    source_code = "\n".join(code)
+    exec(compile(source_code, "<mapping-spec>", "exec"), namespace)
+    mapper = namespace["mapper"]
+    mapper.source_code = source_code  # útil para depuração
+    return mapper
+
+
+def load_mapper(path: Optional[str] = None) -> Mapper:
+    """Carrega e compila a especificação (padrão: mapping.json ao lado deste módulo)."""
+    return compile_mapping(load_spec(path or DEFAULT_SPEC_PATH))
+
+
+def lazy_mapper(path: Optional[str] = None) -> Mapper:
+    """Como load_mapper, mas só lê e compila a especificação na primeira chamada."""
+    compiled: List[Mapper] = []
+
+    def mapper(dados: Dict[str, Any]) -> Dict[str, Any]:
+        if not compiled:
+            compiled.append(load_mapper(path))
+        return compiled[0](dados)
+
+    return mapper
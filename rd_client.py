@@ -1,17 +1,413 @@
 import asyncio
+import importlib.util
+import logging
 import time
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Any, NamedTuple, Optional, List, Tuple
 
 import httpx
 
+import fastjson
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Métricas do cliente (process-wide; ver metrics.py)
+RD_CALL_SECONDS = metrics.REGISTRY.histogram(
+    "rd_client_call_seconds", "Duração das chamadas do RDClient, incluindo retries e backoff", ("method",)
+)
+RD_RETRIES = metrics.REGISTRY.counter("rd_client_retries_total", "Retentativas de requisições ao RD", ("reason",))
+RD_BACKOFF_SECONDS = metrics.REGISTRY.counter(
+    "rd_client_backoff_seconds_total", "Tempo total de espera (backoff/Retry-After) antes de retentar"
+)
+RD_NEGATIVE_HITS = metrics.REGISTRY.counter(
+    "rd_client_negative_cache_hits_total", "Requisições já recusadas pelo RD que falharam sem chamar o RD"
+)
+
+# respostas definitivas: o mesmo payload vai ser recusado de novo
+REJECTION_STATUSES = (400, 422)
+
+
+class TokenBucket:
+    """
+    Limitador token bucket (assíncrono) com taxa adaptativa.
+
+    Cada acquire() reserva um token; sem saldo, o chamador dorme até a sua vez
+    (o saldo pode ficar negativo, o que mantém a ordem de chegada sem lock).
+    A taxa cai pela metade a cada 429 (respeitando Retry-After como pausa) e
+    volta a subir aos poucos a cada sucesso, até a taxa configurada.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        *,
+        burst: Optional[float] = None,
+        min_rate: float = 0.1,
+        increase_step: Optional[float] = None,
+    ):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.min_rate = min(min_rate, rate)
+        self.increase_step = increase_step if increase_step is not None else rate * 0.05
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """Aguarda a vez de enviar; retorna quanto tempo esperou (segundos)."""
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens -= 1
+        wait = max(0.0, -self._tokens / self.rate, self._paused_until - now)
+        self.acquired += 1
+        if wait > 0:
+            self.waits += 1
+            self.wait_seconds += wait
+            await asyncio.sleep(wait)
+        return wait
+
+    def on_success(self) -> None:
+        if self.rate < self.max_rate:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = min(self._tokens, 0.0)
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": round(self.rate, 3),
+            "max_rate": self.max_rate,
+            "acquired": self.acquired,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "throttled": self.throttled,
+        }
+
+
+class ConnectionStats:
+    """
+    Estatísticas do pool de conexões via extensão "trace" do httpx/httpcore.
+
+    - pool wait: tempo entre o início da requisição e o primeiro evento de rede
+      (abrir conexão ou enviar cabeçalhos), ou seja, a espera por uma conexão
+    - reuso: requisições que não precisaram abrir conexão TCP nova
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.pool_wait_seconds = 0.0
+        self.pool_wait_max = 0.0
+
+    def tracer(self) -> Callable[[str, Dict[str, Any]], Awaitable[None]]:
+        start = time.monotonic()
+        waited = False
+
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            nonlocal waited
+            if event == "connection.connect_tcp.started":
+                self.new_connections += 1
+            if not waited and (event == "connection.connect_tcp.started" or event.endswith("send_request_headers.started")):
+                waited = True
+                wait = time.monotonic() - start
+                self.requests += 1
+                self.pool_wait_seconds += wait
+                self.pool_wait_max = max(self.pool_wait_max, wait)
+
+        return trace
+
+    def stats(self) -> Dict[str, Any]:
+        reused = max(0, self.requests - self.new_connections)
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+            "pool_wait_seconds": round(self.pool_wait_seconds, 4),
+            "pool_wait_max": round(self.pool_wait_max, 4),
+            "pool_wait_avg": round(self.pool_wait_seconds / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+class CircuitOpenError(Exception):
+    """RD indisponível (circuito aberto): a chamada nem foi feita; tente após retry_after segundos."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"RD indisponível (circuito aberto); tente novamente em {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class KnownRejectionError(Exception):
+    """O RD já recusou este e-mail + payload (400/422); a chamada nem foi feita."""
+
+    def __init__(self, error_class: str, detail: str, retry_after: float):
+        super().__init__(f"recusado pelo RD ({error_class}: {detail}); não reenviado por mais {retry_after:.0f}s")
+        self.error_class = error_class
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class _Rejection:
+    __slots__ = ("email", "error_class", "detail", "expires_at", "hits", "first_seen")
+
+    def __init__(self, email, error_class, detail, expires_at, hits, first_seen):
+        self.email = email
+        self.error_class = error_class
+        self.detail = detail
+        self.expires_at = expires_at
+        self.hits = hits
+        self.first_seen = first_seen
+
+
+class NegativeCache:
+    """
+    Cache negativo das recusas definitivas do RD (400/422), por e-mail +
+    hash do payload: o mesmo pedido falha na hora, sem chamar o RD, por
+    `ttl` segundos. Payload diferente (ex.: dado corrigido no Mercos) passa.
+    LRU limitado a max_entries; offenders() lista os casos que mais se
+    repetem (e-mail inválido, custom field que não existe no RD...).
+    """
+
+    def __init__(self, ttl: float, *, max_entries: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[Tuple[str, str], _Rejection]" = OrderedDict()
+        self.hits = 0
+        self.added = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def check(self, email: str, payload_hash: str) -> Optional[_Rejection]:
+        """Recusa ainda válida para este pedido (conta um acerto), ou None."""
+        entry = self._entries.get((email, payload_hash))
+        if entry is None or self.clock() >= entry.expires_at:
+            return None
+        entry.hits += 1
+        self.hits += 1
+        RD_NEGATIVE_HITS.inc()
+        return entry
+
+    def add(self, email: str, payload_hash: str, error_class: str, detail: str) -> None:
+        key = (email, payload_hash)
+        now = self.clock()
+        previous = self._entries.pop(key, None)
+        hits, first_seen = (previous.hits, previous.first_seen) if previous is not None else (0, now)
+        self._entries[key] = _Rejection(email, error_class, detail, now + self.ttl, hits, first_seen)
+        self.added += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> int:
+        """Esquece todas as recusas (ex.: custom field criado no RD); devolve quantas saíram."""
+        removed = len(self._entries)
+        self._entries.clear()
+        return removed
+
+    def offenders(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Recusas em vigor, das mais repetidas para as menos."""
+        now = self.clock()
+        active = [e for e in self._entries.values() if e.expires_at > now]
+        active.sort(key=lambda e: e.hits, reverse=True)
+        return [
+            {
+                "email": e.email,
+                "error": e.error_class,
+                "detail": e.detail,
+                "blocked": e.hits,
+                "expires_in": round(e.expires_at - now, 1),
+            }
+            for e in active[:limit]
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ttl": self.ttl, "entries": len(self._entries), "hits": self.hits, "added": self.added}
+
+
+def _rejection_of(resp: httpx.Response) -> Tuple[str, str]:
+    """(classe do erro, detalhe) de uma resposta 400/422: status + error_type do RD, se houver."""
+    try:
+        errors = resp.json().get("errors")
+    except Exception:
+        errors = None
+    first = errors[0] if isinstance(errors, list) and errors else errors
+    error_type = first.get("error_type") if isinstance(first, dict) else None
+    detail = resp.text[:300]
+    return (f"{resp.status_code}:{error_type}" if error_type else str(resp.status_code)), detail
+
+
+class CircuitBreaker:
+    """
+    Disjuntor para indisponibilidade do RD.
+
+    - closed: conta sucessos/falhas (erros de rede e 5xx) numa janela
+      deslizante de window_seconds (baldes de 1 s); com pelo menos
+      min_requests e taxa de falha >= failure_ratio, abre
+    - open: toda chamada falha na hora (CircuitOpenError) por open_seconds
+    - half_open: deixa passar até half_open_max chamadas de teste; sucesso
+      fecha o circuito, falha reabre
+
+    429 não conta como falha: é limite de taxa (ver TokenBucket), não queda.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        *,
+        failure_ratio: float = 0.5,
+        min_requests: int = 20,
+        window_seconds: float = 30.0,
+        open_seconds: float = 30.0,
+        half_open_max: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max = half_open_max
+        self._clock = clock
+        self.state = self.CLOSED
+        self._buckets: "deque[List[int]]" = deque()  # [segundo, total, falhas]
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    def retry_after(self) -> Optional[float]:
+        """Segundos até a próxima tentativa se o circuito está aberto; None se chamadas passam."""
+        if self.state == self.CLOSED:
+            return None
+        now = self._clock()
+        if self.state == self.OPEN:
+            remaining = self._opened_at + self.open_seconds - now
+            return remaining if remaining > 0 else None
+        if self._probes >= self.half_open_max and now - self._probe_started < self.open_seconds:
+            return max(1.0, self._probe_started + self.open_seconds - now)
+        return None
+
+    def before_request(self) -> None:
+        """Levanta CircuitOpenError se a chamada não deve sair agora."""
+        if self.state == self.CLOSED:
+            return
+        wait = self.retry_after()
+        if wait is not None:
+            self.rejected += 1
+            raise CircuitOpenError(wait)
+        if self.state == self.OPEN or self._probes >= self.half_open_max:
+            # fim da pausa (ou teste anterior sem resposta, ex.: cancelado): nova rodada de testes
+            self.state = self.HALF_OPEN
+            self._probes = 0
+        self._probes += 1
+        self._probe_started = self._clock()
+
+    def record_success(self) -> None:
+        if self.state == self.HALF_OPEN:
+            self.state = self.CLOSED
+            self._buckets.clear()
+            return
+        self._record(False)
+
+    def record_failure(self) -> None:
+        if self.state == self.HALF_OPEN:
+            self._open()
+            return
+        if self.state == self.OPEN:
+            return
+        self._record(True)
+        total = sum(b[1] for b in self._buckets)
+        failures = sum(b[2] for b in self._buckets)
+        if total >= self.min_requests and failures >= self.failure_ratio * total:
+            self._open()
+
+    def _record(self, failed: bool) -> None:
+        second = int(self._clock())
+        buckets = self._buckets
+        if not buckets or buckets[-1][0] != second:
+            buckets.append([second, 0, 0])
+        buckets[-1][1] += 1
+        buckets[-1][2] += failed
+        while buckets[0][0] <= second - self.window_seconds:
+            buckets.popleft()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = self._clock()
+        self._buckets.clear()
+        self.opened += 1
+        logger.warning("RD: circuito aberto por %.0fs (falhas em excesso)", self.open_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "retry_after": self.retry_after(),
+            "window_requests": sum(b[1] for b in self._buckets),
+            "window_failures": sum(b[2] for b in self._buckets),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class SyncResult(NamedTuple):
+    contact: Dict[str, Any]
+    created: bool
+    tags_sent: List[str]  # tags enviadas nesta sincronização (no create ou no /tag)
+    tags_error: Optional[str]  # falha ao taguear (o upsert em si deu certo)
+
+
+def create_http_client(
+    *,
+    timeout: float = 20.0,
+    user_agent: str = "mercos-rd-integration/1.0",
+    limits: Optional[httpx.Limits] = None,
+    http2: bool = False,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> httpx.AsyncClient:
+    """AsyncClient para o RD; pode ser compartilhado por vários RDClient (http_client=...)."""
+    return httpx.AsyncClient(
+        timeout=timeout,
+        headers={"User-Agent": user_agent},
+        limits=limits or httpx.Limits(),
+        http2=http2 and importlib.util.find_spec("h2") is not None,
+        transport=transport,
+    )
+
 
 class RDClient:
     """
     Cliente RD Station Marketing (API 2.0) com:
-      - Renovação automática do access_token via refresh_token
-      - Reuso de conexão (AsyncClient)
+      - Renovação automática do access_token via refresh_token (single-flight,
+        com renovação proativa opcional em background)
+      - Reuso de conexão (AsyncClient) com pool configurável e HTTP/2 opcional
       - Retries com backoff para 429/5xx
       - Retry automático após 401 (refresh e reenvio)
+      - Limite de taxa no cliente (token bucket por família de endpoint:
+        "contacts" e "tag"), adaptado pelos 429/Retry-After do RD
+      - Cache negativo opcional: upsert que o RD já recusou (400/422) com o
+        mesmo e-mail + payload falha na hora
     """
 
     BASE_URL = "https://api.rd.services"
@@ -27,6 +423,17 @@ class RDClient:
         max_retries: int = 3,
         backoff_base: float = 0.5,  # segundos
         user_agent: str = "mercos-rd-integration/1.0",
+        rate_limits: Optional[Dict[str, float]] = None,  # req/s por família; ausente = sem limite
+        max_connections: Optional[int] = 100,
+        max_keepalive_connections: Optional[int] = 20,
+        keepalive_expiry: Optional[float] = 5.0,  # segundos
+        http2: bool = False,  # requer o pacote "h2"
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        known_contacts_max: int = 50000,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        negative_cache: Optional[NegativeCache] = None,
+        http_client: Optional[httpx.AsyncClient] = None,  # pool compartilhado (não é fechado no aclose)
+        rate_limiter_factory: Optional[Callable[[str, float], TokenBucket]] = None,  # (família, taxa) → limitador
     ):
         self.client_id = client_id
         self.client_secret = client_secret
@@ -34,26 +441,75 @@ class RDClient:
 
         self._access_token: Optional[str] = None
         self._expires_at: float = 0.0
+        # refresh "single-flight": no máximo um POST /auth/token em andamento
+        self._refresh_task: Optional[asyncio.Future] = None
+        self._refresher: Optional[asyncio.Task] = None
+        self.token_refreshes = 0
 
         self.timeout = timeout
         self.max_retries = max_retries
         self.backoff_base = backoff_base
         self.user_agent = user_agent
 
-        self._client: Optional[httpx.AsyncClient] = None
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 solicitado mas o pacote 'h2' não está instalado; usando HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.transport = transport
+        self.connection_stats = ConnectionStats()
+
+        self._client: Optional[httpx.AsyncClient] = http_client
+        self._owns_client = http_client is None
+
+        # contatos que sabemos existir no RD → tags já aplicadas (LRU limitado)
+        self.known_contacts_max = known_contacts_max
+        self._known_contacts: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._sync_stats = {"synced": 0, "created": 0, "tag_calls": 0, "tags_skipped": 0}
+
+        # falha rápida durante indisponibilidade do RD (None = desligado)
+        self.circuit_breaker = circuit_breaker
+
+        # recusas 400/422 já vistas: falham na hora, sem gastar cota (None = desligado)
+        self.negative_cache = negative_cache
+
+        # limitador por família; rate_limiter_factory permite um orçamento dividido entre processos
+        make_limiter = rate_limiter_factory or (lambda family, rate: TokenBucket(rate))
+        self._limiters: Dict[str, TokenBucket] = {
+            family: make_limiter(family, rate) for family, rate in (rate_limits or {}).items() if rate and rate > 0
+        }
 
     # ------------- Infra ------------- #
 
     async def _ensure_client(self) -> httpx.AsyncClient:
         if self._client is None:
-            self._client = httpx.AsyncClient(timeout=self.timeout, headers={"User-Agent": self.user_agent})
+            # pool próprio (inclusive depois de um aclose com pool compartilhado): fechado no aclose
+            self._owns_client = True
+            self._client = create_http_client(
+                timeout=self.timeout,
+                user_agent=self.user_agent,
+                limits=self.limits,
+                http2=self.http2,
+                transport=self.transport,
+            )
         return self._client
 
     async def aclose(self):
+        await self.stop_token_refresher()
         if self._client is not None:
-            await self._client.aclose()
+            if self._owns_client:
+                await self._client.aclose()
             self._client = None
 
+    async def warm_up(self) -> None:
+        """Abre o pool e obtém o access_token já no startup (a primeira requisição não espera o refresh)."""
+        await self._ensure_client()
+        await self._get_access_token()
+
     async def __aenter__(self):
         await self._ensure_client()
         return self
@@ -64,6 +520,17 @@ class RDClient:
     # ------------- Auth ------------- #
 
     async def _refresh_access_token(self):
+        """
+        Renova o access_token. Chamadas concorrentes aguardam o mesmo refresh
+        em andamento em vez de disparar um POST cada (evita "thundering herd").
+        """
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._do_refresh_access_token())
+        with tracing.span("rd_token"):
+            await asyncio.shield(self._refresh_task)
+
+    @metrics.timed(RD_CALL_SECONDS.labels("refresh_access_token"))
+    async def _do_refresh_access_token(self):
         client = await self._ensure_client()
         resp = await client.post(
             self.TOKEN_URL,
@@ -80,79 +547,196 @@ class RDClient:
         self._access_token = data["access_token"]
         # alguns tenants retornam expires_in (segundos)
         self._expires_at = time.time() + int(data.get("expires_in", 900))
+        self.token_refreshes += 1
 
     async def _get_access_token(self) -> str:
         if not self._access_token or time.time() >= self._expires_at - 30:
             await self._refresh_access_token()
         return self._access_token  # type: ignore
 
+    def start_token_refresher(self, margin: float = 120.0, retry_delay: float = 5.0) -> None:
+        """
+        Inicia a renovação proativa em background: o token é trocado `margin`
+        segundos antes de _expires_at, então nenhuma requisição espera pelo
+        refresh no caminho quente. Também serve de pré-aquecimento (renova já
+        se ainda não houver token).
+        """
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.create_task(self._refresh_loop(margin, retry_delay))
+
+    async def stop_token_refresher(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except (asyncio.CancelledError, RuntimeError):
+                pass
+            self._refresher = None
+
+    async def _refresh_loop(self, margin: float, retry_delay: float) -> None:
+        while True:
+            if self._access_token:
+                # tokens curtos (validade < 2*margin) são renovados na metade da validade
+                remaining = self._expires_at - time.time()
+                delay = remaining - min(margin, remaining / 2)
+                if remaining <= 0:
+                    # RD devolveu expires_in <= 0 (ou o token venceu): sem isso o laço martela /auth/token
+                    delay = max(delay, retry_delay)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                await self._refresh_access_token()
+            except Exception:
+                # falha transitória: o caminho normal ainda renova sob demanda
+                await asyncio.sleep(retry_delay)
+
     # ------------- HTTP helpers ------------- #
 
-    async def _request(self, method: str, url: str, *, json: Any | None = None) -> httpx.Response:
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        *,
+        json: Any | None = None,
+        family: str = "contacts",
+    ) -> httpx.Response:
         """
         Envia requisição com:
           - Bearer token
+          - Espera no limitador da família do endpoint (se configurado)
           - Retry para 429/5xx com backoff exponencial
           - Em caso de 401, tenta 1x refresh + reenvio
+          - Circuito aberto (RD fora): CircuitOpenError sem chamar o RD,
+            inclusive entre retentativas
         """
         client = await self._ensure_client()
+        limiter = self._limiters.get(family)
+        breaker = self.circuit_breaker
         attempt = 0
         did_refresh = False
 
         while True:
+            if breaker is not None:
+                breaker.before_request()
             token = await self._get_access_token()
             headers = {"Authorization": f"Bearer {token}"}
 
+            if limiter is not None:
+                with tracing.span("rd_rate_limit"):
+                    await limiter.acquire()
+
             try:
-                resp = await client.request(method, url, json=json, headers=headers)
-            except httpx.HTTPError:
+                with tracing.span("rd_http"):
+                    resp = await client.request(
+                        method,
+                        url,
+                        json=json,
+                        headers=headers,
+                        extensions={"trace": self.connection_stats.tracer()},
+                    )
+            except httpx.HTTPError as e:
+                if breaker is not None:
+                    breaker.record_failure()
+                    wait = breaker.retry_after()
+                    if wait is not None:
+                        raise CircuitOpenError(wait) from e
                 # Erros de rede também entram no ciclo de retry
                 if attempt < self.max_retries:
-                    await asyncio.sleep(self._sleep_for_attempt(attempt))
+                    with tracing.span("rd_backoff"):
+                        await asyncio.sleep(self._backoff(attempt))
                     attempt += 1
                     continue
                 raise
 
+            if breaker is not None:
+                if resp.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
             # 401 - token expirado ou inválido: tenta UMA vez refresh e reenvia
             if resp.status_code == 401 and not did_refresh:
-                await self._refresh_access_token()
+                # se outra corrotina já trocou o token, basta reenviar com o novo
+                if self._access_token == token:
+                    await self._refresh_access_token()
                 did_refresh = True
                 # não conta como tentativa de backoff; vamos reenviar já
                 continue
 
+            if limiter is not None:
+                if resp.status_code == 429:
+                    limiter.on_throttle(self._retry_after(resp))
+                elif resp.status_code < 500:
+                    limiter.on_success()
+
             # 429 ou 5xx → backoff/retry
             if resp.status_code in (429, 500, 502, 503, 504):
+                wait = breaker.retry_after() if breaker is not None else None
+                if wait is not None:
+                    # o circuito abriu: não adianta esperar o backoff
+                    raise CircuitOpenError(wait)
                 if attempt < self.max_retries:
-                    await asyncio.sleep(self._sleep_for_attempt(attempt, resp))
+                    with tracing.span("rd_backoff"):
+                        await asyncio.sleep(self._backoff(attempt, resp))
                     attempt += 1
                     continue
 
             return resp
 
+    @staticmethod
+    def _retry_after(resp: httpx.Response) -> Optional[float]:
+        """Retry-After em segundos; http-date é ignorado."""
+        ra = resp.headers.get("Retry-After")
+        if ra:
+            try:
+                return float(ra)
+            except ValueError:
+                return None
+        return None
+
     def _sleep_for_attempt(self, attempt: int, resp: Optional[httpx.Response] = None) -> float:
         """
         Calcula o tempo de espera para retry. Respeita Retry-After (se houver).
         """
-        # Retry-After (em segundos ou data http-date)
+        # Retry-After (em segundos); se vier um http-date, usa backoff exponencial simples
         if resp is not None:
-            ra = resp.headers.get("Retry-After")
-            if ra:
-                try:
-                    return float(ra)
-                except ValueError:
-                    # se vier um http-date, ignora e usa backoff exponencial simples
-                    pass
+            ra = self._retry_after(resp)
+            if ra is not None:
+                return ra
         # Backoff exponencial com jitter simples
         base = self.backoff_base * (2 ** attempt)
         return base + (0.1 * attempt)
 
+    def _backoff(self, attempt: int, resp: Optional[httpx.Response] = None) -> float:
+        """_sleep_for_attempt + contabiliza a retentativa e o tempo de espera nas métricas."""
+        delay = self._sleep_for_attempt(attempt, resp)
+        RD_RETRIES.labels(str(resp.status_code) if resp is not None else "network").inc()
+        RD_BACKOFF_SECONDS.inc(delay)
+        return delay
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Configuração do pool + espera por conexão e taxa de reuso observadas."""
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            **self.connection_stats.stats(),
+        }
+
+    def rate_limit_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Taxa atual e tempo de espera acumulado por família de endpoint."""
+        return {family: limiter.stats() for family, limiter in self._limiters.items()}
+
     # ------------- Contacts ------------- #
 
+    @metrics.timed(RD_CALL_SECONDS.labels("upsert_contact_by_email"))
     async def upsert_contact_by_email(self, email: str, payload: Dict[str, Any]) -> Dict[str, Any]:
         """
         PATCH /platform/contacts/email:{email}
         - Se 404, fallback para POST /platform/contacts (create)
         """
+        payload_hash = self._check_rejected(email, payload)
         patch_url = f"{self.BASE_URL}/platform/contacts/email:{email}"
         resp = await self._request("PATCH", patch_url, json=payload)
 
@@ -160,23 +744,103 @@ class RDClient:
             create_url = f"{self.BASE_URL}/platform/contacts"
             payload_with_email = {"email": email, **payload}
             create_resp = await self._request("POST", create_url, json=payload_with_email)
+            self._remember_rejection(email, payload_hash, create_resp)
             create_resp.raise_for_status()
             return create_resp.json()
 
+        self._remember_rejection(email, payload_hash, resp)
         resp.raise_for_status()
         return resp.json()
 
+    def _check_rejected(self, email: str, payload: Dict[str, Any], payload_hash: Optional[str] = None) -> Optional[str]:
+        """KnownRejectionError se o RD já recusou este e-mail + payload; devolve o hash para registrar recusas."""
+        cache = self.negative_cache
+        if cache is None:
+            return None
+        if payload_hash is None:
+            payload_hash = fastjson.canonical_digest(payload)
+        entry = cache.check(email, payload_hash)
+        if entry is not None:
+            raise KnownRejectionError(entry.error_class, entry.detail, entry.expires_at - cache.clock())
+        return payload_hash
+
+    def _remember_rejection(self, email: str, payload_hash: Optional[str], resp: httpx.Response) -> None:
+        if payload_hash is not None and resp.status_code in REJECTION_STATUSES:
+            self.negative_cache.add(email, payload_hash, *_rejection_of(resp))  # type: ignore[union-attr]
+
+    @metrics.timed(RD_CALL_SECONDS.labels("add_tags"))
     async def add_tags(self, identifier: str, value: str, tags: List[str]) -> Dict[str, Any]:
         """
         POST /platform/contacts/{identifier}:{value}/tag
         - identifier: "email" ou "uuid"
         """
         url = f"{self.BASE_URL}/platform/contacts/{identifier}:{value}/tag"
-        resp = await self._request("POST", url, json={"tags": tags})
+        resp = await self._request("POST", url, json={"tags": tags}, family="tag")
         resp.raise_for_status()
+        if identifier == "email":
+            self._remember_contact(value, tags)
         return resp.json()
 
+    @metrics.timed(RD_CALL_SECONDS.labels("sync_contact"))
+    async def sync_contact(
+        self, email: str, payload: Dict[str, Any], tags: List[str], payload_hash: Optional[str] = None
+    ) -> SyncResult:
+        """
+        Upsert + tags com o mínimo de chamadas ao RD:
+          - PATCH; se 404, POST /platform/contacts já com as tags no corpo
+            (2 chamadas em vez de PATCH + POST + POST /tag)
+          - contato já conhecido: só vai ao /tag com as tags que ainda não
+            sabemos aplicadas (nenhuma chamada extra se todas já foram)
+        Falha ao taguear não derruba a sincronização: volta em `tags_error`.
+        `payload_hash` (opcional) evita recalcular o hash para o cache negativo.
+        """
+        payload_hash = self._check_rejected(email, payload, payload_hash)
+        self._sync_stats["synced"] += 1
+        patch_url = f"{self.BASE_URL}/platform/contacts/email:{email}"
+        resp = await self._request("PATCH", patch_url, json=payload)
+
+        if resp.status_code == 404:
+            create_url = f"{self.BASE_URL}/platform/contacts"
+            body = {"email": email, **payload}
+            if tags:
+                body["tags"] = list(tags)
+            create_resp = await self._request("POST", create_url, json=body)
+            self._remember_rejection(email, payload_hash, create_resp)
+            create_resp.raise_for_status()
+            self._sync_stats["created"] += 1
+            self._remember_contact(email, tags)
+            return SyncResult(create_resp.json(), True, list(tags), None)
+
+        self._remember_rejection(email, payload_hash, resp)
+        resp.raise_for_status()
+        contact = resp.json()
+        self._remember_contact(email, [])
+
+        known = self._known_contacts.get(email) or []
+        missing = [t for t in tags if t not in known]
+        self._sync_stats["tags_skipped"] += len(tags) - len(missing)
+        if not missing:
+            return SyncResult(contact, False, [], None)
+        self._sync_stats["tag_calls"] += 1
+        try:
+            await self.add_tags("email", email, missing)
+        except Exception as e:
+            return SyncResult(contact, False, [], str(e))
+        return SyncResult(contact, False, missing, None)
+
+    def _remember_contact(self, email: str, tags: List[str]) -> None:
+        known = self._known_contacts.get(email)
+        merged = list(dict.fromkeys([*(known or []), *tags]))
+        self._known_contacts[email] = merged
+        self._known_contacts.move_to_end(email)
+        while len(self._known_contacts) > self.known_contacts_max:
+            self._known_contacts.popitem(last=False)
+
+    def sync_stats(self) -> Dict[str, Any]:
+        return {**self._sync_stats, "known_contacts": len(self._known_contacts)}
+
     # (Opcional) utilitário para obter contato — útil para debug/log
+    @metrics.timed(RD_CALL_SECONDS.labels("get_contact_by_email"))
     async def get_contact_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         url = f"{self.BASE_URL}/platform/contacts/email:{email}"
         resp = await self._request("GET", url)
@@ -0,0 +1,150 @@
+"""
+Configuração do serviço em um objeto só, lida das variáveis de ambiente.
+
+Cada campo corresponde à variável de mesmo nome em maiúsculas (ex.:
+webhook_concurrency ← WEBHOOK_CONCURRENCY); o tipo vem do valor padrão.
+Ler as Settings não abre arquivos nem conexões e não falha por variável
+ausente: as credenciais do RD só são exigidas em rd_credentials(), quando
+o cliente é criado. O .env só é carregado com from_env(dotenv=True) — no
+app isso acontece no startup (lifespan), não no import.
+"""
+import os
+from dataclasses import dataclass, fields
+from typing import Any, Mapping, Optional, Tuple
+
+# valores que precisam ser pelo menos 1
+_AT_LEAST_ONE = (
+    "webhook_concurrency",
+    "webhook_max_pending",
+    "event_queue_workers",
+    "event_queue_batch_size",
+    "coordination_partitions",
+)
+
+
+class SettingsError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class Settings:
+    # RD Station (OAuth2)
+    rd_client_id: Optional[str] = None
+    rd_client_secret: Optional[str] = None
+    rd_refresh_token: Optional[str] = None
+    rd_token_prewarm_timeout: float = 5.0
+    rd_rate_limit_contacts: float = 0.0
+    rd_rate_limit_tags: float = 0.0
+    rd_http_max_connections: int = 100
+    rd_http_max_keepalive: int = 20
+    rd_http_keepalive_expiry: float = 5.0
+    rd_http2: bool = False
+    rd_circuit_failure_ratio: float = 0.5
+    rd_circuit_min_requests: int = 20
+    rd_circuit_window_seconds: float = 30.0
+    rd_circuit_open_seconds: float = 30.0
+    rd_negative_cache_ttl: float = 0.0
+    rd_negative_cache_max_entries: int = 10000
+    rd_default_tags: Tuple[str, ...] = ()
+
+    # Vários tenants no mesmo processo (ver tenants.py)
+    tenants_path: Optional[str] = None
+    tenant_idle_seconds: float = 300.0
+    tenant_max_in_flight: int = 20
+
+    # Webhook
+    mercos_webhook_token: Optional[str] = None
+    webhook_concurrency: int = 10
+    webhook_max_event_bytes: int = 1 << 20
+    webhook_max_pending: int = 500
+
+    # Idempotência / estado por contato / fusão
+    idempotency_backend: str = "memory"
+    idempotency_ttl_seconds: int = 3600
+    idempotency_max_keys: int = 10000
+    idempotency_db_path: str = "idempotency.db"
+    coalesce_window_seconds: float = 0.0
+    contact_state_max_entries: int = 50000
+    contact_state_path: Optional[str] = None
+    contact_state_flush_seconds: float = 30.0
+    # auto = só com um processo (sem COORDINATION_PATH, WEB_CONCURRENCY <= 1 e idempotência em memória)
+    contact_state_skip: str = "auto"
+    event_watermark_max_entries: int = 100000
+    event_watermark_path: Optional[str] = None
+    mapping_spec_path: Optional[str] = None
+    failed_events_path: Optional[str] = None
+
+    # Coordenação entre processos (ver coordination.py); WEB_CONCURRENCY é o --workers do uvicorn
+    web_concurrency: int = 1
+    coordination_path: Optional[str] = None
+    coordination_partitions: int = 64
+    coordination_lease_seconds: float = 30.0
+
+    # Fila durável
+    event_queue_path: Optional[str] = None
+    event_queue_workers: int = 2
+    event_queue_batch_size: int = 50
+    event_queue_poll_seconds: float = 0.5
+    event_queue_max_retries: int = 5
+    event_queue_retry_backoff_seconds: float = 5.0
+
+    # Tracing / profiling
+    trace_mode: str = "off"
+    profile_dir: str = "profiles"
+    profile_max_files: int = 100
+    profile_sample_rate: float = 0.0
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None, *, dotenv: bool = False) -> "Settings":
+        """
+        Lê as variáveis de `environ` (padrão: os.environ). Com dotenv=True,
+        carrega antes o .env (sem sobrescrever o que já está no ambiente).
+        """
+        if dotenv:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+        env = os.environ if environ is None else environ
+        values = {}
+        for f in fields(cls):
+            raw = env.get(f.name.upper())
+            if raw is None:
+                continue
+            try:
+                values[f.name] = _convert(raw, f.default)
+            except ValueError:
+                raise SettingsError(f"{f.name.upper()}: valor inválido {raw!r}") from None
+        for name in _AT_LEAST_ONE:
+            if name in values:
+                values[name] = max(1, values[name])
+        for name in ("trace_mode", "contact_state_skip"):
+            if name in values:
+                values[name] = values[name].lower()
+        return cls(**values)
+
+    def has_rd_credentials(self) -> bool:
+        return bool(self.rd_client_id and self.rd_client_secret and self.rd_refresh_token)
+
+    def rd_credentials(self) -> Tuple[str, str, str]:
+        """(client_id, client_secret, refresh_token); SettingsError se faltar alguma."""
+        missing = [
+            name.upper()
+            for name in ("rd_client_id", "rd_client_secret", "rd_refresh_token")
+            if not getattr(self, name)
+        ]
+        if missing:
+            raise SettingsError(f"variáveis obrigatórias ausentes: {', '.join(missing)}")
+        return self.rd_client_id, self.rd_client_secret, self.rd_refresh_token  # type: ignore
+
+
+def _convert(raw: str, default: Any) -> Any:
+    if isinstance(default, bool):
+        return raw.strip().lower() in ("1", "true", "yes")
+    if isinstance(default, tuple):
+        return tuple(t.strip() for t in raw.split(",") if t.strip())
+    if isinstance(default, (int, float)):
+        return type(default)(raw)
+    if default is None:
+        # caminho/segredo opcional: vazio = não definido
+        return raw or None
+    return raw
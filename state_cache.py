@@ -0,0 +1,156 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentLRUCache:
+    """
+    Cache LRU limitado (OrderedDict) com persistência opcional em JSON.
+
+    - get/set movem a chave para o fim; ao passar de max_entries sai a menos usada
+    - com `path`, o conteúdo é carregado na criação e regravado (de forma
+      atômica) no máximo a cada flush_interval segundos após alterações,
+      além de aflush()/flush() explícito no desligamento
+    - dentro do event loop a gravação periódica vai para uma thread
+      (asyncio.to_thread): só a cópia da lista de pares roda no loop; os
+      valores gravados são substituídos por set(), nunca alterados no lugar
+    """
+
+    def __init__(self, max_entries: int, path: Optional[str] = None, *, flush_interval: float = 30.0):
+        self.max_entries = max_entries
+        self.path = path
+        self.flush_interval = flush_interval
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self._generation = 0
+        self._written = 0
+        self._write_lock = threading.Lock()
+        self._saving: Optional["asyncio.Future[None]"] = None
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key: str, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+        self._touch()
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        value = self._data.pop(key, default)
+        self._touch()
+        return value
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._touch()
+
+    # ------------- Persistência ------------- #
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                entries = json.load(fh)
+        except (OSError, ValueError):
+            # arquivo corrompido/ilegível: começa vazio em vez de derrubar o serviço
+            return
+        if not isinstance(entries, list):
+            return
+        skipped = 0
+        for entry in entries[-self.max_entries:]:
+            # par malformado (edição manual, versão antiga) é ignorado, não derruba o startup
+            if isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], str):
+                self._data[entry[0]] = entry[1]
+            else:
+                skipped += 1
+        if skipped:
+            logger.warning("%s: %d entradas inválidas ignoradas", self.path, skipped)
+
+    def _snapshot(self) -> Tuple[int, List[Tuple[str, Any]]]:
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self._generation += 1
+        return self._generation, list(self._data.items())
+
+    def _write(self, generation: int, entries: List[Tuple[str, Any]]) -> None:
+        """Grava num temporário único e troca com os.replace; cópia mais antiga que a gravada é descartada."""
+        with self._write_lock:
+            if generation <= self._written:
+                return
+            fd, tmp = tempfile.mkstemp(
+                prefix=f"{os.path.basename(self.path)}.", suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.path))
+            )
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                    json.dump(entries, fh, ensure_ascii=False, separators=(",", ":"))
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                os.replace(tmp, self.path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(tmp)
+                raise
+            self._written = generation
+
+    def save(self) -> None:
+        """Gravação síncrona (fora do event loop: scripts, testes)."""
+        if not self.path:
+            return
+        self._write(*self._snapshot())
+
+    def flush(self) -> None:
+        """Grava só se houver alterações pendentes."""
+        if self._dirty:
+            self.save()
+
+    async def aflush(self) -> None:
+        """flush() sem bloquear o event loop; espera a gravação periódica em andamento."""
+        if self._saving is not None:
+            await asyncio.gather(self._saving, return_exceptions=True)
+        if self._dirty and self.path:
+            await asyncio.to_thread(self._write, *self._snapshot())
+
+    def _touch(self) -> None:
+        self._dirty = True
+        if self.path and time.monotonic() - self._last_flush >= self.flush_interval:
+            self._save_soon()
+
+    def _save_soon(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        if self._saving is not None and not self._saving.done():
+            return  # a próxima alteração tenta de novo
+        self._saving = loop.create_task(asyncio.to_thread(self._write, *self._snapshot()))
+        self._saving.add_done_callback(self._saved)
+
+    def _saved(self, task: "asyncio.Future[None]") -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self._dirty = True
+            logger.warning("%s: falha ao gravar o cache: %r", self.path, task.exception())
@@ -0,0 +1,207 @@
+"""
+Vários clientes (conta Mercos → conta RD) no mesmo processo.
+
+TENANTS_PATH aponta para um JSON com a lista de tenants; o webhook escolhe
+o tenant pelo ?token= da URL (cada tenant tem o seu). Cada tenant tem as
+próprias credenciais do RD, tags padrão, limites de taxa e namespace de
+idempotência/estado; todos dividem o event loop e um único pool HTTP.
+
+Os RDClient são criados no primeiro evento do tenant e fechados depois de
+TENANT_IDLE_SECONDS sem uso, então tenants parados não ocupam memória nem
+renovam token. Valores "env:NOME" no JSON são lidos da variável NOME
+(segredos fora do arquivo):
+
+    [
+      {"name": "acme", "webhook_token": "env:ACME_TOKEN",
+       "rd_client_id": "...", "rd_client_secret": "env:ACME_RD_SECRET",
+       "rd_refresh_token": "env:ACME_RD_REFRESH", "default_tags": ["mercos"],
+       "rate_limit_contacts": 2}
+    ]
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, fields
+from typing import Any, AsyncIterator, Callable, Dict, List, Mapping, Optional, Tuple
+
+from rd_client import RDClient
+from settings import SettingsError
+
+_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_REQUIRED = ("name", "webhook_token", "rd_client_id", "rd_client_secret", "rd_refresh_token")
+
+
+@dataclass(frozen=True)
+class TenantConfig:
+    name: str
+    webhook_token: str
+    rd_client_id: str
+    rd_client_secret: str
+    rd_refresh_token: str
+    # None = herda a configuração global (RD_DEFAULT_TAGS, RD_RATE_LIMIT_*)
+    default_tags: Optional[Tuple[str, ...]] = None
+    rate_limit_contacts: Optional[float] = None
+    rate_limit_tags: Optional[float] = None
+
+
+def load_tenants(path: str, environ: Optional[Mapping[str, str]] = None) -> List[TenantConfig]:
+    """Lê e valida o JSON de tenants; SettingsError com o problema encontrado."""
+    env = os.environ if environ is None else environ
+    try:
+        with open(path, encoding="utf-8") as fh:
+            raw = json.load(fh)
+    except (OSError, ValueError) as e:
+        raise SettingsError(f"TENANTS_PATH: não foi possível ler {path!r}: {e}") from None
+    if not isinstance(raw, list):
+        raise SettingsError("TENANTS_PATH: esperado uma lista de tenants")
+
+    known = {f.name for f in fields(TenantConfig)}
+    configs: List[TenantConfig] = []
+    for i, entry in enumerate(raw):
+        if not isinstance(entry, dict):
+            raise SettingsError(f"TENANTS_PATH: tenant #{i} não é um objeto")
+        unknown = set(entry) - known
+        if unknown:
+            raise SettingsError(f"TENANTS_PATH: tenant #{i}: campos desconhecidos {sorted(unknown)}")
+        values = {k: _resolve(v, env, f"tenant #{i}.{k}") for k, v in entry.items()}
+        missing = [k for k in _REQUIRED if not values.get(k)]
+        if missing:
+            raise SettingsError(f"TENANTS_PATH: tenant #{i}: faltando {', '.join(missing)}")
+        if not _NAME.match(values["name"]):
+            raise SettingsError(f"TENANTS_PATH: nome inválido {values['name']!r} (letras, números, _ e -)")
+        if values.get("default_tags") is not None:
+            values["default_tags"] = tuple(values["default_tags"])
+        configs.append(TenantConfig(**values))
+
+    for attr in ("name", "webhook_token"):
+        seen = [getattr(c, attr) for c in configs]
+        if len(set(seen)) != len(seen):
+            raise SettingsError(f"TENANTS_PATH: {attr} repetido entre tenants")
+    return configs
+
+
+def _resolve(value: Any, env: Mapping[str, str], where: str) -> Any:
+    if isinstance(value, str) and value.startswith("env:"):
+        name = value[4:]
+        if name not in env:
+            raise SettingsError(f"TENANTS_PATH: {where}: variável {name} não definida")
+        return env[name]
+    return value
+
+
+class Tenant:
+    """Tenant em execução: configuração + cliente do RD (criado sob demanda) + uso."""
+
+    __slots__ = ("config", "client", "last_used", "active", "limit")
+
+    def __init__(self, config: TenantConfig, max_in_flight: int):
+        self.config = config
+        self.client: Optional[RDClient] = None
+        self.last_used = 0.0
+        self.active = 0
+        # teto de chamadas simultâneas ao RD do tenant: um tenant barulhento não ocupa o pool todo
+        self.limit = asyncio.Semaphore(max_in_flight) if max_in_flight > 0 else None
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def scoped(self, key: str) -> str:
+        """Chave no namespace do tenant (idempotência, estado por contato, ordem)."""
+        return f"{self.config.name}:{key}"
+
+
+class TenantRegistry:
+    """
+    Tenants por nome e por token do webhook. lease() entrega o RDClient do
+    tenant (criando com `factory` se preciso) e conta o uso; evict_idle()
+    fecha os clientes sem uso há idle_seconds (nunca com chamada em andamento).
+    """
+
+    def __init__(
+        self,
+        configs: List[TenantConfig],
+        factory: Callable[[TenantConfig], RDClient],
+        *,
+        idle_seconds: float = 300.0,
+        max_in_flight: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.factory = factory
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self._by_name: Dict[str, Tenant] = {c.name: Tenant(c, max_in_flight) for c in configs}
+        self._by_token: Dict[str, Tenant] = {t.config.webhook_token: t for t in self._by_name.values()}
+        self.created = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def __iter__(self):
+        return iter(self._by_name.values())
+
+    def get(self, name: str) -> Optional[Tenant]:
+        return self._by_name.get(name)
+
+    def by_token(self, token: str) -> Optional[Tenant]:
+        return self._by_token.get(token)
+
+    def client(self, tenant: Tenant) -> RDClient:
+        tenant.last_used = self.clock()
+        if tenant.client is None:
+            tenant.client = self.factory(tenant.config)
+            self.created += 1
+        return tenant.client
+
+    @asynccontextmanager
+    async def lease(self, tenant: Tenant) -> AsyncIterator[RDClient]:
+        """Cliente do tenant para uma operação, respeitando o teto de chamadas simultâneas."""
+        if tenant.limit is not None:
+            await tenant.limit.acquire()
+        tenant.active += 1
+        try:
+            yield self.client(tenant)
+        finally:
+            tenant.active -= 1
+            tenant.last_used = self.clock()
+            if tenant.limit is not None:
+                tenant.limit.release()
+
+    async def evict_idle(self) -> int:
+        """Fecha os clientes ociosos; devolve quantos foram fechados."""
+        cutoff = self.clock() - self.idle_seconds
+        # desliga todos antes do primeiro await: um lease que comece durante o
+        # fechamento cria um cliente novo em vez de receber um que está sendo fechado
+        idle = []
+        for tenant in self._by_name.values():
+            if tenant.client is not None and not tenant.active and tenant.last_used <= cutoff:
+                idle.append(tenant.client)
+                tenant.client = None
+        await asyncio.gather(*(c.aclose() for c in idle), return_exceptions=True)
+        self.evicted += len(idle)
+        return len(idle)
+
+    async def aclose(self) -> None:
+        clients = [t.client for t in self._by_name.values() if t.client is not None]
+        for tenant in self._by_name.values():
+            tenant.client = None
+        await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        now = self.clock()
+        return {
+            "tenants": len(self._by_name),
+            "active_clients": sum(1 for t in self._by_name.values() if t.client is not None),
+            "created": self.created,
+            "evicted": self.evicted,
+            "idle_seconds": self.idle_seconds,
+            "clients": {
+                t.name: {"in_flight": t.active, "idle_for": round(now - t.last_used, 1), "sync": t.client.sync_stats()}
+                for t in self._by_name.values()
+                if t.client is not None
+            },
+        }
@@ -1,9 +1,12 @@
 # tests/conftest.py
 import os
+import httpx
 import pytest
 import respx
 from httpx import AsyncClient
+import app as app_module
 from app import app  # importa seu FastAPI app
+from settings import Settings
 
 @pytest.fixture(autouse=True)
 def _env(monkeypatch):
@@ -14,6 +17,48 @@ def _env(monkeypatch):
     monkeypatch.setenv("RD_DEFAULT_TAGS", "mercos,cliente_cadastrado")
     monkeypatch.setenv("IDEMPOTENCY_TTL_SECONDS", "3600")
     monkeypatch.setenv("IDEMPOTENCY_MAX_KEYS", "10000")
+    # o import do app leu o ambiente do shell; reaplica com as variáveis acima
+    # (stores em memória, como no import: sem arquivos nem conexões)
+    app_module.configure(Settings.from_env(), open_stores=False)
+
+# helpers compartilhados pelos testes: `from tests.conftest import RD_BASE, mock_rd, ...`
+RD_BASE = "https://api.rd.services"
+
+class Clock:
+    """Relógio manual: os testes avançam `now` em vez de dormir."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_event(evento, email, **dados):
+    """Item do webhook com um e-mail; `dados` completa ou sobrescreve os campos do cliente."""
+    return {"evento": evento, "dados": {"razao_social": "Cliente", "emails": [{"email": email}], **dados}}
+
+def mock_rd_token(expires_in=900):
+    """Rota de token do RD (chamar dentro de respx.mock); devolve a rota."""
+    return respx.post(f"{RD_BASE}/auth/token").mock(
+        return_value=httpx.Response(200, json={"access_token": "at", "expires_in": expires_in})
+    )
+
+def mock_rd(on_patch=None, fail_email=None):
+    """Token, PATCH de contato e tag do RD; devolve a lista de e-mails que receberam PATCH."""
+    mock_rd_token()
+    patched = []
+
+    def patch(request):
+        email = request.url.path.split("email:")[1]
+        patched.append(email)
+        if on_patch is not None:
+            on_patch(email)
+        if email == fail_email:
+            return httpx.Response(400, json={"errors": "inválido"})
+        return httpx.Response(200, json={"email": email})
+
+    respx.route(method="PATCH").mock(side_effect=patch)
+    respx.route(method="POST", url__regex=r".*/tag$").mock(return_value=httpx.Response(200, json={}))
+    return patched
 
 @pytest.fixture
 async def client():
@@ -36,12 +81,11 @@ def mercos_event(email="teste@mercos.com"):
 
 @pytest.fixture
 def rd_urls():
-    base = "https://api.rd.services"
     return {
-        "token": f"{base}/auth/token",
-        "patch": f"{base}/platform/contacts/email:teste@mercos.com",
-        "post": f"{base}/platform/contacts",
-        "tag": f"{base}/platform/contacts/email:teste@mercos.com/tag",
+        "token": f"{RD_BASE}/auth/token",
+        "patch": f"{RD_BASE}/platform/contacts/email:teste@mercos.com",
+        "post": f"{RD_BASE}/platform/contacts",
+        "tag": f"{RD_BASE}/platform/contacts/email:teste@mercos.com/tag",
     }
 
 @pytest.fixture
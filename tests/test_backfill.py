@@ -0,0 +1,163 @@
+# tests/test_backfill.py
+import asyncio
+import json
+
+import pytest
+import respx
+
+from app import EXCLUIDO_TAGS, UPSERT_EVENTS, _first_email, map_mercos_to_rd
+from backfill import Backfill, Checkpoint
+from jsonstream import iter_records
+from rd_client import RDClient, SyncResult
+from tests.conftest import mock_rd
+
+
+def _export(tmp_path, n=6):
+    records = [
+        {"razao_social": f"Cliente {i}", "emails": [{"email": f"carga{i}@mercos.com"}]} if i != 2 else {"razao_social": "Sem email"}
+        for i in range(n)
+    ]
+    path = tmp_path / "clientes.ndjson"
+    path.write_text("\n".join(json.dumps(r) for r in records), encoding="utf-8")
+    return path
+
+
+async def _run(path, checkpoint, failures=None):
+    async with RDClient("cid", "secret", "rft") as rd:
+        backfill = Backfill(
+            rd,
+            map_mercos_to_rd,
+            lambda dados: _first_email(dados.get("emails")),
+            ["carga_inicial"],
+            concurrency=3,
+            checkpoint=checkpoint,
+            failures_path=failures,
+        )
+        with open(path, "rb") as fh:
+            return await backfill.run(iter_records(fh), start=checkpoint.position)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_backfill_syncs_and_checkpoints(tmp_path):
+    path = _export(tmp_path)
+    patched = mock_rd(fail_email="carga4@mercos.com")
+    checkpoint = Checkpoint(str(tmp_path / "cp.json"), str(path))
+    failures = tmp_path / "falhas.ndjson"
+
+    result = await _run(path, checkpoint, str(failures))
+
+    assert sorted(patched) == sorted(f"carga{i}@mercos.com" for i in (0, 1, 3, 4, 5))
+    assert (result["ok"], result["failed"], result["skipped"], result["position"]) == (4, 1, 1, 6)
+    saved = json.loads((tmp_path / "cp.json").read_text())
+    assert saved["position"] == 6 and saved["counters"]["ok"] == 4
+    # o arquivo de falhas pode ser reprocessado pelo próprio backfill
+    failed = [json.loads(line) for line in failures.read_text().splitlines()]
+    assert [f["email"] for f in failed] == ["carga4@mercos.com"]
+    assert failed[0]["dados"]["razao_social"] == "Cliente 4"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_backfill_resumes_from_checkpoint(tmp_path):
+    path = _export(tmp_path)
+    patched = mock_rd()
+    checkpoint = Checkpoint(str(tmp_path / "cp.json"), str(path))
+    checkpoint.save(4, {"ok": 3, "created": 0, "failed": 0, "skipped": 1, "tag_errors": 0})
+
+    resumed = Checkpoint(str(tmp_path / "cp.json"), str(path))
+    assert resumed.load()
+    result = await _run(path, resumed)
+
+    assert sorted(patched) == ["carga4@mercos.com", "carga5@mercos.com"]
+    assert result["ok"] == 5 and result["position"] == 6
+
+
+def test_checkpoint_of_another_file_is_rejected(tmp_path):
+    Checkpoint(str(tmp_path / "cp.json"), str(tmp_path / "a.json")).save(1, {})
+    with pytest.raises(SystemExit):
+        Checkpoint(str(tmp_path / "cp.json"), str(tmp_path / "b.json")).load()
+
+
+class _FakeRD:
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.calls = []
+
+    async def sync_contact(self, email, payload, tags):
+        self.calls.append(("sync", email))
+        if email == "lento@mercos.com":
+            await self.gate.wait()
+        if email == "libera@mercos.com":
+            self.gate.set()
+        return SyncResult({}, False, tags, None)
+
+    async def add_tags(self, by, email, tags):
+        self.calls.append(("tag", email, tags))
+
+
+def _dados(email):
+    return {"razao_social": "X", "emails": [{"email": email}]}
+
+
+class _Saves(Checkpoint):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.saved = []
+
+    def save(self, position, counters):
+        self.saved.append((position, dict(counters)))
+
+
+@pytest.mark.asyncio
+async def test_events_are_routed_and_only_committed_records_are_counted(tmp_path):
+    rd = _FakeRD()
+    checkpoint = _Saves(str(tmp_path / "cp.json"), str(tmp_path / "x.ndjson"))
+    records = [
+        _dados("lento@mercos.com"),
+        _dados("rapido@mercos.com"),
+        _dados("libera@mercos.com"),
+        {"evento": "cliente.excluido", "dados": _dados("saiu@mercos.com")},
+        {"evento": "cliente.desconhecido", "dados": _dados("outro@mercos.com")},
+    ]
+    backfill = Backfill(
+        rd, map_mercos_to_rd, lambda dados: _first_email(dados.get("emails")), ["carga"],
+        concurrency=2, checkpoint=checkpoint, checkpoint_every=0,
+        upsert_events=UPSERT_EVENTS, excluded_tags=EXCLUIDO_TAGS,
+    )
+    result = await backfill.run(records)
+
+    # "rápido" terminou com "lento" ainda em voo: fica fora do checkpoint até a marca passar
+    position, counters = checkpoint.saved[0]
+    assert position == 0 and counters["ok"] == 0
+    assert ("tag", "saiu@mercos.com", EXCLUIDO_TAGS) in rd.calls
+    assert ("sync", "saiu@mercos.com") not in rd.calls and ("sync", "outro@mercos.com") not in rd.calls
+    assert (result["ok"], result["excluded"], result["ignored"], result["position"]) == (3, 1, 1, 5)
+    assert checkpoint.saved[-1] == (5, {k: v for k, v in result.items() if k not in ("position", "rate")})
+
+
+@pytest.mark.asyncio
+async def test_finished_buffer_is_capped_while_a_slow_record_holds_the_watermark(tmp_path):
+    rd = _FakeRD()
+    checkpoint = _Saves(str(tmp_path / "cp.json"), str(tmp_path / "x.ndjson"))
+    read = []
+
+    def records():
+        for i, email in enumerate(["lento@mercos.com"] + [f"r{i}@mercos.com" for i in range(1, 8)]):
+            read.append(i)
+            yield _dados(email)
+
+    backfill = Backfill(
+        rd, map_mercos_to_rd, lambda dados: _first_email(dados.get("emails")), ["carga"],
+        concurrency=2, checkpoint=checkpoint, checkpoint_every=0, max_buffered=2,
+    )
+    task = asyncio.create_task(backfill.run(records()))
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+    # com "lento" em voo, só dois concluídos ficam à frente da marca; o próximo lido espera
+    assert len(backfill._finished) == 2 and len(read) == 4
+    rd.gate.set()
+    result = await task
+    assert (result["ok"], result["position"]) == (8, 8)
+    assert not backfill._finished
@@ -0,0 +1,123 @@
+# tests/test_circuit_breaker.py
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from event_queue import EventQueue
+from rd_client import CircuitBreaker, CircuitOpenError, RDClient
+from tests.conftest import Clock, mock_rd_token
+
+URL = "/webhooks/mercos/clientes?token=SEGREDO"
+
+
+def _breaker(clock=None, **kw):
+    opts = dict(failure_ratio=0.5, min_requests=4, window_seconds=10, open_seconds=30)
+    opts.update(kw)
+    return CircuitBreaker(clock=clock or Clock(), **opts)
+
+
+def test_opens_on_error_rate_then_half_open_probe_closes():
+    clock = Clock()
+    breaker = _breaker(clock)
+    for ok in (True, False, True):
+        breaker.before_request()
+        breaker.record_success() if ok else breaker.record_failure()
+    assert breaker.state == "closed"  # abaixo de min_requests
+    breaker.record_failure()  # 2/4 falhas
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.before_request()
+    assert exc.value.retry_after == pytest.approx(30)
+
+    clock.now += 30
+    breaker.before_request()  # chamada de teste
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()  # só um teste por vez
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_request()
+
+
+def test_failed_probe_reopens_and_old_failures_leave_the_window():
+    clock = Clock()
+    breaker = _breaker(clock)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 11  # janela de 10 s
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 30
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.opened == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_client_fails_fast_while_open():
+    mock_rd_token()
+    patch = respx.route(method="PATCH").mock(return_value=httpx.Response(503, json={}))
+
+    async with RDClient("cid", "secret", "rft", backoff_base=0, circuit_breaker=_breaker(min_requests=3)) as rd:
+        # 3 falhas abrem o circuito no meio dos retries: nada de backoff até o fim
+        with pytest.raises(CircuitOpenError):
+            await rd.upsert_contact_by_email("fora@mercos.com", {"name": "X"})
+        assert patch.call_count == 3
+        with pytest.raises(CircuitOpenError):
+            await rd.upsert_contact_by_email("fora@mercos.com", {"name": "X"})
+        assert patch.call_count == 3
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_webhook_sheds_load_while_open(client, monkeypatch):
+    breaker = _breaker()
+    breaker._open()
+    monkeypatch.setattr(app_module.get_rd(), "circuit_breaker", breaker)
+    patch = respx.route(method="PATCH").mock(return_value=httpx.Response(200, json={}))
+
+    item = {"evento": "cliente.atualizado", "dados": {"razao_social": "S", "emails": [{"email": "shed@mercos.com"}]}}
+    r = await client.post(URL, json=[item])
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "30"
+    assert not patch.called
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_breaker_opening_mid_batch_returns_503_and_releases_keys(client, monkeypatch):
+    monkeypatch.setattr(app_module.get_rd(), "circuit_breaker", _breaker(min_requests=2))
+    monkeypatch.setattr(app_module, "WEBHOOK_CONCURRENCY", 1)
+    mock_rd_token()
+    respx.route(method="PATCH").mock(return_value=httpx.Response(503, json={}))
+
+    batch = [
+        {"evento": "cliente.atualizado", "dados": {"razao_social": "M", "emails": [{"email": f"meio{i}@mercos.com"}]}}
+        for i in range(3)
+    ]
+    r = await client.post(URL, json=batch)
+    assert r.status_code == 503
+    body = r.json()
+    assert body["status"] == "rd_unavailable"
+    assert all(res["status"] == "error" and "retry_after" in res for res in body["results"])
+    # nenhuma chave ficou reservada: o reenvio do Mercos será processado
+    keys = [app_module._idempotency_key_for_event(item) for item in batch]
+    assert app_module._IDEMPOTENCY.claim_many(keys, 0) == [True, True, True]
+
+
+def test_queue_release_does_not_count_an_attempt(tmp_path):
+    q = EventQueue(str(tmp_path / "queue.db"), max_retries=1)
+    q.enqueue_many([{"evento": "x"}], ["a@x.com"])
+    (event,) = q.claim(1)
+    q.release(event.id, 0)
+    (event,) = q.claim(1)
+    assert event.attempts == 0
+    q.release(event.id, 60)
+    assert q.claim(1) == []
@@ -0,0 +1,108 @@
+# tests/test_coalesce.py
+import asyncio
+import json
+
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from coalesce import Coalescer, merge_rd_payloads, merge_tags
+from tests.conftest import RD_BASE, make_event, mock_rd_token
+
+
+def test_merge_rd_payloads_latest_wins():
+    base = {"name": "A", "city": "Joinville", "custom_fields": {"cnpj": "1", "cep": "89000"}}
+    update = {"name": "B", "custom_fields": {"cnpj": "2"}}
+    assert merge_rd_payloads(base, update) == {
+        "name": "B",
+        "city": "Joinville",
+        "custom_fields": {"cnpj": "2", "cep": "89000"},
+    }
+
+
+def test_merge_tags_keeps_order_without_repeats():
+    assert merge_tags(["mercos", "cliente.atualizado"], ["mercos", "cliente.bloqueioatualizado"]) == [
+        "mercos",
+        "cliente.atualizado",
+        "cliente.bloqueioatualizado",
+    ]
+
+
+def _stub_rd(email):
+    mock_rd_token()
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(return_value=httpx.Response(200, json={"uuid": "c1"}))
+    tag = respx.post(f"{RD_BASE}/platform/contacts/email:{email}/tag").mock(return_value=httpx.Response(200, json={}))
+    return patch, tag
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_same_batch_updates_become_one_rd_call(client, monkeypatch):
+    monkeypatch.setattr(app_module, "_COALESCER", Coalescer(0))
+    monkeypatch.setattr(app_module, "DEFAULT_TAGS", ["mercos", "cliente_cadastrado"])
+    email = "fundir@mercos.com"
+    patch, tag = _stub_rd(email)
+
+    batch = [
+        make_event("cliente.atualizado", email, razao_social="Nome Antigo", cidade="Joinville"),
+        make_event("cliente.bloqueioatualizado", email, razao_social="Nome Novo"),
+    ]
+    r = await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=batch)
+    assert r.status_code == 200
+    assert [res["status"] for res in r.json()["results"]] == ["ok", "ok"]
+
+    assert patch.call_count == 1
+    body = json.loads(patch.calls.last.request.content)
+    assert body["name"] == "Nome Novo"
+    assert body["city"] == "Joinville"
+    assert tag.call_count == 1
+    assert json.loads(tag.calls.last.request.content)["tags"] == [
+        "mercos",
+        "cliente_cadastrado",
+        "cliente.atualizado",
+        "cliente.bloqueioatualizado",
+    ]
+
+    stats = (await client.get("/stats?token=SEGREDO")).json()["coalescing"]
+    assert stats["coalesced"] == 1
+    assert stats["rd_calls_saved"] == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_updates_across_requests_inside_window(client, monkeypatch):
+    monkeypatch.setattr(app_module, "_COALESCER", Coalescer(0.05))
+    email = "janela@mercos.com"
+    patch, tag = _stub_rd(email)
+
+    first = client.post("/webhooks/mercos/clientes?token=SEGREDO", json=[make_event("cliente.atualizado", email, razao_social="A")])
+    second = client.post("/webhooks/mercos/clientes?token=SEGREDO", json=[make_event("cliente.atualizado", email, razao_social="B")])
+    r1, r2 = await asyncio.gather(first, second)
+
+    assert r1.json()["results"][0]["status"] == "ok"
+    assert r2.json()["results"][0]["status"] == "ok"
+    assert patch.call_count == 1
+    assert json.loads(patch.calls.last.request.content)["name"] == "B"
+
+
+@pytest.mark.asyncio
+async def test_excluido_closes_merge_window():
+    coalescer = Coalescer(0)
+    calls = []
+
+    async def send(payload, tags):
+        calls.append(("upsert", payload["name"]))
+
+    async def excluir():
+        calls.append(("excluido", None))
+
+    futures = [
+        coalescer.submit("a@x.com", {"name": "1"}, [], send),
+        coalescer.run("a@x.com", excluir),
+        coalescer.submit("a@x.com", {"name": "2"}, [], send),
+        coalescer.submit("a@x.com", {"name": "3"}, [], send),
+    ]
+    await asyncio.gather(*futures)
+    assert calls == [("upsert", "1"), ("excluido", None), ("upsert", "3")]
+    assert coalescer.stats()["coalesced"] == 1
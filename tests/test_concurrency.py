@@ -0,0 +1,93 @@
+# tests/test_concurrency.py
+import asyncio
+import json
+
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from tests.conftest import RD_BASE, make_event, mock_rd_token
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_batch_runs_concurrently_keeping_order(client, monkeypatch):
+    monkeypatch.setattr(app_module, "WEBHOOK_CONCURRENCY", 2)
+    mock_rd_token()
+
+    in_flight = 0
+    max_in_flight = 0
+    seen = {}
+
+    async def patch_side_effect(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        email = request.url.path.split("email:")[1]
+        seen.setdefault(email, []).append(json.loads(request.content)["name"])
+        return httpx.Response(200, json={"email": email})
+
+    def tag_side_effect(request):
+        email = request.url.path.split("email:")[1].rsplit("/", 1)[0]
+        seen.setdefault(email, []).append(json.loads(request.content)["tags"][-1])
+        return httpx.Response(200, json={})
+
+    respx.route(method="PATCH", url__startswith=f"{RD_BASE}/platform/contacts/email:").mock(side_effect=patch_side_effect)
+    respx.route(method="POST", url__regex=r".*/tag$").mock(side_effect=tag_side_effect)
+
+    emails = [f"conc{i}@mercos.com" for i in range(3)]
+    batch = [make_event("cliente.cadastrado", e, razao_social="v1") for e in emails]
+    batch += [make_event("cliente.excluido", e, razao_social="v1") for e in emails]
+    batch += [make_event("cliente.atualizado", e, razao_social="v2") for e in emails]
+
+    r = await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=batch)
+    assert r.status_code == 200
+    results = r.json()["results"]
+
+    # resultados na ordem de entrada
+    assert [res["evento"] for res in results] == [item["evento"] for item in batch]
+    assert [res["contact"]["email"] for res in results[:3]] == emails
+    assert [res["status"] for res in results[3:6]] == ["tagged_excluded"] * 3
+    # mesmo e-mail em série, na ordem recebida
+    expected = ["v1", "cliente.cadastrado", "excluido_no_mercos", "v2", "cliente.atualizado"]
+    assert all(seen[e] == expected for e in emails)
+    # limite de concorrência respeitado (e de fato usado)
+    assert max_in_flight == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_duplicates_within_batch_are_detected(client):
+    mock_rd_token()
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:dup-lote@mercos.com").mock(return_value=httpx.Response(200, json={}))
+    respx.post(f"{RD_BASE}/platform/contacts/email:dup-lote@mercos.com/tag").mock(return_value=httpx.Response(200, json={}))
+
+    item = make_event("cliente.cadastrado", "dup-lote@mercos.com", razao_social="Dup")
+    r = await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=[item, item])
+    assert [res["status"] for res in r.json()["results"]] == ["ok", "duplicate"]
+    assert patch.call_count == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_idempotency_lookup_is_batched(client, monkeypatch):
+    calls = []
+    store = app_module._IDEMPOTENCY
+    original = store.claim_many
+
+    def spy(keys, now):
+        calls.append(len(keys))
+        return original(keys, now)
+
+    monkeypatch.setattr(store, "claim_many", spy)
+    mock_rd_token()
+    respx.route(method="PATCH").mock(return_value=httpx.Response(200, json={}))
+    respx.route(method="POST", url__regex=r".*/tag$").mock(return_value=httpx.Response(200, json={}))
+
+    batch = [make_event("cliente.atualizado", f"lote{i}@mercos.com", razao_social="X") for i in range(5)]
+    r = await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=batch)
+    assert r.status_code == 200
+    assert calls == [5]
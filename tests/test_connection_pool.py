@@ -0,0 +1,56 @@
+# tests/test_connection_pool.py
+import asyncio
+import time
+
+import pytest
+
+from rd_client import RDClient
+
+
+async def _serve_http(reader, writer):
+    """Servidor HTTP/1.1 mínimo com keep-alive (responde 200 {} a tudo)."""
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            if length:
+                await reader.readexactly(length)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}")
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_stats_report_reuse_and_wait():
+    server = await asyncio.start_server(_serve_http, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        rd = RDClient("cid", "secret", "rft", max_connections=1, max_keepalive_connections=1)
+        rd.BASE_URL = f"http://127.0.0.1:{port}"
+        rd._access_token, rd._expires_at = "at", time.time() + 900
+
+        async with rd:
+            await asyncio.gather(*(rd.upsert_contact_by_email(f"c{i}@x.com", {}) for i in range(4)))
+            stats = rd.pool_stats()
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    assert stats["max_connections"] == 1
+    assert stats["requests"] == 4
+    # pool de 1 conexão: uma abertura, três reusos, e alguém esperou na fila
+    assert stats["new_connections"] == 1
+    assert stats["reused_connections"] == 3
+    assert stats["pool_wait_max"] > 0
+
+
+def test_http2_falls_back_without_h2(monkeypatch):
+    monkeypatch.setattr("importlib.util.find_spec", lambda name: None)
+    rd = RDClient("cid", "secret", "rft", http2=True)
+    assert rd.http2 is False
@@ -0,0 +1,135 @@
+# tests/test_contact_state.py
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from state_cache import PersistentLRUCache
+from tests.conftest import RD_BASE, make_event, mock_rd_token
+
+
+def test_lru_evicts_least_recently_used():
+    cache = PersistentLRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_persists_to_disk(tmp_path):
+    path = str(tmp_path / "state.json")
+    cache = PersistentLRUCache(max_entries=10, path=path)
+    cache.set("a", ["h", ["mercos"]])
+    cache.flush()
+
+    reloaded = PersistentLRUCache(max_entries=10, path=path)
+    assert reloaded.get("a") == ["h", ["mercos"]]
+
+
+def test_corrupted_file_starts_empty(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("{nope")
+    assert len(PersistentLRUCache(max_entries=10, path=str(path))) == 0
+
+
+def test_malformed_entries_are_skipped(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text('[["a", 1], ["sem-valor"], [2, "x"], "lixo", ["b", ["h", []]]]')
+    cache = PersistentLRUCache(max_entries=10, path=str(path))
+    assert len(cache) == 2 and cache.get("b") == ["h", []]
+
+
+@pytest.mark.asyncio
+async def test_periodic_flush_runs_off_the_event_loop(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+
+    path = tmp_path / "state.json"
+    cache = PersistentLRUCache(max_entries=10, path=str(path), flush_interval=0)
+    threads = []
+    write = cache._write
+    monkeypatch.setattr(cache, "_write", lambda *a: (threads.append(threading.current_thread()), write(*a)))
+
+    cache.set("a", 1)
+    cache.set("b", 2)  # gravação anterior ainda em andamento: fica pendente
+    await asyncio.sleep(0.05)
+    await cache.aflush()
+    assert threads and threading.main_thread() not in threads
+    assert PersistentLRUCache(max_entries=10, path=str(path)).get("b") == 2
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]  # sem temporários sobrando
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_irrelevant_change_is_unchanged(client):
+    email = "semmudanca@mercos.com"
+    mock_rd_token()
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(return_value=httpx.Response(200, json={}))
+    tag = respx.post(f"{RD_BASE}/platform/contacts/email:{email}/tag").mock(return_value=httpx.Response(200, json={}))
+
+    url = "/webhooks/mercos/clientes?token=SEGREDO"
+    r1 = await client.post(url, json=[make_event("cliente.atualizado", email, limite_credito=[1])])
+    assert r1.json()["results"][0]["status"] == "ok"
+
+    # muda só um campo que não é mapeado → mesmo payload RD
+    r2 = await client.post(url, json=[make_event("cliente.atualizado", email, limite_credito=[2])])
+    assert r2.json()["results"][0]["status"] == "unchanged"
+    assert patch.call_count == 1
+    assert tag.call_count == 1
+
+    # tag nova (outro tipo de evento) ainda precisa ir para o RD
+    r3 = await client.post(url, json=[make_event("cliente.bloqueioatualizado", email)])
+    assert r3.json()["results"][0]["status"] == "ok"
+    assert patch.call_count == 2
+
+    stats = (await client.get("/stats?token=SEGREDO")).json()["contact_state"]
+    assert stats["unchanged"] >= 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_failed_send_is_not_remembered(client):
+    email = "falhou@mercos.com"
+    mock_rd_token()
+    respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(return_value=httpx.Response(400, json={}))
+
+    r = await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=[make_event("cliente.atualizado", email)])
+    assert r.json()["results"][0]["status"] == "error"
+    assert email not in app_module._CONTACT_STATE
+
+
+def test_skip_is_off_with_several_processes():
+    from settings import Settings, SettingsError
+
+    assert app_module._contact_state_skip(Settings())
+    assert not app_module._contact_state_skip(Settings(web_concurrency=4))
+    assert not app_module._contact_state_skip(Settings(coordination_path="coord.db"))
+    assert not app_module._contact_state_skip(Settings(idempotency_backend="sqlite"))
+    assert app_module._contact_state_skip(Settings(web_concurrency=4, contact_state_skip="on"))
+    assert not app_module._contact_state_skip(Settings(contact_state_skip="off"))
+    assert not app_module._contact_state_skip(Settings.from_env({"WEB_CONCURRENCY": "2"}))
+    with pytest.raises(SettingsError, match="CONTACT_STATE_SKIP"):
+        app_module._contact_state_skip(Settings(contact_state_skip="talvez"))
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_revert_is_sent_when_another_process_may_have_changed_the_contact(client, monkeypatch):
+    # worker 1 envia A, o worker 2 (outro processo) envia B, a volta para A chega de novo ao worker 1
+    email = "revert@mercos.com"
+    mock_rd_token()
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(return_value=httpx.Response(200, json={}))
+    respx.post(f"{RD_BASE}/platform/contacts/email:{email}/tag").mock(return_value=httpx.Response(200, json={}))
+    monkeypatch.setattr(app_module, "_CONTACT_STATE_SKIP", app_module._contact_state_skip(
+        app_module.Settings(web_concurrency=2)
+    ))
+
+    url = "/webhooks/mercos/clientes?token=SEGREDO"
+    for versao in (1, 2):
+        r = await client.post(url, json=[make_event("cliente.atualizado", email, cidade="A", limite_credito=[versao])])
+        assert r.json()["results"][0]["status"] == "ok"
+    assert patch.call_count == 2
+    assert email not in app_module._CONTACT_STATE
@@ -0,0 +1,151 @@
+# tests/test_coordination.py
+import asyncio
+import dataclasses
+import time
+
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from coordination import Coordinator
+from event_queue import EventQueue, partition_hash
+from tests.conftest import RD_BASE, Clock, mock_rd_token
+
+
+def test_partitions_are_split_between_live_workers(tmp_path):
+    path, clock = str(tmp_path / "coord.db"), Clock()
+    a = Coordinator(path, partitions=8, lease_seconds=30, owner="a", clock=clock)
+    b = Coordinator(path, partitions=8, lease_seconds=30, owner="b", clock=clock)
+
+    assert a.heartbeat() == frozenset(range(8))
+    assert b.heartbeat() == frozenset()  # tudo com "a" até ele devolver o excedente
+    assert len(a.heartbeat()) == 4
+    assert len(b.heartbeat()) == 4 and not (a.owned & b.owned)
+
+    # "a" para de responder: depois do lease, "b" assume tudo
+    clock.now += 31
+    assert b.heartbeat() == frozenset(range(8))
+    # "a" volta e pega a metade de novo; saída limpa devolve na hora
+    a.heartbeat(), b.heartbeat(), a.heartbeat()
+    assert len(a.owned) == 4 and len(b.owned) == 4
+    a.close()
+    assert b.heartbeat() == frozenset(range(8))
+    b.close()
+
+
+@pytest.mark.asyncio
+async def test_contact_lock_excludes_other_processes(tmp_path):
+    path = str(tmp_path / "coord.db")
+    a = Coordinator(path, owner="a")
+    b = Coordinator(path, owner="b")
+    order = []
+
+    async def hold(coordinator, label):
+        async with coordinator.contact("cliente@mercos.com"):
+            order.append(f"{label}+")
+            await asyncio.sleep(0.03)
+            order.append(f"{label}-")
+
+    first = asyncio.ensure_future(hold(a, "a"))
+    await asyncio.sleep(0)
+    await asyncio.gather(first, hold(b, "b"))
+    assert order == ["a+", "a-", "b+", "b-"]
+    assert b.lock_waits == 1
+
+    # lock de um processo que morreu expira
+    clock = Clock()
+    dead = Coordinator(path, owner="morto", lease_seconds=5, clock=clock)
+    assert dead.try_lock("x@mercos.com")
+    late = Coordinator(path, owner="c", lease_seconds=5, clock=clock)
+    assert not late.try_lock("x@mercos.com")
+    clock.now += 6
+    assert late.try_lock("x@mercos.com")
+
+
+@pytest.mark.asyncio
+async def test_rate_budget_and_throttle_are_shared(tmp_path):
+    path = str(tmp_path / "coord.db")
+    a = Coordinator(path, owner="a").bucket("contacts", 50, burst=1)
+    b = Coordinator(path, owner="b").bucket("contacts", 50, burst=1)
+
+    started = time.monotonic()
+    await asyncio.gather(*(bucket.acquire() for bucket in (a, b, a, b, a, b)))
+    assert time.monotonic() - started >= 0.09  # 6 requisições a 50/s somando os dois processos
+
+    a.on_throttle()
+    await a.acquire()  # espera a gravação do 429, feita numa thread
+    await b.acquire()
+    assert b.rate == 25 and b.stats()["shared"]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_write_lock_does_not_block_the_event_loop(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "coord.db")
+    coordinator = Coordinator(path, owner="a")
+    bucket = coordinator.bucket("contacts", 1000, burst=10)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")  # outro processo no meio de uma escrita
+
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    tick = asyncio.ensure_future(ticker())
+    pending = asyncio.ensure_future(asyncio.gather(bucket.acquire(), coordinator.aheartbeat()))
+    await asyncio.sleep(0.1)
+    assert not pending.done() and len(ticks) >= 5
+    other.execute("COMMIT")
+    await pending
+    tick.cancel()
+    assert coordinator.stats()["workers"] == 1
+    other.close()
+    coordinator.close()
+
+
+def test_queue_claims_only_owned_partitions(tmp_path):
+    queue = EventQueue(str(tmp_path / "queue.db"))
+    emails = [f"c{i}@mercos.com" for i in range(20)]
+    queue.enqueue_many([{"email": e} for e in emails], emails)
+    mine = {partition_hash(e) % 4 for e in emails[:3]}
+
+    claimed = queue.claim(100, partitions=mine, partition_count=4)
+    assert claimed and all(partition_hash(e.item["email"]) % 4 in mine for e in claimed)
+    assert queue.claim(100, partitions=(), partition_count=4) == []
+    rest = queue.claim(100)
+    assert len(claimed) + len(rest) == 20
+    queue.close()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_webhook_sends_under_contact_lock_with_shared_limiter(client, monkeypatch, tmp_path):
+    coordinator = Coordinator(str(tmp_path / "coord.db"), owner="eu")
+    monkeypatch.setattr(app_module, "_COORDINATOR", coordinator)
+    monkeypatch.setattr(app_module, "SETTINGS", dataclasses.replace(app_module.SETTINGS, rd_rate_limit_contacts=100))
+    rd = app_module._create_rd(app_module.SETTINGS)
+    monkeypatch.setattr(app_module, "rd", rd)
+    assert rd.rate_limit_stats()["contacts"]["shared"]
+
+    email = "coord@mercos.com"
+    mock_rd_token()
+    locked = []
+
+    def on_patch(request):
+        locked.append(coordinator._conn.execute("SELECT owner FROM contact_locks WHERE key = ?", (email,)).fetchone())
+        return httpx.Response(200, json={})
+
+    respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(side_effect=on_patch)
+    respx.post(f"{RD_BASE}/platform/contacts/email:{email}/tag").mock(return_value=httpx.Response(200, json={}))
+    body = [{"evento": "cliente.atualizado", "dados": {"razao_social": "C", "emails": [{"email": email}]}}]
+
+    r = await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=body)
+    assert r.json()["results"][0]["status"] == "ok"
+    assert locked == [("eu",)]
+    assert coordinator._conn.execute("SELECT COUNT(*) FROM contact_locks").fetchone() == (0,)
+    await rd.aclose()
@@ -0,0 +1,83 @@
+# tests/test_event_ordering.py
+import asyncio
+import json
+
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from tests.conftest import RD_BASE, make_event, mock_rd_token
+
+URL = "/webhooks/mercos/clientes?token=SEGREDO"
+
+
+def test_event_version_normalizes_and_rejects_garbage():
+    assert app_module._event_version({"ultima_alteracao": "2025-05-29T10:04:07"}) == "2025-05-29 10:04:07"
+    assert app_module._event_version({"ultima_alteracao": "2025-05-29 10:04:07"}) == "2025-05-29 10:04:07"
+    assert app_module._event_version({"ultima_alteracao": "ontem"}) is None
+    assert app_module._event_version({}) is None
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_older_event_in_later_request_is_stale(client):
+    mock_rd_token()
+    email = "ordem@mercos.com"
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(return_value=httpx.Response(200, json={}))
+    respx.post(f"{RD_BASE}/platform/contacts/email:{email}/tag").mock(return_value=httpx.Response(200, json={}))
+
+    r1 = await client.post(URL, json=[make_event("cliente.atualizado", email, ultima_alteracao="2025-06-01 10:00:00", id=9101, razao_social="Novo")])
+    assert r1.json()["results"][0]["status"] == "ok"
+
+    # entrega atrasada de uma alteração anterior: não vai ao RD
+    r2 = await client.post(URL, json=[make_event("cliente.atualizado", email, ultima_alteracao="2025-06-01 09:00:00", id=9101, razao_social="Velho")])
+    result = r2.json()["results"][0]
+    assert result["status"] == "stale"
+    assert result["last_applied"] == "2025-06-01 10:00:00"
+    assert patch.call_count == 1
+
+    # mesma data (ex.: outra alteração no mesmo segundo) ainda passa
+    r3 = await client.post(URL, json=[make_event("cliente.atualizado", email, ultima_alteracao="2025-06-01 10:00:00", id=9101, razao_social="Outro")])
+    assert r3.json()["results"][0]["status"] == "ok"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_out_of_order_within_batch_and_concurrent_requests(client):
+    mock_rd_token()
+    email = "lote.ordem@mercos.com"
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(return_value=httpx.Response(200, json={}))
+    respx.post(f"{RD_BASE}/platform/contacts/email:{email}/tag").mock(return_value=httpx.Response(200, json={}))
+
+    novo = make_event("cliente.atualizado", email, ultima_alteracao="2025-06-02 12:00:00", id=9102, razao_social="Novo")
+    velho = make_event("cliente.atualizado", email, ultima_alteracao="2025-06-02 11:00:00", id=9102, razao_social="Velho")
+    r = await client.post(URL, json=[novo, velho])
+    assert [x["status"] for x in r.json()["results"]] == ["ok", "stale"]
+    assert json.loads(patch.calls.last.request.content)["name"] == "Novo"
+
+    # duas requisições simultâneas: a mais antiga nunca sobrescreve a mais nova
+    mais_novo = make_event("cliente.atualizado", email, ultima_alteracao="2025-06-02 14:00:00", id=9102, razao_social="Mais novo")
+    antigo = make_event("cliente.atualizado", email, ultima_alteracao="2025-06-02 13:00:00", id=9102, razao_social="Antigo")
+    await asyncio.gather(client.post(URL, json=[mais_novo]), client.post(URL, json=[antigo]))
+    assert json.loads(patch.calls.last.request.content)["name"] == "Mais novo"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_failed_send_rolls_back_the_mark(client):
+    mock_rd_token()
+    email = "falha.ordem@mercos.com"
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(
+        side_effect=[httpx.Response(400, json={}), httpx.Response(200, json={})]
+    )
+    respx.post(f"{RD_BASE}/platform/contacts/email:{email}/tag").mock(return_value=httpx.Response(200, json={}))
+
+    r1 = await client.post(URL, json=[make_event("cliente.atualizado", email, ultima_alteracao="2025-06-03 10:00:00", id=9103)])
+    assert r1.json()["results"][0]["status"] == "error"
+    assert app_module._WATERMARKS.get("id:9103") is None
+
+    # a alteração anterior ainda pode ser aplicada (a que falhou nunca chegou ao RD)
+    r2 = await client.post(URL, json=[make_event("cliente.atualizado", email, ultima_alteracao="2025-06-03 09:00:00", id=9103)])
+    assert r2.json()["results"][0]["status"] == "ok"
+    assert patch.call_count == 2
@@ -0,0 +1,134 @@
+# tests/test_event_queue.py
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from event_queue import EventQueue
+from tests.conftest import RD_BASE, make_event, mock_rd_token
+
+
+def test_queue_survives_restart(tmp_path):
+    path = str(tmp_path / "queue.db")
+    q = EventQueue(path)
+    q.enqueue_many([make_event("cliente.cadastrado", "a@x.com"), make_event("cliente.cadastrado", "b@x.com")], ["a@x.com", "b@x.com"])
+    q.close()
+
+    q = EventQueue(path)
+    assert q.stats()["depth"] == 2
+    claimed = q.claim(10)
+    assert [e.item["dados"]["emails"][0]["email"] for e in claimed] == ["a@x.com", "b@x.com"]
+    q.close()
+
+
+def test_claim_keeps_partition_order(tmp_path):
+    q = EventQueue(str(tmp_path / "queue.db"))
+    q.enqueue_many([make_event("cliente.cadastrado", "a@x.com", razao_social="v1"), make_event("cliente.cadastrado", "a@x.com", razao_social="v2"), {"evento": "x"}], ["a@x.com", "a@x.com", None])
+
+    first = q.claim(10)
+    # só a cabeça da partition "a@x.com" + o item sem e-mail
+    assert [e.item.get("dados", {}).get("razao_social") for e in first] == ["v1", None]
+    assert q.claim(10) == []
+
+    q.ack(first[0].id)
+    assert [e.item["dados"]["razao_social"] for e in q.claim(10)] == ["v2"]
+
+
+def test_fail_retries_then_dead_letter(tmp_path):
+    q = EventQueue(str(tmp_path / "queue.db"), max_retries=2, retry_backoff=0)
+    q.enqueue_many([make_event("cliente.cadastrado", "a@x.com")], ["a@x.com"])
+
+    (event,) = q.claim(1)
+    assert q.fail(event.id, "boom") is False
+    (event,) = q.claim(1)
+    assert event.attempts == 1
+    assert q.fail(event.id, "boom again") is True
+
+    stats = q.stats()
+    assert stats["depth"] == 0
+    assert stats["dead_letter"] == 1
+    (dead,) = q.dead_letters()
+    assert dead["error"] == "boom again"
+    assert dead["attempts"] == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_webhook_acks_with_202_and_worker_drains(client, monkeypatch, tmp_path):
+    q = EventQueue(str(tmp_path / "queue.db"))
+    monkeypatch.setattr(app_module, "_QUEUE", q)
+
+    r = await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=[make_event("cliente.cadastrado", "fila@mercos.com")])
+    assert r.status_code == 202
+    assert r.json() == {"status": "queued", "queued": 1}
+
+    stats = (await client.get("/stats?token=SEGREDO")).json()["queue"]
+    assert stats["depth"] == 1
+    assert stats["lag_seconds"] >= 0
+
+    mock_rd_token()
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:fila@mercos.com").mock(return_value=httpx.Response(200, json={}))
+    respx.post(f"{RD_BASE}/platform/contacts/email:fila@mercos.com/tag").mock(return_value=httpx.Response(200, json={}))
+
+    await app_module._drain_batch(q, q.claim(10))
+    assert patch.called
+    assert q.stats()["depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_survives_sqlite_errors(monkeypatch, tmp_path):
+    import asyncio
+    import sqlite3
+
+    q = EventQueue(str(tmp_path / "queue.db"))
+    q.enqueue_many([make_event("cliente.cadastrado", "a@x.com")], ["a@x.com"])
+    claim, calls, acked = q.claim, [], asyncio.Event()
+
+    def flaky_claim(*args, **kwargs):
+        calls.append(1)
+        if len(calls) <= 2:
+            raise sqlite3.OperationalError("database is locked")
+        return claim(*args, **kwargs)
+
+    async def drain(queue, batch):
+        for event in batch:
+            queue.ack(event.id)
+        acked.set()
+
+    monkeypatch.setattr(q, "claim", flaky_claim)
+    monkeypatch.setattr(app_module, "_drain_batch", drain)
+    monkeypatch.setattr(app_module, "EVENT_QUEUE_POLL_SECONDS", 0.01)
+    worker = asyncio.ensure_future(app_module._queue_worker(q))
+    await asyncio.wait_for(acked.wait(), 2)
+    assert not worker.done() and len(calls) >= 3 and q.stats()["depth"] == 0
+    worker.cancel()
+    q.close()
+
+
+@pytest.mark.asyncio
+async def test_worker_waits_for_the_queue_lock_off_the_event_loop(monkeypatch, tmp_path):
+    import asyncio
+    import sqlite3
+
+    path = str(tmp_path / "queue.db")
+    q = EventQueue(path)
+    q.enqueue_many([make_event("cliente.cadastrado", "a@x.com")], ["a@x.com"])
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")  # outro processo escrevendo na fila
+    drained = asyncio.Event()
+
+    async def drain(queue, batch):
+        for event in batch:
+            await asyncio.to_thread(queue.ack, event.id)
+        drained.set()
+
+    monkeypatch.setattr(app_module, "_drain_batch", drain)
+    worker = asyncio.ensure_future(app_module._queue_worker(q))
+    await asyncio.sleep(0.05)
+    assert q.stats()["depth"] == 1  # /stats continua respondendo
+    other.execute("COMMIT")
+    await asyncio.wait_for(drained.wait(), 7)
+    assert q.stats()["depth"] == 0
+    worker.cancel()
+    other.close()
+    q.close()
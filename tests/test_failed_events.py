@@ -0,0 +1,168 @@
+# tests/test_failed_events.py
+import asyncio
+import os
+import time
+
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from failed_events import FailedEventStore, Replayer
+from tests.conftest import RD_BASE, make_event, mock_rd_token
+
+URL = "/webhooks/mercos/clientes?token=SEGREDO"
+
+
+def test_store_dedupes_by_key_and_survives_reload(tmp_path):
+    path = str(tmp_path / "failed.ndjson")
+    store = FailedEventStore(path)
+    assert store.record("k1", {"n": 1}, "boom") == 1
+    assert store.record("k1", {"n": 1}, "boom de novo") == 2
+    store.record("k2", {"n": 2}, "x")
+    assert store.resolve("k2") and not store.resolve("k2")
+    with open(path, "a") as fh:
+        fh.write('{"key": "k3", "item": {"cortad')  # queda no meio da gravação
+
+    reloaded = FailedEventStore(path)
+    [event] = reloaded.pending()
+    assert (event.key, event.item, event.error, event.attempts) == ("k1", {"n": 1}, "boom de novo", 2)
+    assert reloaded.compact() == 3  # duas falhas + resolução de k2 (a linha cortada nem conta)
+    assert FailedEventStore(path).pending() == [event]
+
+
+def test_index_follows_other_processes_sharing_the_file(tmp_path):
+    path = str(tmp_path / "failed.ndjson")
+    worker, cli = FailedEventStore(path), FailedEventStore(path)
+    worker.record("k1", {"n": 1}, "boom")
+    worker.record("k2", {"n": 2}, "boom")
+
+    assert [e.key for e in cli.pending()] == ["k1", "k2"]
+    assert cli.resolve("k1")  # replay em outro processo resolveu
+    assert "k1" not in worker and not worker.resolve("k1")
+    assert worker.record("k2", {"n": 2}, "de novo") == 2
+
+    cli.compact()
+    assert [(e.key, e.attempts) for e in worker.pending()] == [("k2", 2)]
+    assert worker.record("k3", {"n": 3}, "x") == 1
+    assert len(cli) == 2 and cli.stats()["lines"] == 2
+
+
+@pytest.mark.asyncio
+async def test_replayer_respects_concurrency_and_rate(tmp_path):
+    store = FailedEventStore(str(tmp_path / "failed.ndjson"))
+    for i in range(6):
+        store.record(f"k{i}", {"i": i}, "erro")
+    in_flight = max_in_flight = 0
+
+    async def process(items):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return [{"status": "error" if items[0]["i"] == 5 else "ok"}]
+
+    started = time.monotonic()
+    progress = await Replayer(store, process, rate=50, concurrency=2).run()
+    elapsed = time.monotonic() - started
+
+    assert max_in_flight <= 2
+    assert elapsed >= 0.09  # 6 eventos a 50/s: 5 intervalos de 20 ms
+    assert progress["done"] == 6 and progress["statuses"] == {"ok": 5, "error": 1}
+    [left] = store.pending()
+    assert left.key == "k5" and left.attempts == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_webhook_errors_are_recorded_and_replayed_through_the_pipeline(client, monkeypatch, tmp_path):
+    store = FailedEventStore(str(tmp_path / "failed.ndjson"))
+    monkeypatch.setattr(app_module, "_FAILED", store)
+    monkeypatch.setattr(app_module, "_REPLAY", None)
+    email = "replay@mercos.com"
+    mock_rd_token()
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(
+        side_effect=[httpx.Response(400, json={}), httpx.Response(200, json={"uuid": "u1"})]
+    )
+    respx.post(f"{RD_BASE}/platform/contacts/email:{email}/tag").mock(return_value=httpx.Response(200, json={}))
+
+    r = await client.post(URL, json=[make_event("cliente.atualizado", email)])
+    assert r.json()["results"][0]["status"] == "error"
+    assert len(store) == 1
+
+    r = await client.post("/admin/failed-events/replay?token=SEGREDO&rate=0&concurrency=2")
+    assert r.status_code == 202 and r.json()["running"]
+    while app_module._REPLAY.running:
+        await asyncio.sleep(0.01)
+
+    status = (await client.get("/admin/failed-events?token=SEGREDO")).json()
+    assert status["pending"] == 0 and status["events"] == []
+    assert status["replay"]["statuses"] == {"ok": 1}
+    assert patch.call_count == 2
+
+    # o Mercos reenviando depois do replay: já processado
+    r = await client.post(URL, json=[make_event("cliente.atualizado", email)])
+    assert r.json()["results"][0]["status"] == "duplicate"
+
+
+@pytest.mark.asyncio
+async def test_admin_endpoints_require_token_and_store(client, monkeypatch):
+    monkeypatch.setattr(app_module, "_FAILED", None)
+    assert (await client.get("/admin/failed-events")).status_code == 401
+    assert (await client.get("/admin/failed-events?token=SEGREDO")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_replay_requires_the_admin_token(client, monkeypatch, tmp_path):
+    store = FailedEventStore(str(tmp_path / "failed.ndjson"))
+    store.record("k1", {"n": 1}, "erro")
+    monkeypatch.setattr(app_module, "_FAILED", store)
+    monkeypatch.setattr(app_module, "_REPLAY", None)
+
+    assert (await client.post("/admin/failed-events/replay")).status_code == 401
+    assert (await client.post("/admin/failed-events/replay?token=errado")).status_code == 401
+    monkeypatch.setattr(app_module, "MERCOS_URL_TOKEN", None)
+    # sem token configurado o replay não fica aberto para qualquer um
+    assert (await client.post("/admin/failed-events/replay")).status_code == 403
+    assert app_module._REPLAY is None and len(store) == 1
+
+
+def test_compact_waits_for_writers_and_cut_lines_do_not_swallow_records(tmp_path):
+    import threading
+
+    path = str(tmp_path / "failed.ndjson")
+    store = FailedEventStore(path)
+    with open(path, "a") as fh:
+        fh.write('{"key": "k0", "item": {"cortad')  # queda no meio da gravação
+    store.record("k1", {"n": 1}, "boom")
+    assert [e.key for e in FailedEventStore(path).pending()] == ["k1"]
+
+    other = FailedEventStore(path)
+    with store._locked():
+        # compact de outro processo/thread espera o lock do escritor
+        compacting = threading.Thread(target=other.compact)
+        compacting.start()
+        compacting.join(0.05)
+        assert compacting.is_alive()
+        store._refresh()
+        store._append({"key": "k2", "item": {"n": 2}, "error": "x", "attempts": 1, "failed_at": 0})
+    compacting.join()
+    assert [e.key for e in FailedEventStore(path).pending()] == ["k1", "k2"]
+
+
+def test_membership_of_unknown_keys_does_not_stat_the_file_every_time(tmp_path, monkeypatch):
+    path = str(tmp_path / "failed.ndjson")
+    worker, cli = FailedEventStore(path), FailedEventStore(path, refresh_interval=60)
+    worker.record("k1", {"n": 1}, "boom")
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(os, "stat", lambda p, *a, **kw: stats.append(p) or real_stat(p, *a, **kw))
+
+    assert all(f"ok{i}" not in cli for i in range(100)) and "k1" not in cli
+    assert stats == []
+    cli.refresh_interval = 0
+    assert "k1" in cli
+
+    # chave já no índice confere o arquivo: a resolução de outro processo vale na hora
+    assert cli.resolve("k1") and "k1" not in worker
@@ -0,0 +1,49 @@
+# tests/test_fastjson.py
+import glob
+import hashlib
+import json
+import os
+
+import pytest
+
+import fastjson
+
+DOCS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "_docs")
+
+
+def _stdlib_digest(obj):
+    serialized = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _examples():
+    items = []
+    for path in sorted(glob.glob(os.path.join(DOCS, "*.example.json"))):
+        with open(path, encoding="utf-8") as fh:
+            items.extend(json.load(fh))
+    return items
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_digest_matches_previous_key_format(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(fastjson, "orjson", None)
+    elif fastjson.orjson is None:
+        pytest.skip("orjson não instalado")
+    items = _examples() + [{"evento": "x", "dados": {"nome": "João   \x1f", "n": [1, 2.5, None, True]}}]
+    for item in items:
+        assert fastjson.canonical_digest(item) == _stdlib_digest(item)
+
+
+def test_huge_int_falls_back_to_stdlib():
+    obj = {"n": 2 ** 70}
+    assert fastjson.canonical_digest(obj) == _stdlib_digest(obj)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_loads(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(fastjson, "orjson", None)
+    assert fastjson.loads(b'[{"a": "\xc3\xa7"}]') == [{"a": "ç"}]
+    with pytest.raises(ValueError):
+        fastjson.loads(b"{invalid")
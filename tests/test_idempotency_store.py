@@ -0,0 +1,147 @@
+# tests/test_idempotency_store.py
+import pytest
+
+from idempotency import IdempotencyStore, MemoryIdempotencyStore, SQLiteIdempotencyStore, create_idempotency_store
+
+
+def test_seen_respects_ttl():
+    store = MemoryIdempotencyStore(ttl_seconds=10, max_keys=100)
+    store.mark("a", now=1000)
+    assert store.seen("a", now=1010)
+    assert not store.seen("a", now=1011)
+    assert not store.seen("b", now=1000)
+
+
+def test_expire_drops_only_old_entries():
+    store = MemoryIdempotencyStore(ttl_seconds=10, max_keys=100)
+    store.mark("a", now=1000)
+    store.mark("b", now=1005)
+    store.expire(now=1012)
+    assert len(store) == 1
+    assert store.seen("b", now=1012)
+
+
+def test_max_keys_evicts_oldest_first():
+    store = MemoryIdempotencyStore(ttl_seconds=3600, max_keys=2)
+    store.mark("a", now=1)
+    store.mark("b", now=2)
+    store.mark("a", now=3)  # remarcar move para o fim
+    store.mark("c", now=4)
+    assert len(store) == 2
+    assert not store.seen("b", now=4)
+    assert store.seen("a", now=4)
+    assert store.seen("c", now=4)
+
+
+def test_expire_compares_timestamps_when_now_is_out_of_order():
+    store = MemoryIdempotencyStore(ttl_seconds=10, max_keys=2)
+    store.mark("novo", now=1008)
+    store.mark("velho", now=1000)  # chamada atrasada com um `now` anterior
+    store.expire(now=1012)
+    assert len(store) == 1 and store.seen("novo", now=1012)
+
+    store.mark("velho", now=1001)
+    store.mark("outro", now=1009)  # excedente: sai o menor timestamp, não o primeiro inserido
+    assert len(store) == 2
+    assert store.seen("novo", now=1009) and store.seen("outro", now=1009)
+
+
+def test_unmark():
+    store = MemoryIdempotencyStore(ttl_seconds=3600, max_keys=10)
+    store.mark("a", now=1)
+    store.unmark("a")
+    store.unmark("inexistente")
+    assert not store.seen("a", now=1)
+
+
+def test_memory_claim_many_flags_repeats_in_same_batch():
+    store = MemoryIdempotencyStore(ttl_seconds=3600, max_keys=10)
+    store.mark("a", now=1)
+    assert store.claim_many(["a", "b", "b", "c"], now=2) == [False, True, False, True]
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "idem.db")
+    worker1 = SQLiteIdempotencyStore(path, ttl_seconds=3600, max_keys=100)
+    worker2 = SQLiteIdempotencyStore(path, ttl_seconds=3600, max_keys=100)
+
+    assert worker1.claim_many(["a", "b", "a"], now=1000) == [True, True, False]
+    assert worker2.claim_many(["b", "c"], now=1001) == [False, True]
+
+    worker1.unmark("a")
+    assert worker2.claim_many(["a"], now=1002) == [True]
+
+
+def test_sqlite_store_survives_restart_and_respects_ttl(tmp_path):
+    path = str(tmp_path / "idem.db")
+    store = SQLiteIdempotencyStore(path, ttl_seconds=10, max_keys=100)
+    store.claim_many(["a"], now=1000)
+    store.close()
+
+    store = SQLiteIdempotencyStore(path, ttl_seconds=10, max_keys=100)
+    assert store.claim_many(["a"], now=1005) == [False]
+    assert store.claim_many(["a"], now=1011) == [True]
+
+
+def test_sqlite_store_cleanup_limits_size(tmp_path):
+    store = SQLiteIdempotencyStore(str(tmp_path / "idem.db"), ttl_seconds=3600, max_keys=2, cleanup_interval=0)
+    store.claim_many(["a"], now=1)
+    store.claim_many(["b"], now=2)
+    store.claim_many(["c"], now=3)
+    assert len(store) == 2
+    assert store.claim_many(["a"], now=4) == [True]
+
+
+def test_create_idempotency_store(tmp_path):
+    assert isinstance(create_idempotency_store("memory", 10, 10), MemoryIdempotencyStore)
+    store = create_idempotency_store("sqlite", 10, 10, path=str(tmp_path / "idem.db"))
+    assert isinstance(store, SQLiteIdempotencyStore)
+    with pytest.raises(ValueError):
+        create_idempotency_store("redis", 10, 10)
+
+
+def test_incomplete_backend_cannot_be_instantiated():
+    class SemUnmark(IdempotencyStore):
+        def claim_many(self, keys, now):
+            return [True] * len(keys)
+
+        def expire(self, now):
+            pass
+
+        def __len__(self):
+            return 0
+
+    with pytest.raises(TypeError, match="unmark"):
+        SemUnmark()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_waits_for_the_write_lock_off_the_event_loop(tmp_path):
+    import asyncio
+    import sqlite3
+    import time
+
+    path = str(tmp_path / "idem.db")
+    store = SQLiteIdempotencyStore(path, ttl_seconds=3600, max_keys=100)
+    store.claim_many(["a"], now=1)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")  # outro worker no meio de uma escrita
+
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    tick = asyncio.ensure_future(ticker())
+    pending = asyncio.ensure_future(asyncio.gather(store.aclaim_many(["a", "b"], now=2), store.aunmark("a")))
+    await asyncio.sleep(0.1)
+    assert not pending.done() and len(ticks) >= 5
+    assert len(store) == 1  # leitura não espera quem escreve
+    other.execute("COMMIT")
+    claimed, _ = await pending
+    tick.cancel()
+    assert claimed == [False, True] and len(store) == 1
+    other.close()
+    store.close()
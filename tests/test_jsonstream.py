@@ -0,0 +1,74 @@
+# tests/test_jsonstream.py
+import codecs
+import io
+import json
+
+import pytest
+
+from jsonstream import ArrayStreamParser, JSONStreamError, aiter_array, iter_array, iter_records
+
+DOC = [
+    {"evento": "cliente.cadastrado", "dados": {"razao_social": "Açaí [ltda], \"x\"", "id": 1}},
+    12345,
+    -1.5e10,
+    "texto com ] e ,",
+    True,
+    None,
+    [1, [2, {"a": []}]],
+]
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 10_000])
+def test_array_split_at_any_boundary(size):
+    data = json.dumps(DOC, ensure_ascii=False, indent=1).encode("utf-8")
+    assert list(iter_array(_chunks(data, size))) == DOC
+
+
+def test_items_are_yielded_before_the_end():
+    parser = ArrayStreamParser()
+    assert parser.feed(b'[{"a": 1}, {"b"') == [{"a": 1}]
+    assert parser.feed(b': 2}, 3') == [{"b": 2}]
+    assert parser.feed(b"]") == [3]
+    assert parser.close() == []
+
+
+@pytest.mark.parametrize("data", [b"", b"{}", b"[1, 2", b"[1 2]", b"[1,]", b"[1] 2", b'[{"a": }]'])
+def test_invalid_documents_raise(data):
+    with pytest.raises(JSONStreamError):
+        list(iter_array([data]))
+
+
+def test_item_size_is_bounded():
+    parser = ArrayStreamParser(max_item_size=100)
+    parser.feed(b'[{"a": "')
+    with pytest.raises(JSONStreamError):
+        parser.feed(b"x" * 200)
+
+
+async def test_async_array():
+    async def gen():
+        for chunk in _chunks(json.dumps(DOC).encode(), 5):
+            yield chunk
+
+    assert [item async for item in aiter_array(gen())] == DOC
+
+
+@pytest.mark.parametrize("ndjson", [False, True])
+def test_iter_records_detects_format(ndjson):
+    records = [{"id": i, "razao_social": f"C{i}"} for i in range(50)]
+    if ndjson:
+        data = b"\n".join(json.dumps(r).encode() for r in records) + b"\n\n"
+    else:
+        data = b"\xef\xbb\xbf  \n" + json.dumps(records).encode()
+    assert list(iter_records(io.BytesIO(data), chunk_size=16)) == records
+
+
+@pytest.mark.parametrize("size", [1, 5, 64])
+def test_object_ends_inside_strings_are_not_item_boundaries(size):
+    doc = [{"a": '"}, {"b": 1}, ', "c": [{"d": "},"}, {}]}, {"e": '\\"},'}, 7]
+    data = codecs.BOM_UTF8 + json.dumps(doc).encode()
+    assert list(iter_array(_chunks(data, size))) == doc
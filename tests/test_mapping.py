@@ -0,0 +1,161 @@
+# tests/test_mapping.py
+import glob
+import json
+import os
+
+import pytest
+
+import app as app_module
+from mapping import MappingSpecError, compile_mapping, load_mapper, load_spec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_map(dados):
+    """Cópia do map_mercos_to_rd original (if por campo sobre o MercosCliente)."""
+    mercos = app_module.MercosCliente.model_validate(dados)
+    body = {}
+    if mercos.razao_social:
+        body["name"] = mercos.razao_social
+    tel = mercos.principal_telefone()
+    if tel:
+        body["personal_phone"] = tel
+    if mercos.cidade:
+        body["city"] = mercos.cidade
+    if mercos.estado:
+        body["state"] = mercos.estado
+    if mercos.pais:
+        body["country"] = mercos.pais
+    custom_fields = {}
+    for field in ("cnpj", "nome_fantasia", "cep", "rua", "bairro", "numero", "complemento"):
+        if getattr(mercos, field):
+            custom_fields[field] = getattr(mercos, field)
+    if custom_fields:
+        body["custom_fields"] = custom_fields
+    return body
+
+
+def _exemplos():
+    dados = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "_docs", "*.example.json"))):
+        with open(path, encoding="utf-8") as fh:
+            dados.extend(item["dados"] for item in json.load(fh))
+    return dados
+
+
+CASOS = _exemplos() + [
+    {},
+    {"pais": None},
+    {"pais": ""},
+    {"razao_social": "", "cidade": "Blumenau", "pais": "AR"},
+    {"telefones": [{"tipo": "M"}, {"telefone": "4733334444"}]},
+    {"telefones": [{"numero": "", "fone": "4799990000"}]},
+    {"telefones": [{}, {"numero": "11999999999"}]},
+    {"telefones": []},
+    {"cnpj": "00.000.000/0001-00", "numero": "12", "complemento": "Sala 2"},
+]
+
+
+@pytest.mark.parametrize("dados", CASOS)
+def test_default_spec_matches_legacy_mapping(dados):
+    assert app_module.map_mercos_to_rd(dados) == legacy_map(dados)
+    assert app_module.map_mercos_to_rd(app_module.MercosCliente.model_validate(dados)) == legacy_map(dados)
+
+
+def test_transforms_and_defaults():
+    mapper = compile_mapping({"fields": [
+        {"target": "personal_phone", "source": "telefones[].numero", "transform": "str"},
+        {"target": "custom_fields.cnpj", "source": "cnpj", "transform": ["strip"]},
+        {"target": "state", "source": "endereco.uf", "transform": ["strip", "upper"]},
+        {"target": "country", "source": "pais", "default": "BR"},
+    ]})
+    out = mapper({
+        "telefones": [{"numero": 4799990000}],
+        "cnpj": " 00.000.000/0001-00 ",
+        "endereco": {"uf": " sc "},
+    })
+    assert out == {
+        "personal_phone": "4799990000",
+        "custom_fields": {"cnpj": "00.000.000/0001-00"},
+        "state": "SC",
+        "country": "BR",
+    }
+    # valor vazio depois do transform é descartado; default só vale quando a chave não existe
+    assert mapper({"cnpj": "  ", "pais": None}) == {}
+
+
+def test_digits_and_e164_transforms():
+    mapper = compile_mapping({"fields": [
+        {"target": "personal_phone", "source": "telefones[].numero", "transform": "e164"},
+        {"target": "custom_fields.cnpj", "source": "cnpj", "type": "str", "transform": ["digits"]},
+    ]})
+    assert mapper({"telefones": [{"numero": "(47) 99999-0000"}], "cnpj": "00.000.000/0001-00"}) == {
+        "personal_phone": "+5547999990000",
+        "custom_fields": {"cnpj": "00000000000100"},
+    }
+    assert mapper({"telefones": [{"numero": "+1 (415) 555-0100"}]}) == {"personal_phone": "+14155550100"}
+    assert mapper({"telefones": [{"numero": "0044 20 7946 0000"}]}) == {"personal_phone": "+442079460000"}
+    assert mapper({"telefones": [{"numero": 4733334444}]}) == {"personal_phone": "+554733334444"}
+    # curto demais (ou sem dígitos) não é enviado
+    assert mapper({"telefones": [{"numero": "123"}], "cnpj": "--"}) == {}
+
+
+def test_type_mismatch_raises():
+    mapper = load_mapper()
+    with pytest.raises(ValueError, match="numero: esperado str, recebido int"):
+        mapper({"razao_social": "X", "numero": 12})
+    with pytest.raises(ValueError, match="razao_social"):
+        mapper({"razao_social": ["X"]})
+    assert mapper({"numero": None, "pais": "AR"}) == {"country": "AR"}
+
+
+@pytest.mark.parametrize("spec", [
+    {},
+    {"fields": []},
+    {"fields": [{"target": "name"}]},
+    {"fields": [{"target": "name", "source": "x", "transform": "nope"}]},
+    {"fields": [{"target": "a.b.c", "source": "x"}]},
+    {"fields": [{"target": "name", "source": "a[].b[].c"}]},
+    {"fields": [{"target": "name", "source": "a.b", "default": "x"}]},
+    {"fields": [{"target": "name", "source": "x", "type": "texto"}]},
+])
+def test_invalid_spec_is_rejected(spec):
+    with pytest.raises(MappingSpecError):
+        compile_mapping(spec)
+
+
+def test_non_dict_dados_raises():
+    with pytest.raises(TypeError):
+        load_mapper()(["nao", "e", "objeto"])
+
+
+def test_yaml_spec(tmp_path):
+    yaml = pytest.importorskip("yaml")
+    path = tmp_path / "spec.yaml"
+    path.write_text(yaml.safe_dump(load_spec(os.path.join(ROOT, "mapping.json"))), encoding="utf-8")
+    for dados in CASOS:
+        assert load_mapper(str(path))(dados) == legacy_map(dados)
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_wrong_types_and_malformed_email(client, monkeypatch):
+    calls = []
+
+    async def send(*args, **kwargs):
+        calls.append(args)
+        return {"status": "ok"}
+
+    monkeypatch.setattr(app_module, "_send_upsert", send)
+    body = [
+        {"evento": "cliente.atualizado", "dados": {"numero": 12, "emails": [{"email": "tipo@mercos.com"}]}},
+        {"evento": "cliente.atualizado", "dados": {"razao_social": "X", "emails": [{"email": "sem-arroba"}]}},
+        {"evento": "cliente.atualizado", "dados": {"razao_social": "X", "emails": [{"email": 42}]}},
+    ]
+    r = await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=body)
+    results = r.json()["results"]
+    assert [res["status"] for res in results] == ["error", "error", "error"]
+    assert "numero" in results[0]["error"] and "e-mail inválido" in results[1]["error"]
+    assert calls == []
+
+    # chave liberada: o Mercos pode reenviar o evento corrigido
+    assert (await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=body[:1])).json()["results"][0]["status"] == "error"
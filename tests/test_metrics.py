@@ -0,0 +1,94 @@
+# tests/test_metrics.py
+import re
+
+import httpx
+import pytest
+import respx
+
+from metrics import Registry
+from rd_client import RDClient
+from tests.conftest import RD_BASE, mock_rd_token
+
+
+def _value(text, series):
+    match = re.search(rf"^{re.escape(series)} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_render_counter_and_histogram():
+    registry = Registry()
+    events = registry.counter("eventos_total", "Eventos", ("status",))
+    latency = registry.histogram("latencia_seconds", "Latência", buckets=(0.1, 1.0))
+    events.labels("ok").inc()
+    events.labels("ok").inc(2)
+    events.labels('com "aspas"').inc()
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+    registry.add_collector(lambda: [("fila", "gauge", "Fila", [({"nome": "a"}, 3)])])
+
+    text = registry.render()
+    assert "# TYPE eventos_total counter" in text
+    assert 'eventos_total{status="ok"} 3' in text
+    assert 'eventos_total{status="com \\"aspas\\""} 1' in text
+    assert 'latencia_seconds_bucket{le="0.1"} 1' in text
+    assert 'latencia_seconds_bucket{le="1"} 2' in text
+    assert 'latencia_seconds_bucket{le="+Inf"} 3' in text
+    assert "latencia_seconds_count 3" in text
+    assert 'fila{nome="a"} 3' in text
+    # registrar de novo devolve a mesma série
+    assert registry.counter("eventos_total", "Eventos", ("status",)) is events
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_metrics_endpoint_counts_events_and_rd_calls(client):
+    mock_rd_token()
+    respx.route(method="PATCH").mock(return_value=httpx.Response(200, json={}))
+    respx.route(method="POST", url__regex=r".*/tag$").mock(return_value=httpx.Response(200, json={}))
+
+    before = (await client.get("/metrics?token=SEGREDO")).text
+    item = {"evento": "cliente.atualizado", "dados": {"razao_social": "M", "emails": [{"email": "metricas@mercos.com"}]}}
+    batch = [item, item, {"evento": "cliente.qualquer", "dados": {"emails": [{"email": "x@mercos.com"}]}}]
+    assert (await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=batch)).status_code == 200
+
+    r = await client.get("/metrics?token=SEGREDO")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    after = r.text
+
+    def delta(series):
+        return _value(after, series) - _value(before, series)
+
+    assert delta('mercos_webhook_events_total{evento="cliente.atualizado",status="ok"}') == 1
+    assert delta('mercos_webhook_events_total{evento="cliente.atualizado",status="duplicate"}') == 1
+    assert delta('mercos_webhook_events_total{evento="outro",status="ignored"}') == 1
+    assert delta('idempotency_lookups_total{result="hit"}') == 1
+    assert delta('rd_client_call_seconds_count{method="sync_contact"}') == 1
+    assert delta("mercos_webhook_request_seconds_count") == 1
+    assert delta("mercos_mapping_seconds_count") == 2  # duplicado não é mapeado
+    assert "idempotency_keys " in after
+
+
+@pytest.mark.asyncio
+async def test_metrics_requires_token(client):
+    assert (await client.get("/metrics")).status_code == 401
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_retries_and_backoff_are_counted():
+    from metrics import REGISTRY
+
+    mock_rd_token()
+    respx.patch(f"{RD_BASE}/platform/contacts/email:retry-metrica@mercos.com").mock(
+        side_effect=[httpx.Response(429, headers={"Retry-After": "0.01"}), httpx.Response(200, json={})]
+    )
+    before = REGISTRY.render()
+    async with RDClient("cid", "secret", "rft") as rd:
+        await rd.upsert_contact_by_email("retry-metrica@mercos.com", {"name": "R"})
+    after = REGISTRY.render()
+
+    assert _value(after, 'rd_client_retries_total{reason="429"}') - _value(before, 'rd_client_retries_total{reason="429"}') == 1
+    assert _value(after, "rd_client_backoff_seconds_total") - _value(before, "rd_client_backoff_seconds_total") == pytest.approx(0.01)
+    refreshes = 'rd_client_call_seconds_count{method="refresh_access_token"}'
+    assert _value(after, refreshes) - _value(before, refreshes) == 1
@@ -0,0 +1,104 @@
+# tests/test_negative_cache.py
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from rd_client import KnownRejectionError, NegativeCache, RDClient
+from tests.conftest import RD_BASE, Clock, mock_rd_token
+
+URL = "/webhooks/mercos/clientes?token=SEGREDO"
+INVALID_FIELD = {"errors": [{"error_type": "INVALID_FIELDS", "error_message": "cf_segmento não existe"}]}
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_rejected_payload_fails_fast_until_ttl_or_payload_change():
+    mock_rd_token()
+    email = "ruim@mercos.com"
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(return_value=httpx.Response(422, json=INVALID_FIELD))
+    clock = Clock()
+
+    async with RDClient("cid", "secret", "rft", negative_cache=NegativeCache(60, clock=clock)) as rd:
+        with pytest.raises(httpx.HTTPStatusError):
+            await rd.sync_contact(email, {"cf_segmento": "x"}, ["mercos"])
+        for _ in range(3):
+            with pytest.raises(KnownRejectionError) as exc:
+                await rd.sync_contact(email, {"cf_segmento": "x"}, ["mercos"])
+        assert exc.value.error_class == "422:INVALID_FIELDS"
+        assert "cf_segmento" in str(exc.value)
+        assert patch.call_count == 1
+
+        # payload corrigido passa; o antigo volta a ser tentado depois do TTL
+        with pytest.raises(httpx.HTTPStatusError):
+            await rd.sync_contact(email, {"name": "Outro"}, ["mercos"])
+        assert patch.call_count == 2
+        clock.now += 61
+        with pytest.raises(httpx.HTTPStatusError):
+            await rd.upsert_contact_by_email(email, {"cf_segmento": "x"})
+        assert patch.call_count == 3
+
+        offenders = rd.negative_cache.offenders()
+    assert offenders[0]["email"] == email and offenders[0]["blocked"] == 3
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_server_errors_and_not_found_are_not_cached():
+    mock_rd_token()
+    email = "transitorio@mercos.com"
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(return_value=httpx.Response(404, json={}))
+    create = respx.post(f"{RD_BASE}/platform/contacts").mock(
+        side_effect=[httpx.Response(503, json={}), httpx.Response(201, json={"uuid": "u1"})]
+    )
+
+    async with RDClient("cid", "secret", "rft", max_retries=0, negative_cache=NegativeCache(60)) as rd:
+        with pytest.raises(httpx.HTTPStatusError):
+            await rd.sync_contact(email, {"name": "X"}, [])
+        result = await rd.sync_contact(email, {"name": "X"}, [])
+    assert result.created and patch.call_count == 2 and create.call_count == 2
+
+
+def test_bounded_lru():
+    cache = NegativeCache(60, max_entries=2)
+    for i in range(3):
+        cache.add(f"e{i}@x.com", "h", "400", "")
+    assert len(cache) == 2
+    assert cache.check("e0@x.com", "h") is None
+    assert cache.check("e2@x.com", "h") is not None
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_webhook_reports_error_and_admin_lists_offenders(client, monkeypatch):
+    mock_rd_token()
+    email = "invalido@mercos.com"
+    rd = app_module.get_rd()
+    monkeypatch.setattr(rd, "negative_cache", NegativeCache(60))
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(
+        return_value=httpx.Response(400, json={"errors": {"error_type": "INVALID_EMAIL"}})
+    )
+    body = [{"evento": "cliente.atualizado", "dados": {"razao_social": "X", "emails": [{"email": email}]}}]
+
+    for _ in range(3):
+        r = await client.post(URL, json=body)
+        assert r.json()["results"][0]["status"] == "error"
+    assert patch.call_count == 1
+
+    offenders = (await client.get("/admin/rd-rejections?token=SEGREDO")).json()["offenders"]
+    assert offenders[0]["email"] == email and offenders[0]["error"] == "400:INVALID_EMAIL"
+    assert offenders[0]["blocked"] == 2
+
+
+@pytest.mark.asyncio
+async def test_replay_clears_cached_rejections(client, monkeypatch, tmp_path):
+    from failed_events import FailedEventStore
+
+    cache = NegativeCache(60)
+    cache.add("x@mercos.com", "h", "422", "")
+    monkeypatch.setattr(app_module.get_rd(), "negative_cache", cache)
+    monkeypatch.setattr(app_module, "_FAILED", FailedEventStore(str(tmp_path / "failed.ndjson")))
+    monkeypatch.setattr(app_module, "_REPLAY", None)
+
+    r = await client.post("/admin/failed-events/replay?token=SEGREDO")
+    assert r.status_code == 202 and len(cache) == 0
@@ -0,0 +1,67 @@
+# tests/test_rate_limit.py
+import time
+
+import httpx
+import pytest
+import respx
+
+from rd_client import RDClient, TokenBucket
+from tests.conftest import RD_BASE, mock_rd_token
+
+
+@pytest.mark.asyncio
+async def test_bucket_paces_requests():
+    bucket = TokenBucket(20, burst=1)
+    start = time.monotonic()
+    for _ in range(5):
+        await bucket.acquire()
+    elapsed = time.monotonic() - start
+    # 1 token de burst + 4 a 20/s ≈ 0.2s
+    assert 0.15 <= elapsed < 1.0
+    assert bucket.stats()["waits"] == 4
+
+
+def test_bucket_adapts_to_throttling():
+    bucket = TokenBucket(10, increase_step=1)
+    bucket.on_throttle(retry_after=2)
+    assert bucket.rate == 5
+    assert bucket.stats()["throttled"] == 1
+    bucket.on_success()
+    assert bucket.rate == 6
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 10
+
+
+def test_bucket_never_below_min_rate():
+    bucket = TokenBucket(1, min_rate=0.5)
+    for _ in range(5):
+        bucket.on_throttle()
+    assert bucket.rate == 0.5
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_client_feeds_429_back_into_family_limiter():
+    mock_rd_token()
+    respx.post(f"{RD_BASE}/platform/contacts/email:a@x.com/tag").mock(side_effect=[
+        httpx.Response(429, headers={"Retry-After": "0"}, json={}),
+        httpx.Response(200, json={"ok": True}),
+    ])
+    respx.patch(f"{RD_BASE}/platform/contacts/email:a@x.com").mock(return_value=httpx.Response(200, json={}))
+
+    async with RDClient("cid", "secret", "rft", backoff_base=0.01, rate_limits={"contacts": 100, "tag": 100}) as rd:
+        await rd.add_tags("email", "a@x.com", ["mercos"])
+        await rd.upsert_contact_by_email("a@x.com", {"name": "A"})
+        stats = rd.rate_limit_stats()
+
+    assert stats["tag"]["throttled"] == 1
+    assert stats["tag"]["acquired"] == 2
+    assert stats["tag"]["rate"] < 100
+    assert stats["contacts"]["throttled"] == 0
+    assert stats["contacts"]["acquired"] == 1
+
+
+def test_rate_limits_are_optional():
+    rd = RDClient("cid", "secret", "rft", rate_limits={"contacts": 0})
+    assert rd.rate_limit_stats() == {}
@@ -0,0 +1,98 @@
+# tests/test_streaming.py
+import asyncio
+import json
+
+import pytest
+import respx
+from tests.conftest import make_event, mock_rd
+
+URL = "/webhooks/mercos/clientes?token=SEGREDO"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_first_rd_call_happens_before_body_ends(client):
+    first_patch = asyncio.Event()
+    mock_rd(on_patch=lambda email: first_patch.set())
+    sent_before_end = None
+
+    async def body():
+        nonlocal sent_before_end
+        yield b"[" + json.dumps(make_event("cliente.atualizado", "stream-a@mercos.com")).encode() + b","
+        try:
+            await asyncio.wait_for(first_patch.wait(), 2)
+            sent_before_end = True
+        except asyncio.TimeoutError:
+            sent_before_end = False
+        yield json.dumps(make_event("cliente.atualizado", "stream-b@mercos.com")).encode() + b"]"
+
+    r = await client.post(URL, content=body())
+    assert r.status_code == 200
+    assert sent_before_end is True
+    assert [res["contact"]["email"] for res in r.json()["results"]] == ["stream-a@mercos.com", "stream-b@mercos.com"]
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_events_split_across_tiny_chunks_keep_order(client, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, "WEBHOOK_MAX_PENDING", 2)
+    mock_rd()
+    emails = [f"pedaco{i}@mercos.com" for i in range(8)]
+    data = json.dumps([make_event("cliente.atualizado", e) for e in emails]).encode()
+
+    async def body():
+        for i in range(0, len(data), 7):
+            yield data[i:i + 7]
+
+    r = await client.post(URL, content=body())
+    assert r.status_code == 200
+    assert [res["contact"]["email"] for res in r.json()["results"]] == emails
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_truncated_body_is_422_after_finishing_started_events(client):
+    done = []
+    mock_rd(on_patch=done.append)
+
+    async def body():
+        yield b"[" + json.dumps(make_event("cliente.atualizado", "truncado@mercos.com")).encode() + b","
+        yield b'{"evento": "cliente.atualizado", "dad'
+
+    r = await client.post(URL, content=body())
+    assert r.status_code == 422
+    assert done == ["truncado@mercos.com"]
+
+
+@pytest.mark.asyncio
+async def test_oversized_event_is_rejected(client, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, "WEBHOOK_MAX_EVENT_BYTES", 100)
+    big = json.dumps([make_event("cliente.atualizado", "grande@mercos.com", razao_social="x" * 500)]).encode()
+
+    async def body():
+        for i in range(0, len(big), 50):
+            yield big[i:i + 50]
+
+    r = await client.post(URL, content=body())
+    assert r.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_oversized_non_array_body_is_413(client, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, "WEBHOOK_MAX_EVENT_BYTES", 200)
+    small = await client.post(URL, content=json.dumps(make_event("cliente.atualizado", "x@mercos.com")).encode())
+    assert small.status_code == 400
+
+    async def body():
+        yield b'{"dados": "'
+        for _ in range(10):
+            yield b"x" * 50
+
+    r = await client.post(URL, content=body())
+    assert r.status_code == 413
@@ -0,0 +1,74 @@
+# tests/test_sync_contact.py
+import json
+
+import httpx
+import pytest
+import respx
+
+from rd_client import RDClient
+from tests.conftest import RD_BASE, mock_rd_token
+
+EMAIL = "sync@mercos.com"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_new_contact_gets_tags_in_create_body():
+    mock_rd_token()
+    respx.patch(f"{RD_BASE}/platform/contacts/email:{EMAIL}").mock(return_value=httpx.Response(404, json={}))
+    create = respx.post(f"{RD_BASE}/platform/contacts").mock(return_value=httpx.Response(201, json={"uuid": "u1"}))
+    tag = respx.post(f"{RD_BASE}/platform/contacts/email:{EMAIL}/tag").mock(return_value=httpx.Response(200, json={}))
+
+    async with RDClient("cid", "secret", "rft") as rd:
+        result = await rd.sync_contact(EMAIL, {"name": "X"}, ["mercos", "cliente.cadastrado"])
+
+    assert result.created
+    assert result.contact == {"uuid": "u1"}
+    assert json.loads(create.calls.last.request.content) == {
+        "email": EMAIL,
+        "name": "X",
+        "tags": ["mercos", "cliente.cadastrado"],
+    }
+    assert not tag.called
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_known_tags_are_not_sent_again():
+    mock_rd_token()
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{EMAIL}").mock(return_value=httpx.Response(200, json={"uuid": "u1"}))
+    tag = respx.post(f"{RD_BASE}/platform/contacts/email:{EMAIL}/tag").mock(return_value=httpx.Response(200, json={}))
+
+    async with RDClient("cid", "secret", "rft") as rd:
+        first = await rd.sync_contact(EMAIL, {"name": "X"}, ["mercos", "cliente.atualizado"])
+        second = await rd.sync_contact(EMAIL, {"name": "Y"}, ["mercos", "cliente.atualizado"])
+        third = await rd.sync_contact(EMAIL, {"name": "Z"}, ["mercos", "cliente.bloqueioatualizado"])
+        stats = rd.sync_stats()
+
+    assert first.tags_sent == ["mercos", "cliente.atualizado"]
+    assert second.tags_sent == []
+    assert third.tags_sent == ["cliente.bloqueioatualizado"]
+    assert patch.call_count == 3
+    assert tag.call_count == 2
+    assert stats["tags_skipped"] == 3
+    assert stats["known_contacts"] == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_tag_failure_is_reported_and_retried_next_time():
+    mock_rd_token()
+    respx.patch(f"{RD_BASE}/platform/contacts/email:{EMAIL}").mock(return_value=httpx.Response(200, json={}))
+    tag = respx.post(f"{RD_BASE}/platform/contacts/email:{EMAIL}/tag").mock(side_effect=[
+        httpx.Response(400, json={}),
+        httpx.Response(200, json={}),
+    ])
+
+    async with RDClient("cid", "secret", "rft") as rd:
+        failed = await rd.sync_contact(EMAIL, {}, ["mercos"])
+        retried = await rd.sync_contact(EMAIL, {}, ["mercos"])
+
+    assert failed.tags_error is not None
+    assert retried.tags_error is None
+    assert retried.tags_sent == ["mercos"]
+    assert tag.call_count == 2
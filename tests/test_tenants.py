@@ -0,0 +1,210 @@
+# tests/test_tenants.py
+import asyncio
+import dataclasses
+import json
+import sqlite3
+
+import httpx
+import pytest
+import respx
+
+import app as app_module
+from event_queue import EventQueue
+from rd_client import RDClient
+from settings import SettingsError
+from tenants import TenantConfig, TenantRegistry, load_tenants
+from tests.conftest import RD_BASE, Clock, make_event
+
+
+def _config(name, **extra):
+    return TenantConfig(name, f"tok-{name}", f"{name}-id", f"{name}-secret", f"{name}-rft", **extra)
+
+
+def test_load_tenants_resolves_env_and_validates(tmp_path):
+    path = tmp_path / "tenants.json"
+    entry = {"name": "acme", "webhook_token": "env:ACME_TOKEN", "rd_client_id": "id", "rd_client_secret": "s",
+             "rd_refresh_token": "r", "default_tags": ["acme"], "rate_limit_contacts": 2}
+    path.write_text(json.dumps([entry]))
+    [config] = load_tenants(str(path), {"ACME_TOKEN": "t1"})
+    assert config.webhook_token == "t1" and config.default_tags == ("acme",) and config.rate_limit_tags is None
+
+    with pytest.raises(SettingsError, match="ACME_TOKEN"):
+        load_tenants(str(path), {})
+    path.write_text(json.dumps([{**entry, "webhook_token": "t"}, {**entry, "name": "outro", "webhook_token": "t"}]))
+    with pytest.raises(SettingsError, match="webhook_token repetido"):
+        load_tenants(str(path))
+    path.write_text(json.dumps([{"name": "sem-credencial", "webhook_token": "t"}]))
+    with pytest.raises(SettingsError, match="rd_client_id"):
+        load_tenants(str(path))
+
+
+@pytest.mark.asyncio
+async def test_clients_are_lazy_capped_and_evicted_when_idle():
+    clock = Clock()
+    registry = TenantRegistry(
+        [_config("a")], lambda c: RDClient(c.rd_client_id, c.rd_client_secret, c.rd_refresh_token),
+        idle_seconds=60, max_in_flight=1, clock=clock,
+    )
+    tenant = registry.by_token("tok-a")
+    assert tenant.client is None
+
+    order = []
+
+    async def use(label):
+        async with registry.lease(tenant):
+            order.append(f"{label}+")
+            await asyncio.sleep(0.01)
+            order.append(f"{label}-")
+
+    await asyncio.gather(use("x"), use("y"))
+    assert order == ["x+", "x-", "y+", "y-"]  # teto de 1 chamada simultânea
+    assert registry.created == 1
+
+    clock.now += 30
+    assert await registry.evict_idle() == 0
+    clock.now += 31
+    assert await registry.evict_idle() == 1 and tenant.client is None
+    async with registry.lease(tenant) as client:
+        assert client is tenant.client
+    assert registry.stats()["created"] == 2 and registry.stats()["evicted"] == 1
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_webhook_routes_by_token_with_separate_namespaces(client, monkeypatch):
+    token_route = respx.post(f"{RD_BASE}/auth/token").mock(
+        return_value=httpx.Response(200, json={"access_token": "at", "expires_in": 900})
+    )
+    email = "multi@mercos.com"
+    patch = respx.patch(f"{RD_BASE}/platform/contacts/email:{email}").mock(return_value=httpx.Response(200, json={}))
+    tag = respx.post(f"{RD_BASE}/platform/contacts/email:{email}/tag").mock(return_value=httpx.Response(200, json={}))
+    registry = TenantRegistry(
+        [_config("acme", default_tags=("acme",)), _config("beta")],
+        lambda c: app_module._create_rd(app_module.SETTINGS, c),
+    )
+    monkeypatch.setattr(app_module, "_TENANTS", registry)
+
+    for token in ("tok-acme", "tok-beta", "SEGREDO"):
+        r = await client.post(f"/webhooks/mercos/clientes?token={token}", json=[make_event("cliente.atualizado", email)])
+        assert r.json()["results"][0]["status"] == "ok", token
+
+    # mesmo evento e mesmo e-mail em três contas RD: nada de "duplicate" ou "unchanged" entre elas
+    assert patch.call_count == 3
+    client_ids = {dict(httpx.QueryParams(c.request.content.decode()))["client_id"] for c in token_route.calls}
+    assert {"acme-id", "beta-id"} <= client_ids
+    assert any("acme" in json.loads(c.request.content)["tags"] for c in tag.calls)
+
+    # dentro do tenant a idempotência continua valendo
+    r = await client.post("/webhooks/mercos/clientes?token=tok-acme", json=[make_event("cliente.atualizado", email)])
+    assert r.json()["results"][0]["status"] == "duplicate"
+
+    stats = (await client.get("/stats?token=SEGREDO")).json()["tenants"]
+    assert stats["tenants"] == 2 and stats["active_clients"] == 2
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_tenants_only_rejects_unknown_token(client, monkeypatch):
+    monkeypatch.setattr(app_module, "_TENANTS", TenantRegistry([_config("acme")], lambda c: None))
+    monkeypatch.setattr(app_module, "SETTINGS", dataclasses.replace(app_module.SETTINGS, rd_client_id=None))
+    r = await client.post("/webhooks/mercos/clientes?token=SEGREDO", json=[make_event("cliente.atualizado", "x@mercos.com")])
+    assert r.status_code == 401
+
+
+def test_queue_keeps_tenant_and_migrates_old_files(tmp_path):
+    path = str(tmp_path / "queue.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE events (id INTEGER PRIMARY KEY AUTOINCREMENT, partition TEXT, payload TEXT NOT NULL,"
+        " enqueued_at REAL NOT NULL, available_at REAL NOT NULL, locked_until REAL NOT NULL DEFAULT 0,"
+        " attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT);"
+        "INSERT INTO events (partition, payload, enqueued_at, available_at) VALUES ('a@x.com', '{\"n\": 1}', 0, 0);"
+    )
+    conn.close()
+
+    queue = EventQueue(path, max_retries=1)
+    queue.enqueue_many([{"n": 2}], ["acme:b@x.com"], tenant="acme")
+    old, new = queue.claim(10)
+    assert (old.item, old.tenant) == ({"n": 1}, None)
+    assert (new.item, new.tenant) == ({"n": 2}, "acme")
+    queue.fail(new.id, "boom")
+    assert queue.dead_letters()[0]["tenant"] == "acme"
+    queue.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_events_are_replayed_through_their_tenant(tmp_path):
+    from failed_events import FailedEventStore, Replayer
+
+    store = FailedEventStore(str(tmp_path / "failed.ndjson"))
+    store.record("acme:k1", {"n": 1}, "erro", "acme")
+    store.record("k2", {"n": 2}, "erro")
+    calls = []
+
+    async def process(items, tenant=None):
+        calls.append((items[0]["n"], tenant))
+        return [{"status": "ok"}]
+
+    await Replayer(FailedEventStore(store.path), process).run()
+    assert sorted(calls) == [(1, "acme"), (2, None)]
+
+
+@pytest.mark.asyncio
+async def test_lease_during_pending_eviction_gets_a_fresh_client():
+    clock = Clock()
+
+    class SlowClient:
+        def __init__(self):
+            self.closed = False
+
+        async def aclose(self):
+            await asyncio.sleep(0.02)
+            self.closed = True
+
+    registry = TenantRegistry([_config("a"), _config("b")], lambda c: SlowClient(), idle_seconds=60, clock=clock)
+    a, b = registry.get("a"), registry.get("b")
+    old_a, old_b = registry.client(a), registry.client(b)
+    clock.now += 61
+
+    eviction = asyncio.ensure_future(registry.evict_idle())
+    await asyncio.sleep(0)  # fechamento em andamento
+    async with registry.lease(b) as leased:
+        assert leased is not old_b
+        assert await eviction == 2
+        assert not leased.closed and b.client is leased
+    assert old_a.closed and old_b.closed
+
+
+def test_tenants_require_a_distinct_admin_token(tmp_path):
+    path = tmp_path / "tenants.json"
+    entry = {"name": "acme", "webhook_token": "t1", "rd_client_id": "id", "rd_client_secret": "s", "rd_refresh_token": "r"}
+    path.write_text(json.dumps([entry]))
+    settings = dataclasses.replace(app_module.SETTINGS, tenants_path=str(path), mercos_webhook_token=None)
+    with pytest.raises(SettingsError, match="MERCOS_WEBHOOK_TOKEN"):
+        app_module.configure(settings)
+    with pytest.raises(SettingsError, match="igual"):
+        app_module.configure(dataclasses.replace(settings, mercos_webhook_token="t1"))
+
+
+@pytest.mark.asyncio
+async def test_admin_views_include_tenant_clients(client, monkeypatch):
+    from rd_client import NegativeCache
+
+    registry = TenantRegistry(
+        [_config("acme")],
+        lambda c: RDClient(c.rd_client_id, c.rd_client_secret, c.rd_refresh_token, negative_cache=NegativeCache(60)),
+    )
+    monkeypatch.setattr(app_module, "_TENANTS", registry)
+    registry.client(registry.get("acme")).negative_cache.add("ruim@acme.com", "h", "422:INVALID_FIELDS", "")
+
+    r = await client.get("/admin/rd-rejections?token=SEGREDO")
+    assert r.json()["offenders"] == [
+        {**registry.get("acme").client.negative_cache.offenders()[0], "tenant": "acme"}
+    ]
+    stats = (await client.get("/stats?token=SEGREDO")).json()
+    assert stats["rd_tenants"]["acme"]["negative_cache"]["entries"] == 1
+    text = (await client.get("/metrics?token=SEGREDO")).text
+    assert 'rd_client_negative_cache_entries{tenant="acme"} 1' in text
+    assert text.count("# TYPE rd_client_token_refreshes_total") == 1
+    await registry.aclose()
@@ -0,0 +1,79 @@
+# tests/test_token_refresh.py
+import asyncio
+
+import httpx
+import pytest
+import respx
+
+from rd_client import RDClient
+from tests.conftest import RD_BASE
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_concurrent_callers_share_one_refresh():
+    async def slow_token(request):
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, json={"access_token": "at", "expires_in": 900})
+
+    token = respx.post(f"{RD_BASE}/auth/token").mock(side_effect=slow_token)
+    respx.route(method="PATCH").mock(return_value=httpx.Response(200, json={}))
+
+    async with RDClient("cid", "secret", "rft") as rd:
+        await asyncio.gather(*(rd.upsert_contact_by_email(f"c{i}@x.com", {}) for i in range(20)))
+        assert rd.token_refreshes == 1
+    assert token.call_count == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_wave_of_401_refreshes_once():
+    tokens = iter(["at1", "at2", "at3"])
+    token = respx.post(f"{RD_BASE}/auth/token").mock(
+        side_effect=lambda request: httpx.Response(200, json={"access_token": next(tokens), "expires_in": 900})
+    )
+
+    def patch(request):
+        if request.headers["Authorization"] == "Bearer at1":
+            return httpx.Response(401, json={})
+        return httpx.Response(200, json={})
+
+    respx.route(method="PATCH").mock(side_effect=patch)
+
+    async with RDClient("cid", "secret", "rft") as rd:
+        await rd._get_access_token()
+        await asyncio.gather(*(rd.upsert_contact_by_email(f"c{i}@x.com", {}) for i in range(10)))
+    # 1 inicial + 1 único refresh após a onda de 401
+    assert token.call_count == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_background_refresher_renews_before_expiry():
+    respx.post(f"{RD_BASE}/auth/token").mock(return_value=httpx.Response(200, json={"access_token": "at", "expires_in": 1}))
+
+    async with RDClient("cid", "secret", "rft") as rd:
+        rd.start_token_refresher(margin=60)
+        await asyncio.sleep(0.05)
+        # pré-aquecido: já existe token sem nenhuma requisição
+        assert rd._access_token == "at"
+        first_expiry = rd._expires_at
+        # validade de 1s → renova na metade
+        await asyncio.sleep(0.7)
+        assert rd.token_refreshes >= 2
+        assert rd._expires_at > first_expiry
+    assert rd._refresher is None
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_background_refresher_backs_off_on_non_positive_expiry():
+    token = respx.post(f"{RD_BASE}/auth/token").mock(
+        return_value=httpx.Response(200, json={"access_token": "at", "expires_in": 0})
+    )
+
+    async with RDClient("cid", "secret", "rft") as rd:
+        rd.start_token_refresher(margin=60, retry_delay=0.1)
+        await asyncio.sleep(0.25)
+    # 1 inicial + no máximo 1 por retry_delay, em vez de um laço sem espera
+    assert 2 <= token.call_count <= 4
@@ -0,0 +1,113 @@
+# tests/test_tracing.py
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import pstats
+
+import pytest
+import respx
+
+import app as app_module
+import tracing
+from settings import Settings
+from tests.conftest import mock_rd
+
+URL = "/webhooks/mercos/clientes?token=SEGREDO"
+
+
+def _batch(email):
+    return [{"evento": "cliente.atualizado", "dados": {"razao_social": "T", "emails": [{"email": email}]}}]
+
+
+async def test_spans_accumulate_across_tasks_only_inside_a_trace():
+    with tracing.span("fora"):
+        pass  # sem trace ativo: nada a registrar
+
+    trace, token = tracing.start()
+    try:
+        async def work():
+            with tracing.span("rd_http"):
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(work(), work())
+        with tracing.span("parse"):
+            pass
+    finally:
+        tracing.finish(token)
+
+    assert tracing.current() is None
+    assert trace.spans["rd_http"][1] == 2 and trace.spans["rd_http"][0] >= 0.02
+    assert trace.spans["parse"][1] == 1
+    assert 'rd_http;dur=' in trace.server_timing() and "total;dur=" in trace.server_timing()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_webhook_returns_server_timing(client, monkeypatch):
+    mock_rd()
+    monkeypatch.setattr(app_module, "_TRACE_HEADER", True)
+    r = await client.post(URL, json=_batch("trace-header@mercos.com"))
+    assert r.status_code == 200
+    names = {part.split(";")[0].strip() for part in r.headers["server-timing"].split(",")}
+    assert {"parse", "idempotency", "map", "rd_http", "total"} <= names
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_server_timing_is_off_by_default(client):
+    mock_rd()
+    assert Settings.from_env().trace_mode == "off"
+    r = await client.post(URL, json=_batch("trace-off@mercos.com"))
+    assert r.status_code == 200 and "server-timing" not in r.headers
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_trace_log_line(client, monkeypatch, caplog):
+    mock_rd()
+    monkeypatch.setattr(app_module, "_TRACE_LOG", True)
+    monkeypatch.setattr(app_module, "_TRACE_HEADER", False)
+    with caplog.at_level(logging.INFO, logger="app"):
+        r = await client.post(URL, json=_batch("trace-log@mercos.com"))
+    assert "server-timing" not in r.headers
+    line = json.loads(caplog.records[-1].getMessage())
+    assert line["trace"] == "webhook" and line["status"] == 200
+    assert line["spans"]["rd_http"]["count"] == 2  # PATCH + tag
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_admin_enables_sampled_profiling(client, monkeypatch, tmp_path):
+    mock_rd()
+    monkeypatch.setattr(app_module, "_PROFILER", tracing.SamplingProfiler(str(tmp_path), max_files=1))
+
+    assert (await client.post("/admin/profiling?rate=1")).status_code == 401
+    r = await client.post("/admin/profiling?token=SEGREDO&rate=1&duration=60")
+    assert r.json()["rate"] == 1.0
+
+    await client.post(URL, json=_batch("perfil1@mercos.com"))
+    await client.post(URL, json=_batch("perfil2@mercos.com"))
+    status = (await client.get("/admin/profiling?token=SEGREDO")).json()
+    assert status["sampled"] == 2
+    assert len(status["files"]) == 1  # max_files
+    assert pstats.Stats(status["files"][0]).total_calls > 0
+
+    await client.post("/admin/profiling?token=SEGREDO&rate=0")
+    await client.post(URL, json=_batch("perfil3@mercos.com"))
+    assert (await client.get("/admin/profiling?token=SEGREDO")).json()["sampled"] == 2
+
+
+@pytest.mark.asyncio
+async def test_profiling_needs_a_configured_token_and_stays_in_its_directory(client, monkeypatch, tmp_path):
+    profiler = tracing.SamplingProfiler(str(tmp_path / "perfis"))
+    monkeypatch.setattr(app_module, "_PROFILER", profiler)
+    monkeypatch.setattr(app_module, "MERCOS_URL_TOKEN", None)
+    assert (await client.post("/admin/profiling?rate=1")).status_code == 403
+    assert profiler.rate == 0
+
+    profile = cProfile.Profile()
+    profile.enable()
+    path = profiler.stop(profile, "../../fora")
+    assert os.path.dirname(path) == os.path.realpath(tmp_path / "perfis")
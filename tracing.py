@@ -0,0 +1,165 @@
+"""
+Rastreamento leve por requisição + profiling amostrado sob demanda.
+
+Spans: `with tracing.span("nome"):` soma o tempo gasto no trecho ao trace da
+requisição corrente (ContextVar, então tasks criadas dentro da requisição
+herdam o mesmo trace). Sem trace ativo o span não mede nada. Trechos que
+rodam em paralelo somam os seus tempos: o total de um span pode passar da
+duração da requisição (ex.: 10 chamadas simultâneas ao RD).
+
+Profiling: SamplingProfiler passa uma fração das requisições pelo cProfile
+e grava cada perfil (.prof) em disco, para análise com pstats/snakeviz.
+"""
+import cProfile
+import os
+import random
+import re
+import time
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Optional, Tuple
+
+_CURRENT: "ContextVar[Optional[Trace]]" = ContextVar("trace", default=None)
+
+
+class Trace:
+    __slots__ = ("started", "spans")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}  # nome → [segundos, chamadas]
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Valor do header Server-Timing (durações em ms)."""
+        parts = [f'{name};dur={seconds * 1000:.2f};desc="{int(count)}x"' for name, (seconds, count) in self.spans.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round(self.elapsed() * 1000, 3),
+            "spans": {name: {"ms": round(s * 1000, 3), "count": int(c)} for name, (s, c) in self.spans.items()},
+        }
+
+
+class _Span:
+    __slots__ = ("name", "trace", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.trace = _CURRENT.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.started)
+
+
+def span(name: str) -> _Span:
+    return _Span(name)
+
+
+def start() -> Tuple[Trace, Token]:
+    """Abre um trace para a requisição corrente; feche com finish(token)."""
+    trace = Trace()
+    return trace, _CURRENT.set(trace)
+
+
+def finish(token: Token) -> None:
+    _CURRENT.reset(token)
+
+
+def current() -> Optional[Trace]:
+    return _CURRENT.get()
+
+
+_UNSAFE_LABEL = re.compile(r"[^A-Za-z0-9_-]")
+
+
+class SamplingProfiler:
+    """
+    Profiling opt-in: com rate > 0 (ligado por um admin, opcionalmente por
+    `duration` segundos), cada requisição tem essa chance de rodar sob o
+    cProfile. Um perfil por vez (o cProfile é global ao interpretador);
+    guarda no máximo max_files arquivos, apagando os mais antigos.
+
+    Os arquivos ficam sempre dentro de `directory` (PROFILE_DIR, resolvido
+    no início): o rótulo entra no nome só com letras, números, _ e -.
+
+    Em asyncio o perfil inclui o que mais o event loop executou enquanto a
+    requisição estava aberta — útil para ver onde o processo gasta CPU.
+    """
+
+    def __init__(self, directory: str, *, max_files: int = 100):
+        self.directory = os.path.realpath(directory)
+        self.max_files = max_files
+        self.rate = 0.0
+        self.until: Optional[float] = None
+        self.sampled = 0
+        self._active = False
+        self._files: List[str] = []
+
+    def configure(self, rate: float, duration: Optional[float] = None) -> None:
+        self.rate = min(max(rate, 0.0), 1.0)
+        self.until = time.time() + duration if duration and self.rate > 0 else None
+
+    def enabled(self) -> bool:
+        if self.rate <= 0:
+            return False
+        if self.until is not None and time.time() >= self.until:
+            self.rate, self.until = 0.0, None
+            return False
+        return True
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """Sorteia a requisição; devolve o profiler já ligado, ou None."""
+        if self._active or not self.enabled() or random.random() >= self.rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # outro profiler já está ativo no processo
+            return None
+        self._active = True
+        return profile
+
+    def stop(self, profile: cProfile.Profile, label: str) -> str:
+        profile.disable()
+        self._active = False
+        os.makedirs(self.directory, exist_ok=True)
+        label = _UNSAFE_LABEL.sub("_", label)[:40]
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.sampled:05d}-{label}.prof")
+        profile.dump_stats(path)
+        self.sampled += 1
+        self._files.append(path)
+        while len(self._files) > self.max_files:
+            old = self._files.pop(0)
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        return path
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.rate if self.enabled() else 0.0,
+            "until": self.until,
+            "directory": self.directory,
+            "sampled": self.sampled,
+            "files": list(self._files),
+        }